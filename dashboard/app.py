@@ -1,148 +1,226 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory
-import yaml
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort, g, has_request_context
+import base64
+import bisect
+import hmac
+import json
 import os
-from datetime import datetime, timedelta
+from contextvars import ContextVar
+from datetime import datetime
 from uuid import uuid4
 from functools import wraps
+from werkzeug.local import LocalProxy
+from werkzeug.utils import secure_filename
+
+import content_store
+import entity_ids
+import event_index
+import jobs
+import metrics
+import site_files
+import sites
+import storage
+import uploads
+from batch import BatchError, BatchOperations
+from dir_snapshot import DirectorySnapshot
+from entity_ids import EntityIds
+from event_index import EventIndex
+from image_variants import VariantPipeline
+from pdf_metadata import PdfMetadataCache
+from process_pool import ProcessPool
+from course_calendar import CourseCalendar, build_lecture_sequence, parse_date, shift_date
+from schedule_compiler import ScheduleCompiler
+from sqlite_store import SqliteStore, site_documents
+from usage_index import MaterialUsageIndex
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'  # Change this in production
 
 # Configuration
-SITE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(SITE_ROOT, '_data')
-CONFIG_FILE = os.path.join(SITE_ROOT, '_config.yml')
-UPLOAD_DIR = os.path.join(SITE_ROOT, 'static_files', 'uploads')
-HOME_MODULES_FILE = os.path.join(DATA_DIR, 'home_modules.yml')
-TEXTBOOKS_FILE = os.path.join(DATA_DIR, 'textbooks.yml')
-ASSIGNMENTS_FILE = os.path.join(DATA_DIR, 'assignments.yml')
+# DASHBOARD_SITE_ROOT points the dashboard at another copy of the site, and
+# DASHBOARD_SITES serves several course sites from this process instead,
+# each under /<name>/ or at <name>.DASHBOARD_SITES_DOMAIN; see sites.py.
+SITE_ROOT = os.environ.get('DASHBOARD_SITE_ROOT') or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SITE_ROOTS = sites.parse_sites(os.environ.get('DASHBOARD_SITES')) or {None: SITE_ROOT}
+SITES_DOMAIN = os.environ.get('DASHBOARD_SITES_DOMAIN')
+MAX_UPLOAD_PAGE_SIZE = 1000
 ALLOWED_EXTENSIONS = {'pdf', 'ppt', 'pptx', 'doc', 'docx', 'txt', 'jpg', 'png', 'gif'}
-PHOTO_UPLOAD_DIR = os.path.join(SITE_ROOT, '_images', 'pp')
 ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
-TEXTBOOK_UPLOAD_DIR = os.path.join(SITE_ROOT, '_images', 'textbook')
+# Pickled copies of parsed data files, so restarts skip YAML parsing. Jekyll
+# ignores dot-directories, so this stays out of the built site. Sidecars are
+# keyed by content, so all sites share the directory.
+YAML_SIDECAR_DIR = os.environ.get('DASHBOARD_YAML_CACHE_DIR') or os.path.join(SITE_ROOT, '.dashboard-cache', 'yaml')
+# DASHBOARD_STORAGE=sqlite keeps the course data of each site in a database
+# (.dashboard.sqlite3 in the site root, or DASHBOARD_SQLITE_PATH for a single
+# site) and exports the YAML files for Jekyll; see sqlite_store.py.
+STORAGE_ENGINE = os.environ.get('DASHBOARD_STORAGE', 'yaml').lower()
+SQLITE_DATABASE = os.environ.get('DASHBOARD_SQLITE_PATH')
+# Status of background jobs, shared by all workers so any of them can answer
+# a poll; see jobs.py.
+JOBS_DIR = os.environ.get('DASHBOARD_JOBS_DIR') or os.path.join(SITE_ROOT, '.dashboard-cache', 'jobs')
+JOB_WORKERS = int(os.environ.get('DASHBOARD_JOB_WORKERS', 2))
+# Lets a Prometheus server scrape /metrics with "Authorization: Bearer
+# <token>" instead of the login cookie.
+METRICS_TOKEN = os.environ.get('DASHBOARD_METRICS_TOKEN')
+# Thumbnail widths in pixels, by the Site attribute holding the directory;
+# profile photos are shown at up to 120px and covers at 120px wide, so these
+# cover 1x to 4x displays.
+IMAGE_VARIANT_WIDTHS = {
+    'photo_upload_dir': (128, 256, 512),
+    'textbook_upload_dir': (160, 320, 480),
+}
+
+# Cache-Control for files served under /site/, by path prefix relative to the
+# site root; the longest matching prefix wins. Everything is revalidated with
+# its ETag by default, so a replaced file shows up on the next request.
+SITE_CACHE_CONTROL = {
+    '_images/': 'private, max-age=300',
+}
+SITE_DEFAULT_CACHE_CONTROL = 'private, no-cache'
+
+INVALID_MATERIALS_MESSAGE = 'materials must be a list of objects with a name and a URL'
+
+# Lists of entries that carry stable ids, by the Site attribute of their
+# file, as (key, key of the entries' own list of entries); see entity_ids.py.
+ENTITY_LISTS = {
+    'schedule_file': [('lecture_sequence', 'materials')],
+    'additional_events_file': [('additional_events', 'materials')],
+    'home_modules_file': [('modules', None)],
+    'assignments_file': [('assignments', None)],
+    'textbooks_file': [('textbooks', None)],
+    'people_file': [('instructors', None), ('teaching_assistants', None)],
+}
 
 # Simple authentication (replace with proper auth in production)
 ADMIN_PASSWORD = "admin123"  # Change this!
 
+storage.set_sidecar_dir(YAML_SIDECAR_DIR)
+job_queue = jobs.JobQueue(JOBS_DIR, max_workers=JOB_WORKERS)
+# One pool of each kind for all sites, so more courses do not mean more
+# processes; see process_pool.py.
+image_pool = ProcessPool(max_workers=2)
+pdf_pool = ProcessPool(max_workers=1)
+# Background jobs run outside of requests and carry their site with them.
+_job_site = ContextVar('job_site', default=None)
+
+def current_site():
+    """The Site of the current request or job, or the only site outside of them."""
+    if _job_site.get() is not None:
+        return _job_site.get()
+    if has_request_context():
+        name = request.environ.get(sites.SITE_KEY)
+        if name in course_sites:
+            return course_sites[name]
+    elif len(course_sites) == 1:
+        return next(iter(course_sites.values()))
+    raise LookupError('No course site is selected')
+
+site = LocalProxy(current_site)
+
 def load_yaml_file(filename):
-    filepath = os.path.join(DATA_DIR, filename)
+    filepath = os.path.join(site.data_dir, filename)
     try:
-        with open(filepath, 'r', encoding='utf-8') as file:
-            return yaml.safe_load(file) or {}
+        return storage.load_yaml(filepath) or {}
     except FileNotFoundError:
         return {}
 
-def build_lecture_sequence(schedule_data):
-    sequence = schedule_data.get('lecture_sequence')
-    if sequence:
-        return sequence
-
-    class_days = schedule_data.get('course_schedule', {}).get('class_days', [])
-    day_order = [day.get('day') for day in class_days if day.get('day')]
-    if not day_order:
-        day_order = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-
-    sequence = []
-    for lecture_week in schedule_data.get('lectures', []):
-        for day in day_order:
-            if day in lecture_week and lecture_week[day]:
-                sequence.append({
-                    'topic': lecture_week[day].get('topic', 'TBD'),
-                    'materials': lecture_week[day].get('materials', [])
-                })
-
-    return sequence
-
 def save_yaml_file(filename, data):
-    filepath = os.path.join(DATA_DIR, filename)
-    with open(filepath, 'w', encoding='utf-8') as file:
-        yaml.dump(data, file, default_flow_style=False, allow_unicode=True, sort_keys=False)
+    filepath = os.path.join(site.data_dir, filename)
+    storage.save_yaml(filepath, data)
 
 def load_config():
     try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as file:
-            return yaml.safe_load(file)
+        return storage.load_yaml(site.config_file)
     except FileNotFoundError:
         return {}
 
+def get_url_context():
+    return site.url_context()
+
 def build_public_url(relative_path):
-    config = load_config()
-    base_url = (config.get('url') or '').rstrip('/')
-    base_path = (config.get('baseurl') or '').strip()
-    if base_path and not base_path.startswith('/'):
-        base_path = '/' + base_path
-    rel = relative_path if relative_path.startswith('/') else '/' + relative_path
-    if base_url:
-        return f"{base_url}{base_path}{rel}"
-    if base_path:
-        return f"{base_path}{rel}"
-    return rel
+    return get_url_context().public_url(relative_path)
 
 def get_public_base():
-    config = load_config()
-    base_url = (config.get('url') or '').rstrip('/')
-    base_path = (config.get('baseurl') or '').strip()
-    if base_path and not base_path.startswith('/'):
-        base_path = '/' + base_path
-    if base_url:
-        return f"{base_url}{base_path}"
-    return base_path or ''
+    return get_url_context().base
 
 def get_public_root():
-    config = load_config()
-    return (config.get('url') or '').rstrip('/')
+    return get_url_context().root
 
 def normalize_material_url(raw_url):
-    if not raw_url:
-        return raw_url
-    url = raw_url.strip()
-    public_base = get_public_base().rstrip('/')
-    public_root = get_public_root().rstrip('/')
-    if url.startswith('http://') or url.startswith('https://'):
-        if public_base and public_root and url.startswith(public_root) and not url.startswith(public_base):
-            rel = url[len(public_root):]
-            if not rel.startswith('/'):
-                rel = '/' + rel
-            return f"{public_base}{rel}"
-        return url
-    if url.startswith('/static_files/') or url.startswith('static_files/'):
-        rel = url if url.startswith('/') else f"/{url}"
-        return f"{public_base}{rel}" if public_base else rel
-    return url
+    return get_url_context().normalize(raw_url)
+
+def valid_materials(raw_materials):
+    """Whether raw_materials, from a request, is a list of materials normalize_materials() can read."""
+    return isinstance(raw_materials, list) and all(
+        isinstance(m, dict) and isinstance(m.get('url') or '', str) for m in raw_materials
+    )
+
+def normalize_materials(raw_materials):
+    urls = get_url_context().normalize_all(m.get('url', '') for m in raw_materials)
+    return [
+        entity_ids.keep_id(m, {'name': m.get('name'), 'url': url})
+        for m, url in zip(raw_materials, urls)
+    ]
+
+def find_item(path, items, values, id_field='id', index_field='index'):
+    """Position in items, an entity list of the file at path, of the entry a request names, or None.
+
+    values is the request's form or JSON. Its id_field names the entry by
+    id, which still finds it after the list changed; without one,
+    index_field gives its position.
+    """
+    entity_id = values.get(id_field)
+    if entity_id:
+        if not isinstance(entity_id, str):
+            return None
+        return entity_ids.find(items, entity_id, site.entity_ids.position(path, entity_id))
+    try:
+        index = int(values.get(index_field))
+    except (TypeError, ValueError):
+        return None
+    return index if 0 <= index < len(items) else None
 
 def load_home_modules():
-    if not os.path.exists(HOME_MODULES_FILE):
+    try:
+        return storage.load_yaml(site.home_modules_file) or {'modules': []}
+    except FileNotFoundError:
         return {'modules': []}
-    with open(HOME_MODULES_FILE, 'r', encoding='utf-8') as file:
-        return yaml.safe_load(file) or {'modules': []}
 
 def save_home_modules(data):
-    with open(HOME_MODULES_FILE, 'w', encoding='utf-8') as file:
-        yaml.dump(data, file, default_flow_style=False, allow_unicode=True, sort_keys=False)
+    storage.save_yaml(site.home_modules_file, data)
 
 def load_textbooks():
-    if not os.path.exists(TEXTBOOKS_FILE):
+    try:
+        return storage.load_yaml(site.textbooks_file) or {'textbooks': []}
+    except FileNotFoundError:
         return {'textbooks': []}
-    with open(TEXTBOOKS_FILE, 'r', encoding='utf-8') as file:
-        return yaml.safe_load(file) or {'textbooks': []}
 
 def save_textbooks(data):
-    with open(TEXTBOOKS_FILE, 'w', encoding='utf-8') as file:
-        yaml.dump(data, file, default_flow_style=False, allow_unicode=True, sort_keys=False)
+    storage.save_yaml(site.textbooks_file, data)
 
 def load_assignments():
-    if not os.path.exists(ASSIGNMENTS_FILE):
+    try:
+        return storage.load_yaml(site.assignments_file) or {'intro': '', 'assignments': []}
+    except FileNotFoundError:
         return {'intro': '', 'assignments': []}
-    with open(ASSIGNMENTS_FILE, 'r', encoding='utf-8') as file:
-        return yaml.safe_load(file) or {'intro': '', 'assignments': []}
 
 def save_assignments(data):
-    with open(ASSIGNMENTS_FILE, 'w', encoding='utf-8') as file:
-        yaml.dump(data, file, default_flow_style=False, allow_unicode=True, sort_keys=False)
+    storage.save_yaml(site.assignments_file, data)
 
 def save_config(data):
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as file:
-        yaml.dump(data, file, default_flow_style=False, allow_unicode=True, sort_keys=False)
+    storage.save_yaml(site.config_file, data)
+
+def warm_caches():
+    for course in course_sites.values():
+        if os.path.isdir(course.data_dir):
+            for filename in os.listdir(course.data_dir):
+                if filename.endswith('.yml'):
+                    try:
+                        storage.load_yaml(os.path.join(course.data_dir, filename))
+                    except FileNotFoundError:
+                        pass
+        course.url_context()
+        course.material_usage.refresh()
+        course.schedule_compiler.compile()
 
 def require_auth(f):
     @wraps(f)
@@ -152,6 +230,96 @@ def require_auth(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def with_file_locks(*files):
+    """Hold the locks on the current site's files, named by their Site attributes."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with storage.locked(*(getattr(site, name) for name in files)):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def submit_job(kind, function, *args):
+    """Queue function(job, *args) to run in the background for the current site."""
+    course = current_site()
+
+    def run(job, *args):
+        token = _job_site.set(course)
+        try:
+            return function(job, *args)
+        finally:
+            _job_site.reset(token)
+    return job_queue.submit(kind, run, *args, site=course.name)
+
+def job_response(job, message):
+    return jsonify({
+        'success': True,
+        'message': message,
+        'job': job,
+        'status_url': url_for('job_status', job_id=job['id'])
+    }), 202
+
+def read_reorder_request():
+    data = request.get_json(silent=True)
+    if data is None:
+        data = request.form.to_dict()
+        if 'order' in data:
+            data['order'] = data['order'].split(',')
+    return data
+
+def reorder_items(items, label, path):
+    """Rearrange items, an entity list of the file at path, as the request asks, in a single step.
+
+    The request carries either "order", the ids of all items (or, from
+    clients without ids, their current indexes) in their new order, or the
+    item to move and the "to" index it should end up at. The item is named
+    by its "id" or by its "from" index. An optional "count" is the length of
+    the list the client was showing. If the list has changed since, an id
+    is gone or the ids of "order" are not those of the list, the request is
+    refused so a stale page cannot shuffle the wrong items. Returns
+    (reordered, error_response).
+    """
+    data = read_reorder_request()
+    changed = jsonify({
+        'success': False,
+        'message': f'The {label} list has changed. Reload the page and try again.'
+    }), 409
+    try:
+        if data.get('count') is not None and int(data['count']) != len(items):
+            return None, changed
+        if 'order' in data:
+            order = data['order']
+            if not isinstance(order, list):
+                raise ValueError('order is not a list')
+            positions = {
+                item['id']: position for position, item in enumerate(items)
+                if isinstance(item, dict) and isinstance(item.get('id'), str)
+            }
+            if any(isinstance(entry, str) and (entry in positions or not entry.isdigit()) for entry in order):
+                if len(order) != len(items) or set(order) != set(positions) or len(positions) != len(items):
+                    return None, changed
+                return [items[positions[entity_id]] for entity_id in order], None
+            order = [int(index) for index in order]
+            if sorted(order) != list(range(len(items))):
+                raise ValueError('order is not a permutation')
+            return [items[index] for index in order], None
+        if data.get('id'):
+            source = find_item(path, items, data)
+            if source is None:
+                return None, changed
+        else:
+            source = int(data['from'])
+        target = int(data['to'])
+        if not (0 <= source < len(items) and 0 <= target < len(items)):
+            raise ValueError('index out of range')
+    except (KeyError, TypeError, ValueError):
+        return None, (jsonify({'success': False, 'message': f'Invalid {label} order'}), 400)
+
+    reordered = list(items)
+    reordered.insert(target, reordered.pop(source))
+    return reordered, None
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -183,7 +351,7 @@ def get_material_relative_path(filename):
     return f'/static_files/uploads/{filename}'
 
 def get_material_absolute_path(filename):
-    return os.path.join(UPLOAD_DIR, filename)
+    return os.path.join(site.upload_dir, filename)
 
 def get_material_public_url(filename):
     return build_public_url(get_material_relative_path(filename))
@@ -197,67 +365,129 @@ def iter_material_references(container):
             if url:
                 yield material, url
 
-def get_material_url_variants(filename):
-    relative_path = get_material_relative_path(filename)
-    public_url = build_public_url(relative_path)
-    public_root = get_public_root().rstrip('/')
+def get_material_url_variants(filename, url_context=None):
+    url_context = url_context or get_url_context()
+    return url_context.url_variants(get_material_relative_path(filename))
 
-    variants = {relative_path, public_url}
-    if public_root:
-        variants.add(f"{public_root}{relative_path}")
-    return {variant for variant in variants if variant}
+def lecture_usage_sources(schedule_data):
+    return [
+        ('lecture', lecture.get('topic', f'Lecture {lecture_idx + 1}'),
+         tuple(material.get('url', '') for material in lecture.get('materials', []) or []))
+        for lecture_idx, lecture in enumerate(build_lecture_sequence(schedule_data))
+    ]
 
-def build_material_usage_index():
-    usage_index = {}
-    schedule_data = load_yaml_file('course_schedule.yml')
-    for lecture_idx, lecture in enumerate(build_lecture_sequence(schedule_data)):
-        lecture_label = lecture.get('topic', f'Lecture {lecture_idx + 1}')
-        grouped = {}
-        for material in lecture.get('materials', []) or []:
-            normalized = normalize_material_url(material.get('url', ''))
-            if not normalized:
-                continue
-            grouped[normalized] = grouped.get(normalized, 0) + 1
-        for normalized, count in grouped.items():
-            items = usage_index.setdefault(normalized, [])
-            items.append({
-                'type': 'lecture',
-                'label': lecture_label,
-                'count': count
-            })
+def event_usage_sources(additional_events_data):
+    return [
+        ('event', event.get('topic', 'Untitled Event'),
+         tuple(material.get('url', '') for material in event.get('materials', []) or []))
+        for event in additional_events_data.get('additional_events', []) or []
+    ]
 
-    additional_events_data = load_yaml_file('additional_events.yml')
-    for event in additional_events_data.get('additional_events', []) or []:
-        event_label = event.get('topic', 'Untitled Event')
-        grouped = {}
-        for material in event.get('materials', []) or []:
-            normalized = normalize_material_url(material.get('url', ''))
-            if not normalized:
-                continue
-            grouped[normalized] = grouped.get(normalized, 0) + 1
-        for normalized, count in grouped.items():
-            items = usage_index.setdefault(normalized, [])
-            items.append({
-                'type': 'event',
-                'label': event_label,
-                'count': count
+def open_site(name, root):
+    """Return a Site for the course at root with its caches and indexes set up."""
+    course = sites.Site(name, root)
+    course.sqlite_store = None
+    if STORAGE_ENGINE == 'sqlite':
+        database = (SQLITE_DATABASE if name is None else None) or os.path.join(root, '.dashboard.sqlite3')
+        course.sqlite_store = SqliteStore(database, site_documents(course.data_dir))
+        course.sqlite_store.open()
+        storage.add_engine(course.sqlite_store)
+
+    course.entity_ids = EntityIds({getattr(course, name): lists for name, lists in ENTITY_LISTS.items()})
+    course.upload_snapshot = DirectorySnapshot(course.upload_dir, allowed_file)
+    course.pdf_metadata_cache = PdfMetadataCache(course.upload_dir, pdf_pool)
+    course.image_pipeline = VariantPipeline(
+        root, course.image_variants_file,
+        {getattr(course, directory): widths for directory, widths in IMAGE_VARIANT_WIDTHS.items()},
+        allowed_image_file, image_pool
+    )
+    course.event_index = EventIndex(
+        course.additional_events_file, lambda: storage.load_yaml(course.additional_events_file)
+    )
+    course.material_usage = MaterialUsageIndex(
+        {
+            course.schedule_file: lecture_usage_sources,
+            course.additional_events_file: event_usage_sources
+        },
+        storage.load_yaml,
+        course.url_context
+    )
+    # With the SQLite engine the schedule is recompiled when the YAML files
+    # are exported rather than on every save.
+    course.schedule_compiler = ScheduleCompiler(
+        course.schedule_file, course.additional_events_file, course.generated_schedule_file,
+        compile_on_save=course.sqlite_store is None
+    )
+    if course.sqlite_store is not None:
+        course.sqlite_store.add_export_listener(course.schedule_compiler.sources_changed)
+    return course
+
+course_sites = {name: open_site(name, root) for name, root in SITE_ROOTS.items()}
+if None not in course_sites:
+    app.wsgi_app = sites.SiteDispatcher(app.wsgi_app, course_sites, SITES_DOMAIN)
+
+@app.template_global()
+def image_variant(path, width):
+    """Site path of the smallest WebP variant at least width pixels wide, or path itself."""
+    if not path:
+        return path
+    # Pages show many images, so the data file is loaded once per request.
+    if 'image_manifest' not in g:
+        g.image_manifest = site.image_pipeline.manifest()
+    entry = site.image_pipeline.lookup(path, g.image_manifest)
+    if not entry or not entry.get('webp'):
+        return path
+    for variant in entry['webp']:
+        if variant['width'] >= width:
+            return variant['path']
+    return entry['webp'][-1]['path']
+
+def cache_counts(counts):
+    """Sum the (hits, misses) counts(course) of every site's cache."""
+    totals = [counts(course) for course in course_sites.values()]
+    return sum(hits for hits, _ in totals), sum(misses for _, misses in totals)
+
+metrics_registry = metrics.Registry(os.path.commonpath(list(SITE_ROOTS.values())))
+metrics.instrument(app, metrics_registry)
+metrics_registry.add_cache('upload_listing', lambda: cache_counts(
+    lambda course: (course.upload_snapshot.hits, course.upload_snapshot.scans)))
+metrics_registry.add_cache('material_usage', lambda: cache_counts(
+    lambda course: (course.material_usage.hits, course.material_usage.rebuilds)))
+
+# Endpoints that work without a course site, e.g. at the root of a
+# multi-course dashboard.
+SITELESS_ENDPOINTS = {'metrics_endpoint', 'static', 'login', 'logout'}
+
+@app.before_request
+def require_site():
+    if request.environ.get(sites.SITE_KEY) in course_sites or request.endpoint in SITELESS_ENDPOINTS:
+        return None
+    if request.path == '/':
+        # The course list names every course, so it is only shown after login.
+        if 'authenticated' not in request.cookies:
+            return redirect(url_for('login'))
+        courses = []
+        for name, course in sorted(course_sites.items()):
+            try:
+                config = storage.load_yaml(course.config_file) or {}
+            except FileNotFoundError:
+                config = {}
+            courses.append({
+                'name': name,
+                'title': config.get('course_name') or name,
+                'url': f'{request.script_root}/{name}/'
             })
+        return render_template('sites.html', courses=courses)
+    abort(404)
 
-    return usage_index
-
-def find_material_usages(filename, usage_index=None):
-    variants = get_material_url_variants(filename)
-    if usage_index is None:
-        usage_index = build_material_usage_index()
-
-    usages = []
-    for variant in variants:
-        usages.extend(usage_index.get(variant, []))
-    return usages
+def find_material_usages(filename, url_context=None, refresh=True):
+    variants = get_material_url_variants(filename, url_context)
+    return site.material_usage.lookup(variants, refresh=refresh)
 
 def replace_material_references(old_filename, new_filename):
-    old_variants = get_material_url_variants(old_filename)
-    new_url = get_material_public_url(new_filename)
+    url_context = get_url_context()
+    old_variants = get_material_url_variants(old_filename, url_context)
+    new_url = url_context.public_url(get_material_relative_path(new_filename))
     updated = 0
 
     schedule_data = load_yaml_file('course_schedule.yml')
@@ -265,7 +495,7 @@ def replace_material_references(old_filename, new_filename):
     changed = False
     for lecture in sequence:
         for material in lecture.get('materials', []) or []:
-            if normalize_material_url(material.get('url', '')) in old_variants:
+            if url_context.normalize(material.get('url', '')) in old_variants:
                 material['url'] = new_url
                 updated += 1
                 changed = True
@@ -277,7 +507,7 @@ def replace_material_references(old_filename, new_filename):
     changed = False
     for event in additional_events_data.get('additional_events', []) or []:
         for material in event.get('materials', []) or []:
-            if normalize_material_url(material.get('url', '')) in old_variants:
+            if url_context.normalize(material.get('url', '')) in old_variants:
                 material['url'] = new_url
                 updated += 1
                 changed = True
@@ -287,7 +517,8 @@ def replace_material_references(old_filename, new_filename):
     return updated
 
 def remove_material_references(filename):
-    variants = get_material_url_variants(filename)
+    url_context = get_url_context()
+    variants = get_material_url_variants(filename, url_context)
     removed = 0
 
     schedule_data = load_yaml_file('course_schedule.yml')
@@ -297,7 +528,7 @@ def remove_material_references(filename):
         materials = lecture.get('materials', []) or []
         filtered = []
         for material in materials:
-            if normalize_material_url(material.get('url', '')) in variants:
+            if url_context.normalize(material.get('url', '')) in variants:
                 removed += 1
                 changed = True
             else:
@@ -313,7 +544,7 @@ def remove_material_references(filename):
         materials = event.get('materials', []) or []
         filtered = []
         for material in materials:
-            if normalize_material_url(material.get('url', '')) in variants:
+            if url_context.normalize(material.get('url', '')) in variants:
                 removed += 1
                 changed = True
             else:
@@ -324,32 +555,179 @@ def remove_material_references(filename):
 
     return removed
 
-def collect_uploaded_files():
-    files = []
-    if not os.path.exists(UPLOAD_DIR):
-        return files
-
-    usage_index = build_material_usage_index()
-
-    for filename in os.listdir(UPLOAD_DIR):
-        file_path = get_material_absolute_path(filename)
-        if not os.path.isfile(file_path) or not allowed_file(filename):
-            continue
-
-        stat = os.stat(file_path)
-        usages = find_material_usages(filename, usage_index=usage_index)
-        files.append({
+def material_conflict_response(filename):
+    return jsonify({
+        'success': False,
+        'conflict': True,
+        'message': f'"{filename}" already exists. Confirm overwrite to replace it.',
+        'existing_file': {
             'name': filename,
             'path': get_material_relative_path(filename),
             'url': get_material_public_url(filename),
-            'size': stat.st_size,
-            'modified_at': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds'),
-            'usage_count': sum(item['count'] for item in usages),
-            'usages': usages
-        })
+            'usages': find_material_usages(filename)
+        }
+    }), 409
+
+def upload_error_response(error):
+    payload = {'success': False, 'message': error.message}
+    if error.offset is not None:
+        payload['offset'] = error.offset
+    return jsonify(payload), error.status
+
+def store_material_file(source_path, filename, digest=None):
+    stored = content_store.store(site.upload_dir, source_path, filename, allowed_file, digest)
+    site.pdf_metadata_cache.queue(filename, stored['sha256'])
+    return stored
+
+def upload_success_message(overwritten, stored):
+    message = 'File overwritten successfully' if overwritten else 'File uploaded successfully'
+    if stored['duplicate_of']:
+        names = ', '.join(f'"{name}"' for name in stored['duplicate_of'])
+        message += f'. Identical to {names}; stored once on disk'
+    return message
+
+# "mtime" sorts by upload time rather than the inode's mtime, which a
+# deduplicated upload shares with the older file it links to.
+UPLOAD_SORT_KEYS = {
+    'name': (lambda name, stat, usage_count, uploaded_ns: name.lower(), False),
+    'size': (lambda name, stat, usage_count, uploaded_ns: stat.st_size, True),
+    'mtime': (lambda name, stat, usage_count, uploaded_ns: uploaded_ns, True),
+    'usage': (lambda name, stat, usage_count, uploaded_ns: usage_count, True)
+}
+UPLOAD_SORT_KEY_TYPES = {'name': str, 'size': int, 'mtime': int, 'usage': int}
+
+def encode_upload_cursor(sort, descending, key, name):
+    payload = json.dumps([sort, descending, key, name], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_upload_cursor(cursor, sort, descending):
+    try:
+        cursor_sort, cursor_descending, key, name = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort or cursor_descending != descending:
+        raise ValueError('Cursor does not match the requested sort order')
+    # The key is compared against the sorted keys, so it must be of their type.
+    key_type = UPLOAD_SORT_KEY_TYPES[sort]
+    if not isinstance(key, key_type) or isinstance(key, bool) or not isinstance(name, str):
+        raise ValueError('Invalid cursor')
+    return (key, name)
+
+def upload_totals(snapshot):
+    logical_bytes = 0
+    physical_bytes = 0
+    seen_inodes = set()
+    for stat in snapshot.files.values():
+        logical_bytes += stat.st_size
+        if (stat.st_dev, stat.st_ino) not in seen_inodes:
+            seen_inodes.add((stat.st_dev, stat.st_ino))
+            physical_bytes += stat.st_size
+    return logical_bytes, physical_bytes
+
+def pdf_summary(metadata):
+    if metadata is None:
+        return None
+    return {
+        'pages': metadata['pages'],
+        'title': metadata['title'],
+        'preview_url': url_for('pdf_preview', digest=metadata['sha256']) if metadata['preview'] else None,
+        'error': metadata['error']
+    }
 
-    files.sort(key=lambda item: item['modified_at'], reverse=True)
-    return files
+def collect_uploaded_files(sort='mtime', descending=None, prefix='', extensions=None,
+                           unused_only=False, cursor=None, limit=None, include_usages=True):
+    files = []
+    listing = {'files': files, 'total': 0, 'next_cursor': None, 'logical_bytes': 0, 'physical_bytes': 0, 'pdf_pending': 0}
+    snapshot = site.upload_snapshot.listing()
+    if not snapshot.files:
+        return listing
+
+    sort_key, default_descending = UPLOAD_SORT_KEYS[sort]
+    descending = default_descending if descending is None else descending
+    after = decode_upload_cursor(cursor, sort, descending) if cursor else None
+    prefix = (prefix or '').lower()
+    listing['logical_bytes'], listing['physical_bytes'] = snapshot.memo('totals', lambda: upload_totals(snapshot))
+    uploaded = snapshot.memo('uploaded', lambda: content_store.upload_times(site.upload_dir, snapshot.files))
+
+    url_context = get_url_context()
+    site.material_usage.refresh()
+
+    def matches(filename):
+        if prefix and not filename.lower().startswith(prefix):
+            return False
+        return not extensions or filename.rsplit('.', 1)[1].lower() in extensions
+
+    usages_by_name = {}
+    if sort == 'usage' or unused_only:
+        # Usage counts come from the usage index, which changes independently
+        # of the directory, so this order is computed per request.
+        ordered = []
+        for filename, stat in snapshot.files.items():
+            if not matches(filename):
+                continue
+            usages = find_material_usages(filename, url_context=url_context, refresh=False)
+            usage_count = sum(item['count'] for item in usages)
+            if unused_only and usage_count:
+                continue
+            usages_by_name[filename] = usages
+            ordered.append((sort_key(filename, stat, usage_count, uploaded[filename]), filename))
+        ordered.sort()
+        keys = ordered
+        listing['total'] = len(ordered)
+    else:
+        keys = snapshot.memo(('sorted', sort), lambda: sorted(
+            (sort_key(filename, stat, 0, uploaded[filename]), filename) for filename, stat in snapshot.files.items()
+        ))
+        listing['total'] = len(keys) if not (prefix or extensions) else sum(
+            1 for _, filename in keys if matches(filename)
+        )
+
+    if descending:
+        end = bisect.bisect_left(keys, after) if after is not None else len(keys)
+        positions = range(end - 1, -1, -1)
+    else:
+        start = bisect.bisect_right(keys, after) if after is not None else 0
+        positions = range(start, len(keys))
+
+    page = []
+    has_more = False
+    for position in positions:
+        key, filename = keys[position]
+        if filename not in usages_by_name and not matches(filename):
+            continue
+        if limit is not None and len(page) == limit:
+            has_more = True
+            break
+        page.append((key, filename))
+
+    pdf_found, pdf_pending = site.pdf_metadata_cache.metadata_for(snapshot)
+    listing['pdf_pending'] = len(pdf_pending)
+
+    for key, filename in page:
+        stat = snapshot.files[filename]
+        relative_path = get_material_relative_path(filename)
+        file_info = {
+            'name': filename,
+            'path': relative_path,
+            'url': url_context.public_url(relative_path),
+            'size': stat.st_size,
+            'links': stat.st_nlink,
+            'modified_at': datetime.fromtimestamp(uploaded[filename] / 1e9).isoformat(timespec='seconds')
+        }
+        if include_usages:
+            usages = usages_by_name.get(filename)
+            if usages is None:
+                usages = find_material_usages(filename, url_context=url_context, refresh=False)
+            file_info['usage_count'] = sum(item['count'] for item in usages)
+            file_info['usages'] = usages
+        if filename.lower().endswith('.pdf'):
+            file_info['pdf'] = pdf_summary(pdf_found.get(filename))
+        files.append(file_info)
+
+    if has_more:
+        key, filename = page[-1]
+        listing['next_cursor'] = encode_upload_cursor(sort, descending, key, filename)
+    return listing
 
 @app.route('/')
 @require_auth
@@ -380,16 +758,17 @@ def logout():
 @require_auth
 def schedule():
     schedule_data = load_yaml_file('course_schedule.yml')
-    additional_events_data = load_yaml_file('additional_events.yml')
     
     # Merge the data for the template
     if not schedule_data.get('lecture_sequence') and schedule_data.get('lectures'):
-        schedule_data['lecture_sequence'] = build_lecture_sequence(schedule_data)
-        save_yaml_file('course_schedule.yml', schedule_data)
+        with storage.locked(site.schedule_file):
+            schedule_data = load_yaml_file('course_schedule.yml')
+            if not schedule_data.get('lecture_sequence') and schedule_data.get('lectures'):
+                schedule_data['lecture_sequence'] = build_lecture_sequence(schedule_data)
+                save_yaml_file('course_schedule.yml', schedule_data)
 
     merged_data = schedule_data.copy()
     merged_data['lecture_sequence'] = build_lecture_sequence(schedule_data)
-    merged_data['additional_events'] = additional_events_data.get('additional_events', [])
     
     return render_template(
         'schedule.html',
@@ -400,6 +779,7 @@ def schedule():
 
 @app.route('/schedule/add_lecture', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file')
 def add_lecture():
     topic = request.form['topic']
     
@@ -418,22 +798,26 @@ def add_lecture():
 
 @app.route('/schedule/add_material', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file')
 def add_material():
-    lecture_index = int(request.form['lecture_index'])
     material_name = request.form['material_name']
     material_url = normalize_material_url(request.form['material_url'])
     
     schedule_data = load_yaml_file('course_schedule.yml')
 
     sequence = build_lecture_sequence(schedule_data)
-    if 0 <= lecture_index < len(sequence):
-        if 'materials' not in sequence[lecture_index]:
-            sequence[lecture_index]['materials'] = []
-        sequence[lecture_index]['materials'].append({
-            'name': material_name,
-            'url': material_url
-        })
-        schedule_data['lecture_sequence'] = sequence
+    lecture_index = find_item(site.schedule_file, sequence, request.form, 'lecture_id', 'lecture_index')
+    if lecture_index is None:
+        flash('Lecture not found.', 'error')
+        return redirect(url_for('schedule'))
+
+    if 'materials' not in sequence[lecture_index]:
+        sequence[lecture_index]['materials'] = []
+    sequence[lecture_index]['materials'].append({
+        'name': material_name,
+        'url': material_url
+    })
+    schedule_data['lecture_sequence'] = sequence
 
     save_yaml_file('course_schedule.yml', schedule_data)
     flash('Added material to lecture!', 'success')
@@ -453,6 +837,7 @@ def home():
 
 @app.route('/home/add_module', methods=['POST'])
 @require_auth
+@with_file_locks('home_modules_file')
 def add_home_module():
     module_type = request.form['module_type']
     title = request.form.get('title', '').strip()
@@ -472,8 +857,8 @@ def add_home_module():
 
 @app.route('/home/update_module', methods=['POST'])
 @require_auth
+@with_file_locks('home_modules_file')
 def update_home_module():
-    index = int(request.form['index'])
     module_type = request.form['module_type']
     title = request.form.get('title', '').strip()
     body = request.form.get('body', '').strip()
@@ -481,12 +866,13 @@ def update_home_module():
     modules_data = load_home_modules()
     modules = modules_data.get('modules', [])
 
-    if 0 <= index < len(modules):
-        modules[index] = {
+    index = find_item(site.home_modules_file, modules, request.form)
+    if index is not None:
+        modules[index] = entity_ids.keep_id(modules[index], {
             'type': module_type,
             'title': title,
             'body': body
-        }
+        })
         modules_data['modules'] = modules
         save_home_modules(modules_data)
         flash('Home module updated successfully!', 'success')
@@ -497,12 +883,13 @@ def update_home_module():
 
 @app.route('/home/delete_module', methods=['POST'])
 @require_auth
+@with_file_locks('home_modules_file')
 def delete_home_module():
-    index = int(request.form['index'])
     modules_data = load_home_modules()
     modules = modules_data.get('modules', [])
 
-    if 0 <= index < len(modules):
+    index = find_item(site.home_modules_file, modules, request.form)
+    if index is not None:
         modules.pop(index)
         modules_data['modules'] = modules
         save_home_modules(modules_data)
@@ -514,13 +901,14 @@ def delete_home_module():
 
 @app.route('/home/move_module', methods=['POST'])
 @require_auth
+@with_file_locks('home_modules_file')
 def move_home_module():
-    index = int(request.form['index'])
     direction = request.form.get('direction')
     modules_data = load_home_modules()
     modules = modules_data.get('modules', [])
 
-    if not (0 <= index < len(modules)):
+    index = find_item(site.home_modules_file, modules, request.form)
+    if index is None:
         flash('Module not found.', 'error')
         return redirect(url_for('home'))
 
@@ -542,9 +930,13 @@ def materials():
 @app.route('/material-library')
 @require_auth
 def material_library():
+    listing = collect_uploaded_files()
     return render_template(
         'material_library.html',
-        uploaded_files=collect_uploaded_files(),
+        uploaded_files=listing['files'],
+        logical_bytes=listing['logical_bytes'],
+        physical_bytes=listing['physical_bytes'],
+        pdf_pending=listing['pdf_pending'],
         public_base=get_public_base(),
         public_root=get_public_root()
     )
@@ -561,6 +953,7 @@ def assignments():
 
 @app.route('/assignments/update_intro', methods=['POST'])
 @require_auth
+@with_file_locks('assignments_file')
 def update_assignments_intro():
     data = load_assignments()
     data['intro'] = request.form.get('intro', '').strip()
@@ -568,8 +961,21 @@ def update_assignments_intro():
     flash('Assignments intro updated successfully!', 'success')
     return redirect(url_for('assignments'))
 
+@app.route('/home/reorder_modules', methods=['POST'])
+@require_auth
+@with_file_locks('home_modules_file')
+def reorder_home_modules():
+    modules_data = load_home_modules()
+    modules, error = reorder_items(modules_data.get('modules', []), 'module', site.home_modules_file)
+    if error:
+        return error
+    modules_data['modules'] = modules
+    save_home_modules(modules_data)
+    return jsonify({'success': True, 'message': 'Modules reordered'})
+
 @app.route('/assignments/add', methods=['POST'])
 @require_auth
+@with_file_locks('assignments_file')
 def add_assignment():
     data = load_assignments()
     items = data.get('assignments', [])
@@ -585,16 +991,17 @@ def add_assignment():
 
 @app.route('/assignments/update', methods=['POST'])
 @require_auth
+@with_file_locks('assignments_file')
 def update_assignment():
-    index = int(request.form['index'])
     data = load_assignments()
     items = data.get('assignments', [])
-    if 0 <= index < len(items):
-        items[index] = {
+    index = find_item(site.assignments_file, items, request.form)
+    if index is not None:
+        items[index] = entity_ids.keep_id(items[index], {
             'title': request.form['title'],
             'link': request.form.get('link', ''),
             'description': request.form.get('description', '')
-        }
+        })
         data['assignments'] = items
         save_assignments(data)
         flash('Assignment updated successfully!', 'success')
@@ -604,11 +1011,12 @@ def update_assignment():
 
 @app.route('/assignments/delete', methods=['POST'])
 @require_auth
+@with_file_locks('assignments_file')
 def delete_assignment():
-    index = int(request.form['index'])
     data = load_assignments()
     items = data.get('assignments', [])
-    if 0 <= index < len(items):
+    index = find_item(site.assignments_file, items, request.form)
+    if index is not None:
         items.pop(index)
         data['assignments'] = items
         save_assignments(data)
@@ -619,13 +1027,14 @@ def delete_assignment():
 
 @app.route('/assignments/move', methods=['POST'])
 @require_auth
+@with_file_locks('assignments_file')
 def move_assignment():
-    index = int(request.form['index'])
     direction = request.form.get('direction')
     data = load_assignments()
     items = data.get('assignments', [])
 
-    if not (0 <= index < len(items)):
+    index = find_item(site.assignments_file, items, request.form)
+    if index is None:
         flash('Assignment not found.', 'error')
         return redirect(url_for('assignments'))
 
@@ -638,8 +1047,21 @@ def move_assignment():
     save_assignments(data)
     return redirect(url_for('assignments'))
 
+@app.route('/assignments/reorder', methods=['POST'])
+@require_auth
+@with_file_locks('assignments_file')
+def reorder_assignments():
+    data = load_assignments()
+    items, error = reorder_items(data.get('assignments', []), 'assignment', site.assignments_file)
+    if error:
+        return error
+    data['assignments'] = items
+    save_assignments(data)
+    return jsonify({'success': True, 'message': 'Assignments reordered'})
+
 @app.route('/materials/add_textbook', methods=['POST'])
 @require_auth
+@with_file_locks('textbooks_file')
 def add_textbook():
     textbooks_data = load_textbooks()
     textbooks = textbooks_data.get('textbooks', [])
@@ -660,13 +1082,14 @@ def add_textbook():
 
 @app.route('/materials/update_textbook', methods=['POST'])
 @require_auth
+@with_file_locks('textbooks_file')
 def update_textbook():
-    index = int(request.form['index'])
     textbooks_data = load_textbooks()
     textbooks = textbooks_data.get('textbooks', [])
 
-    if 0 <= index < len(textbooks):
-        textbooks[index] = {
+    index = find_item(site.textbooks_file, textbooks, request.form)
+    if index is not None:
+        textbooks[index] = entity_ids.keep_id(textbooks[index], {
             'title': request.form['title'],
             'author': request.form['author'],
             'publisher': request.form.get('publisher', ''),
@@ -675,7 +1098,7 @@ def update_textbook():
             'link': request.form.get('link', ''),
             'link_text': request.form.get('link_text', ''),
             'cover_image': request.form.get('cover_image', '')
-        }
+        })
         textbooks_data['textbooks'] = textbooks
         save_textbooks(textbooks_data)
         flash('Textbook updated successfully!', 'success')
@@ -686,12 +1109,13 @@ def update_textbook():
 
 @app.route('/materials/delete_textbook', methods=['POST'])
 @require_auth
+@with_file_locks('textbooks_file')
 def delete_textbook():
-    index = int(request.form['index'])
     textbooks_data = load_textbooks()
     textbooks = textbooks_data.get('textbooks', [])
 
-    if 0 <= index < len(textbooks):
+    index = find_item(site.textbooks_file, textbooks, request.form)
+    if index is not None:
         textbooks.pop(index)
         textbooks_data['textbooks'] = textbooks
         save_textbooks(textbooks_data)
@@ -701,6 +1125,18 @@ def delete_textbook():
 
     return redirect(url_for('materials'))
 
+@app.route('/materials/reorder_textbooks', methods=['POST'])
+@require_auth
+@with_file_locks('textbooks_file')
+def reorder_textbooks():
+    textbooks_data = load_textbooks()
+    textbooks, error = reorder_items(textbooks_data.get('textbooks', []), 'textbook', site.textbooks_file)
+    if error:
+        return error
+    textbooks_data['textbooks'] = textbooks
+    save_textbooks(textbooks_data)
+    return jsonify({'success': True, 'message': 'Textbooks reordered'})
+
 @app.route('/materials/upload_cover', methods=['POST'])
 @require_auth
 def upload_cover():
@@ -716,21 +1152,25 @@ def upload_cover():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
         filename = timestamp + filename
 
-        os.makedirs(TEXTBOOK_UPLOAD_DIR, exist_ok=True)
-        file_path = os.path.join(TEXTBOOK_UPLOAD_DIR, filename)
+        os.makedirs(site.textbook_upload_dir, exist_ok=True)
+        file_path = os.path.join(site.textbook_upload_dir, filename)
         file.save(file_path)
+        variants = site.image_pipeline.submit(file_path)
 
         relative_path = f'/_images/textbook/{filename}'
         return jsonify({
             'success': True,
             'message': 'Cover uploaded successfully',
-            'file_path': relative_path
+            'file_path': relative_path,
+            'variants': variants['variants'],
+            'variants_status': variants['status']
         })
 
     return jsonify({'success': False, 'message': 'Invalid file type'})
 
 @app.route('/people/add_instructor', methods=['POST'])
 @require_auth
+@with_file_locks('people_file')
 def add_instructor():
     instructor_data = {
         'name': request.form['name'],
@@ -753,13 +1193,14 @@ def add_instructor():
 
 @app.route('/people/update_instructor', methods=['POST'])
 @require_auth
+@with_file_locks('people_file')
 def update_instructor():
-    index = int(request.form['index'])
     people_data = load_yaml_file('people.yml')
     instructors = people_data.get('instructors', [])
 
-    if 0 <= index < len(instructors):
-        instructors[index] = {
+    index = find_item(site.people_file, instructors, request.form)
+    if index is not None:
+        instructors[index] = entity_ids.keep_id(instructors[index], {
             'name': request.form['name'],
             'title': request.form['title'],
             'email': request.form['email'],
@@ -767,7 +1208,7 @@ def update_instructor():
             'office_hours': request.form.get('office_hours', ''),
             'webpage': request.form.get('webpage', ''),
             'profile_pic': request.form.get('profile_pic', '')
-        }
+        })
         people_data['instructors'] = instructors
         save_yaml_file('people.yml', people_data)
         flash('Instructor updated successfully!', 'success')
@@ -778,12 +1219,13 @@ def update_instructor():
 
 @app.route('/people/delete_instructor', methods=['POST'])
 @require_auth
+@with_file_locks('people_file')
 def delete_instructor():
-    index = int(request.form['index'])
     people_data = load_yaml_file('people.yml')
     instructors = people_data.get('instructors', [])
 
-    if 0 <= index < len(instructors):
+    index = find_item(site.people_file, instructors, request.form)
+    if index is not None:
         instructors.pop(index)
         people_data['instructors'] = instructors
         save_yaml_file('people.yml', people_data)
@@ -795,6 +1237,7 @@ def delete_instructor():
 
 @app.route('/people/add_ta', methods=['POST'])
 @require_auth
+@with_file_locks('people_file')
 def add_ta():
     ta_data = {
         'name': request.form['name'],
@@ -831,35 +1274,57 @@ def upload_photo():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
         filename = timestamp + filename
 
-        os.makedirs(PHOTO_UPLOAD_DIR, exist_ok=True)
-        file_path = os.path.join(PHOTO_UPLOAD_DIR, filename)
+        os.makedirs(site.photo_upload_dir, exist_ok=True)
+        file_path = os.path.join(site.photo_upload_dir, filename)
         file.save(file_path)
+        variants = site.image_pipeline.submit(file_path)
 
         relative_path = f'/_images/pp/{filename}'
         return jsonify({
             'success': True,
             'message': 'Photo uploaded successfully',
-            'file_path': relative_path
+            'file_path': relative_path,
+            'variants': variants['variants'],
+            'variants_status': variants['status']
         })
 
     return jsonify({'success': False, 'message': 'Invalid file type'})
 
+@app.route('/image_variants/status')
+@require_auth
+def image_variants_status():
+    path = request.args.get('path', '')
+    if not path.startswith('/'):
+        return jsonify({'success': False, 'message': 'Image path is required'}), 400
+    return jsonify({'success': True, **site.image_pipeline.status(path)})
+
+@app.route('/image_variants/backfill', methods=['POST'])
+@require_auth
+def backfill_image_variants():
+    queued = site.image_pipeline.backfill()
+    return jsonify({
+        'success': True,
+        'message': f'Queued {len(queued)} image(s) for thumbnails',
+        'jobs': queued
+    })
+
 @app.route('/site/<path:filename>')
 @require_auth
 def serve_site_file(filename):
-    return send_from_directory(SITE_ROOT, filename)
+    return site_files.send_site_file(site.root, filename, SITE_CACHE_CONTROL, SITE_DEFAULT_CACHE_CONTROL)
 
 @app.route('/people/update_ta', methods=['POST'])
 @require_auth
+@with_file_locks('people_file')
 def update_ta():
-    index = int(request.form['index'])
     people_data = load_yaml_file('people.yml')
     tas = people_data.get('teaching_assistants') or []
     if not isinstance(tas, list):
         tas = []
 
-    if 0 <= index < len(tas):
-        tas[index] = {
+    index = find_item(site.people_file, tas, request.form)
+    if index is not None:
+        tas[index] = entity_ids.keep_id(tas[index], {
             'name': request.form['name'],
             'email': request.form['email'],
             'office': request.form.get('office', ''),
@@ -867,7 +1332,7 @@ def update_ta():
             'profile_pic': request.form.get('profile_pic', ''),
             'webpage': request.form.get('webpage', ''),
             'bio': request.form.get('bio', '')
-        }
+        })
         people_data['teaching_assistants'] = tas
         save_yaml_file('people.yml', people_data)
         flash('Teaching Assistant updated successfully!', 'success')
@@ -878,14 +1343,15 @@ def update_ta():
 
 @app.route('/people/delete_ta', methods=['POST'])
 @require_auth
+@with_file_locks('people_file')
 def delete_ta():
-    index = int(request.form['index'])
     people_data = load_yaml_file('people.yml')
     tas = people_data.get('teaching_assistants') or []
     if not isinstance(tas, list):
         tas = []
 
-    if 0 <= index < len(tas):
+    index = find_item(site.people_file, tas, request.form)
+    if index is not None:
         tas.pop(index)
         people_data['teaching_assistants'] = tas
         save_yaml_file('people.yml', people_data)
@@ -903,6 +1369,7 @@ def config():
 
 @app.route('/config/update', methods=['POST'])
 @require_auth
+@with_file_locks('config_file')
 def update_config():
     config_data = load_config()
     
@@ -922,13 +1389,12 @@ def update_config():
 
 @app.route('/schedule/update_settings', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file')
 def update_schedule_settings():
     schedule_data = load_yaml_file('course_schedule.yml')
     
     # Get current class days to check for changes
-    current_days = []
-    if 'course_schedule' in schedule_data and 'class_days' in schedule_data['course_schedule']:
-        current_days = [day['day'] for day in schedule_data['course_schedule']['class_days']]
+    current_days = CourseCalendar(schedule_data).class_days
     
     # Update basic settings
     if 'course_schedule' not in schedule_data:
@@ -960,90 +1426,8 @@ def update_schedule_settings():
     removed_days = current_days_set - new_days_set
     added_days = new_days_set - current_days_set
     
-    messages = []
     auto_manage = 'auto_manage_lectures' in request.form
     
-    # Process lectures if there are changes in class days
-    if (removed_days or added_days) and 'lectures' in schedule_data and auto_manage:
-        # Handle removed days
-        if removed_days:
-            lectures_to_redistribute = []
-            lectures_updated = 0
-            
-            for lecture in schedule_data['lectures']:
-                for removed_day in removed_days:
-                    if removed_day in lecture:
-                        # Store lecture content for potential redistribution
-                        lectures_to_redistribute.append({
-                            'week': lecture['week'],
-                            'content': lecture[removed_day]
-                        })
-                        del lecture[removed_day]
-                        lectures_updated += 1
-            
-            # Remove empty lecture weeks
-            schedule_data['lectures'] = [
-                lecture for lecture in schedule_data['lectures'] 
-                if len(lecture) > 1  # More than just the 'week' key
-            ]
-            
-            if lectures_updated > 0:
-                messages.append(f'Removed {lectures_updated} lectures for discontinued class days: {", ".join(removed_days)}')
-                
-                # Try to redistribute removed lectures to new days if available
-                if added_days and lectures_to_redistribute:
-                    redistributed = 0
-                    new_days_list = list(added_days)
-                    
-                    for removed_lecture in lectures_to_redistribute:
-                        week = removed_lecture['week']
-                        content = removed_lecture['content']
-                        
-                        # Find the lecture week entry
-                        for lecture in schedule_data['lectures']:
-                            if lecture.get('week') == week:
-                                # Assign to first available new day
-                                target_day = new_days_list[redistributed % len(new_days_list)]
-                                lecture[target_day] = content
-                                redistributed += 1
-                                break
-                        else:
-                            # Week doesn't exist, create it
-                            target_day = new_days_list[redistributed % len(new_days_list)]
-                            schedule_data['lectures'].append({
-                                'week': week,
-                                target_day: content
-                            })
-                            redistributed += 1
-                    
-                    if redistributed > 0:
-                        messages.append(f'Redistributed {redistributed} lectures to new class days: {", ".join(added_days)}')
-        
-        # Handle newly added days - create placeholder lectures for existing weeks
-        elif added_days:
-            weeks_with_placeholders = 0
-            existing_weeks = set()
-            
-            # Find all existing weeks
-            for lecture in schedule_data['lectures']:
-                existing_weeks.add(lecture['week'])
-            
-            # Add placeholder lectures for new days in existing weeks
-            for week in sorted(existing_weeks):
-                for lecture in schedule_data['lectures']:
-                    if lecture.get('week') == week:
-                        for new_day in added_days:
-                            if new_day not in lecture:
-                                lecture[new_day] = {
-                                    'topic': 'TBD',
-                                    'materials': []
-                                }
-                                weeks_with_placeholders += 1
-                        break
-            
-            if weeks_with_placeholders > 0:
-                messages.append(f'Added placeholder lectures for new class days in {len(existing_weeks)} existing weeks')
-    
     # Update holidays
     holidays = [date.strip() for date in request.form.getlist('holidays[]') if date.strip()]
     if not holidays:
@@ -1054,44 +1438,55 @@ def update_schedule_settings():
     schedule_data['course_schedule']['holidays'] = holidays
     
     save_yaml_file('course_schedule.yml', schedule_data)
-    
-    # Display all messages
-    for message in messages:
-        flash(message, 'info')
-    
     flash('Schedule settings updated successfully!', 'success')
+    
+    # Moving lectures to the new class days rewrites the whole schedule, so
+    # it runs in the background and the page follows its progress.
+    if (removed_days or added_days) and 'lectures' in schedule_data and auto_manage:
+        job = submit_job(
+            'schedule.redistribute_lectures', redistribute_lectures, sorted(removed_days), sorted(added_days)
+        )
+        return redirect(url_for('schedule', job=job['id']))
     return redirect(url_for('schedule'))
 
+def redistribute_lectures(job, removed_days, added_days):
+    """Move the lectures of removed class days to the added ones, or add placeholders for new days."""
+    messages = []
+    with storage.locked(site.schedule_file):
+        schedule_data = load_yaml_file('course_schedule.yml')
+        calendar = CourseCalendar(schedule_data)
+        job.progress(0, 1)
+
+        if removed_days:
+            removed = calendar.remove_days(removed_days)
+            if removed:
+                messages.append(f'Removed {len(removed)} lectures for discontinued class days: {", ".join(removed_days)}')
+                # Try to redistribute removed lectures to new days if available
+                if added_days:
+                    redistributed = calendar.assign(removed, added_days)
+                    messages.append(f'Redistributed {redistributed} lectures to new class days: {", ".join(added_days)}')
+
+        # Handle newly added days - create placeholder lectures for existing weeks
+        elif added_days:
+            if calendar.add_placeholders(added_days):
+                messages.append(f'Added placeholder lectures for new class days in {len(calendar.weeks)} existing weeks')
+
+        save_yaml_file('course_schedule.yml', schedule_data)
+        job.progress(1)
+    return {'message': ' '.join(messages) or 'No lectures needed to change.', 'messages': messages}
+
 @app.route('/schedule/cleanup_lectures', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file')
 def cleanup_lectures():
     schedule_data = load_yaml_file('course_schedule.yml')
+    calendar = CourseCalendar(schedule_data)
     
-    # Get current class days
-    current_days = set()
-    if 'course_schedule' in schedule_data and 'class_days' in schedule_data['course_schedule']:
-        current_days = {day['day'] for day in schedule_data['course_schedule']['class_days']}
-    
-    if not current_days:
+    if not calendar.class_days:
         return jsonify({'success': False, 'message': 'No class days configured'})
     
-    lectures_updated = 0
-    if 'lectures' in schedule_data:
-        for lecture in schedule_data['lectures']:
-            # Get all days in this lecture except 'week'
-            lecture_days = set(lecture.keys()) - {'week'}
-            # Find days that are no longer in class schedule
-            days_to_remove = lecture_days - current_days
-            
-            for day_to_remove in days_to_remove:
-                del lecture[day_to_remove]
-                lectures_updated += 1
-        
-        # Remove empty lecture weeks
-        schedule_data['lectures'] = [
-            lecture for lecture in schedule_data['lectures'] 
-            if len(lecture) > 1  # More than just the 'week' key
-        ]
+    # Remove lectures on days that are no longer class days
+    lectures_updated = calendar.remove_other_days()
     
     save_yaml_file('course_schedule.yml', schedule_data)
     
@@ -1104,84 +1499,55 @@ def cleanup_lectures():
 @app.route('/schedule/bulk_operations', methods=['POST'])
 @require_auth
 def bulk_operations():
-    operation = request.json.get('operation')
-    schedule_data = load_yaml_file('course_schedule.yml')
+    data = request.get_json() or {}
+    operation = data.get('operation')
     
     if operation == 'fill_missing_days':
-        # Fill missing days for all existing weeks
-        current_days = set()
-        if 'course_schedule' in schedule_data and 'class_days' in schedule_data['course_schedule']:
-            current_days = {day['day'] for day in schedule_data['course_schedule']['class_days']}
-        
-        if not current_days:
-            return jsonify({'success': False, 'message': 'No class days configured'})
-        
-        filled_count = 0
-        if 'lectures' in schedule_data:
-            for lecture in schedule_data['lectures']:
-                week_days = set(lecture.keys()) - {'week'}
-                missing_days = current_days - week_days
-                
-                for missing_day in missing_days:
-                    lecture[missing_day] = {
-                        'topic': 'TBD',
-                        'materials': []
-                    }
-                    filled_count += 1
-        
-        save_yaml_file('course_schedule.yml', schedule_data)
-        return jsonify({'success': True, 'message': f'Added {filled_count} placeholder lectures for missing days'})
+        job = submit_job('schedule.fill_missing_days', fill_missing_days)
+        return job_response(job, 'Filling missing days')
     
     elif operation == 'generate_weeks':
-        # Generate placeholder weeks up to a specified number
-        max_week = request.json.get('max_week', 16)
-        current_days = []
-        if 'course_schedule' in schedule_data and 'class_days' in schedule_data['course_schedule']:
-            current_days = [day['day'] for day in schedule_data['course_schedule']['class_days']]
-        
-        if not current_days:
-            return jsonify({'success': False, 'message': 'No class days configured'})
-        
-        # Find existing weeks
-        existing_weeks = set()
-        if 'lectures' in schedule_data:
-            for lecture in schedule_data['lectures']:
-                existing_weeks.add(lecture['week'])
-        
-        # Generate missing weeks
-        created_count = 0
-        for week in range(1, max_week + 1):
-            if week not in existing_weeks:
-                new_lecture = {'week': week}
-                for day in current_days:
-                    new_lecture[day] = {
-                        'topic': 'TBD',
-                        'materials': []
-                    }
-                
-                if 'lectures' not in schedule_data:
-                    schedule_data['lectures'] = []
-                
-                schedule_data['lectures'].append(new_lecture)
-                created_count += 1
-        
-        # Sort lectures by week
-        if 'lectures' in schedule_data:
-            schedule_data['lectures'].sort(key=lambda x: x['week'])
-        
-        save_yaml_file('course_schedule.yml', schedule_data)
-        return jsonify({'success': True, 'message': f'Generated {created_count} new weeks (up to week {max_week})'})
+        max_week = int(data.get('max_week', 16))
+        job = submit_job('schedule.generate_weeks', generate_weeks, max_week)
+        return job_response(job, f'Generating weeks up to week {max_week}')
     
     return jsonify({'success': False, 'message': 'Unknown operation'})
 
+def fill_missing_days(job):
+    """Add placeholder lectures for the class days missing from existing weeks."""
+    with storage.locked(site.schedule_file):
+        schedule_data = load_yaml_file('course_schedule.yml')
+        calendar = CourseCalendar(schedule_data)
+        if not calendar.class_days:
+            raise jobs.JobError('No class days configured')
+        job.progress(0, 1)
+        filled_count = calendar.fill_missing_days()
+        save_yaml_file('course_schedule.yml', schedule_data)
+        job.progress(1)
+    return {'message': f'Added {filled_count} placeholder lectures for missing days', 'filled': filled_count}
+
+def generate_weeks(job, max_week):
+    """Add placeholder weeks up to max_week."""
+    with storage.locked(site.schedule_file):
+        schedule_data = load_yaml_file('course_schedule.yml')
+        calendar = CourseCalendar(schedule_data)
+        if not calendar.class_days:
+            raise jobs.JobError('No class days configured')
+        job.progress(0, 1)
+        created_count = calendar.generate_weeks(max_week)
+        save_yaml_file('course_schedule.yml', schedule_data)
+        job.progress(1)
+    return {'message': f'Generated {created_count} new weeks (up to week {max_week})', 'created': created_count}
+
 @app.route('/schedule/delete_lecture', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file')
 def delete_lecture():
-    lecture_index = int(request.form['index'])
     schedule_data = load_yaml_file('course_schedule.yml')
 
     sequence = build_lecture_sequence(schedule_data)
-    if 0 <= lecture_index < len(sequence):
+    lecture_index = find_item(site.schedule_file, sequence, request.form)
+    if lecture_index is not None:
         sequence.pop(lecture_index)
         schedule_data['lecture_sequence'] = sequence
         save_yaml_file('course_schedule.yml', schedule_data)
@@ -1192,14 +1558,15 @@ def delete_lecture():
 
 @app.route('/move_lecture', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file')
 def move_lecture():
-    lecture_index = int(request.form['index'])
     direction = request.form.get('direction')
 
     schedule_data = load_yaml_file('course_schedule.yml')
     sequence = build_lecture_sequence(schedule_data)
+    lecture_index = find_item(site.schedule_file, sequence, request.form)
 
-    if not (0 <= lecture_index < len(sequence)):
+    if lecture_index is None:
         flash('Lecture not found.', 'error')
         return redirect(url_for('schedule'))
 
@@ -1212,6 +1579,18 @@ def move_lecture():
     save_yaml_file('course_schedule.yml', schedule_data)
     return redirect(url_for('schedule'))
 
+@app.route('/reorder_lectures', methods=['POST'])
+@require_auth
+@with_file_locks('schedule_file')
+def reorder_lectures():
+    schedule_data = load_yaml_file('course_schedule.yml')
+    sequence, error = reorder_items(build_lecture_sequence(schedule_data), 'lecture', site.schedule_file)
+    if error:
+        return error
+    schedule_data['lecture_sequence'] = sequence
+    save_yaml_file('course_schedule.yml', schedule_data)
+    return jsonify({'success': True, 'message': 'Lectures reordered'})
+
 @app.route('/upload_file', methods=['POST'])
 @require_auth
 def upload_file():
@@ -1227,43 +1606,183 @@ def upload_file():
     if error:
         return jsonify({'success': False, 'message': error})
 
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(site.upload_dir, exist_ok=True)
     overwrite = request.form.get('overwrite', '').lower() == 'true'
     file_path = get_material_absolute_path(filename)
     exists = os.path.exists(file_path)
 
     if exists and not overwrite:
-        return jsonify({
-            'success': False,
-            'conflict': True,
-            'message': f'"{filename}" already exists. Confirm overwrite to replace it.',
-            'existing_file': {
-                'name': filename,
-                'path': get_material_relative_path(filename),
-                'url': get_material_public_url(filename),
-                'usages': find_material_usages(filename)
-            }
-        }), 409
+        return material_conflict_response(filename)
 
-    file.save(file_path)
+    temp_path = uploads.new_temp_path(site.upload_dir)
+    file.save(temp_path)
+    metrics_registry.inc('dashboard_upload_bytes_total', {'method': 'form'}, os.path.getsize(temp_path))
+    with site.upload_snapshot.changing(filename) as touched:
+        stored = store_material_file(temp_path, filename)
+        touched.update(stored['duplicate_of'])
 
     return jsonify({
         'success': True,
-        'message': 'File uploaded successfully' if not exists else 'File overwritten successfully',
+        'message': upload_success_message(exists, stored),
+        'duplicate_of': stored['duplicate_of'],
         'file': {
             'name': filename,
             'path': get_material_relative_path(filename),
-            'url': get_material_public_url(filename)
+            'url': get_material_public_url(filename),
+            'sha256': stored['sha256']
         }
     })
 
+@app.route('/upload_file/init', methods=['POST'])
+@require_auth
+def init_chunked_upload():
+    data = request.get_json() or {}
+    requested_name = (data.get('new_name') or '').strip() or data.get('filename', '')
+    filename, error = validate_material_filename(requested_name)
+    if error:
+        return jsonify({'success': False, 'message': error})
+
+    size = data.get('size')
+    if size is not None:
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            size = -1
+        if size < 0:
+            return jsonify({'success': False, 'message': 'Invalid file size'})
+
+    if os.path.exists(get_material_absolute_path(filename)) and not data.get('overwrite'):
+        return material_conflict_response(filename)
+
+    os.makedirs(site.upload_dir, exist_ok=True)
+    session = uploads.start_upload(site.upload_dir, filename, size)
+    return jsonify({'success': True, **session})
+
+@app.route('/upload_file/<upload_id>', methods=['GET'])
+@require_auth
+def chunked_upload_status(upload_id):
+    try:
+        return jsonify({'success': True, **uploads.upload_status(site.upload_dir, upload_id)})
+    except uploads.UploadError as e:
+        return upload_error_response(e)
+
+@app.route('/upload_file/<upload_id>', methods=['PUT'])
+@require_auth
+def upload_chunk(upload_id):
+    try:
+        offset = int(request.args['offset'])
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'message': 'Missing or invalid offset'}), 400
+
+    try:
+        new_offset = uploads.write_chunk(site.upload_dir, upload_id, offset, request.stream)
+    except uploads.UploadError as e:
+        return upload_error_response(e)
+    metrics_registry.inc('dashboard_upload_bytes_total', {'method': 'chunked'}, new_offset - offset)
+    return jsonify({'success': True, 'upload_id': upload_id, 'offset': new_offset})
+
+@app.route('/upload_file/<upload_id>/finalize', methods=['POST'])
+@require_auth
+def finalize_chunked_upload(upload_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        filename = uploads.upload_status(site.upload_dir, upload_id)['filename']
+        file_path = get_material_absolute_path(filename)
+        exists = os.path.exists(file_path)
+        if exists and not data.get('overwrite'):
+            return material_conflict_response(filename)
+        with site.upload_snapshot.changing(filename) as touched:
+            result = uploads.finish_upload(
+                site.upload_dir, upload_id,
+                lambda part_path, digest: store_material_file(part_path, filename, digest)
+            )
+            touched.update(result['duplicate_of'])
+    except uploads.UploadError as e:
+        return upload_error_response(e)
+
+    return jsonify({
+        'success': True,
+        'message': upload_success_message(exists, result),
+        'duplicate_of': result['duplicate_of'],
+        'file': {
+            'name': filename,
+            'path': get_material_relative_path(filename),
+            'url': get_material_public_url(filename),
+            'size': result['size'],
+            'sha256': result['sha256']
+        }
+    })
+
+@app.route('/upload_file/<upload_id>', methods=['DELETE'])
+@require_auth
+def abort_chunked_upload(upload_id):
+    try:
+        uploads.abort_upload(site.upload_dir, upload_id)
+    except uploads.UploadError as e:
+        return upload_error_response(e)
+    return jsonify({'success': True, 'message': 'Upload cancelled'})
+
 @app.route('/get_uploaded_files')
 @require_auth
 def get_uploaded_files():
-    return jsonify({'files': collect_uploaded_files()})
+    args = request.args
+    sort = args.get('sort', 'mtime')
+    if sort not in UPLOAD_SORT_KEYS:
+        return jsonify({'success': False, 'message': f'Unknown sort "{sort}"'}), 400
+
+    order = args.get('order')
+    if order not in (None, 'asc', 'desc'):
+        return jsonify({'success': False, 'message': 'order must be "asc" or "desc"'}), 400
+
+    limit = None
+    if args.get('limit'):
+        try:
+            limit = int(args['limit'])
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_UPLOAD_PAGE_SIZE:
+            return jsonify({'success': False, 'message': f'limit must be between 1 and {MAX_UPLOAD_PAGE_SIZE}'}), 400
+
+    extensions = {ext.strip().lower().lstrip('.') for ext in args.get('ext', '').split(',') if ext.strip()}
+    try:
+        listing = collect_uploaded_files(
+            sort=sort,
+            descending=None if order is None else order == 'desc',
+            prefix=args.get('prefix', ''),
+            extensions=extensions,
+            unused_only=args.get('unused', '').lower() in ('1', 'true'),
+            cursor=args.get('cursor'),
+            limit=limit,
+            include_usages=args.get('usages', '').lower() not in ('0', 'false')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(listing)
+
+@app.route('/pdf_preview/<digest>.webp')
+@require_auth
+def pdf_preview(digest):
+    if len(digest) != 64 or any(char not in '0123456789abcdef' for char in digest):
+        return jsonify({'success': False, 'message': 'Preview not found'}), 404
+    # Previews are named by content hash, so a given URL never changes.
+    return site_files.send_site_file(
+        site.pdf_metadata_cache.cache_dir, f'{digest}.webp', {}, 'private, max-age=31536000, immutable'
+    )
+
+@app.route('/deduplicate_uploads', methods=['POST'])
+@require_auth
+def deduplicate_uploads():
+    result = content_store.deduplicate(site.upload_dir, allowed_file)
+    site.upload_snapshot.invalidate()
+    return jsonify({
+        'success': True,
+        'message': f"Linked {result['relinked']} duplicate file(s), freeing {result['reclaimed_bytes']} bytes",
+        **result
+    })
 
 @app.route('/rename_file', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file', 'additional_events_file')
 def rename_file():
     data = request.get_json() or {}
     current_name, error = validate_material_filename(data.get('current_name', ''))
@@ -1284,22 +1803,14 @@ def rename_file():
         return jsonify({'success': True, 'message': 'Filename unchanged'})
 
     overwrite = bool(data.get('overwrite'))
-    if os.path.exists(new_path):
-        if not overwrite:
-            return jsonify({
-                'success': False,
-                'conflict': True,
-                'message': f'"{new_name}" already exists. Confirm overwrite to replace it.',
-                'existing_file': {
-                    'name': new_name,
-                    'path': get_material_relative_path(new_name),
-                    'url': get_material_public_url(new_name),
-                    'usages': find_material_usages(new_name)
-                }
-            }), 409
-        os.remove(new_path)
-
-    os.rename(current_path, new_path)
+    if os.path.exists(new_path) and not overwrite:
+        return material_conflict_response(new_name)
+
+    # The file and its links change under the same locks, so a delete or
+    # another rename of either name cannot come in between.
+    with site.upload_snapshot.changing(current_name, new_name):
+        os.replace(current_path, new_path)
+        content_store.rename(site.upload_dir, current_name, new_name)
     updated_references = replace_material_references(current_name, new_name)
 
     return jsonify({
@@ -1314,26 +1825,26 @@ def rename_file():
 
 @app.route('/edit_lecture', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file')
 def edit_lecture():
     data = request.get_json()
-    lecture_index = data.get('index')
     topic = data.get('topic')
     raw_materials = data.get('materials', [])
-    materials = [
-        {'name': m.get('name'), 'url': normalize_material_url(m.get('url', ''))}
-        for m in raw_materials
-    ]
+    if not valid_materials(raw_materials):
+        return jsonify({'success': False, 'message': INVALID_MATERIALS_MESSAGE}), 400
+    materials = normalize_materials(raw_materials)
     
     schedule_data = load_yaml_file('course_schedule.yml')
 
     sequence = build_lecture_sequence(schedule_data)
-    if lecture_index is None or not (0 <= lecture_index < len(sequence)):
+    lecture_index = find_item(site.schedule_file, sequence, data)
+    if lecture_index is None:
         return jsonify({'success': False, 'message': 'Lecture not found'})
 
-    sequence[lecture_index] = {
+    sequence[lecture_index] = entity_ids.keep_id(sequence[lecture_index], {
         'topic': topic,
         'materials': materials
-    }
+    })
     schedule_data['lecture_sequence'] = sequence
 
     save_yaml_file('course_schedule.yml', schedule_data)
@@ -1341,19 +1852,20 @@ def edit_lecture():
 
 @app.route('/delete_material', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file')
 def delete_material():
     data = request.get_json()
-    lecture_index = data.get('lecture_index')
-    index = data.get('index')
     
     schedule_data = load_yaml_file('course_schedule.yml')
 
     sequence = build_lecture_sequence(schedule_data)
-    if lecture_index is None or not (0 <= lecture_index < len(sequence)):
+    lecture_index = find_item(site.schedule_file, sequence, data, 'lecture_id', 'lecture_index')
+    if lecture_index is None:
         return jsonify({'success': False, 'message': 'Lecture not found'})
 
     materials = sequence[lecture_index].get('materials', [])
-    if 0 <= index < len(materials):
+    index = find_item(site.schedule_file, materials, data)
+    if index is not None:
         materials.pop(index)
         schedule_data['lecture_sequence'] = sequence
         save_yaml_file('course_schedule.yml', schedule_data)
@@ -1363,6 +1875,7 @@ def delete_material():
 
 @app.route('/delete_file', methods=['POST'])
 @require_auth
+@with_file_locks('schedule_file', 'additional_events_file')
 def delete_file():
     data = request.get_json() or {}
     filename = data.get('filename') or data.get('name')
@@ -1378,7 +1891,9 @@ def delete_file():
     usages = find_material_usages(filename)
     try:
         if os.path.exists(file_path):
-            os.remove(file_path)
+            with site.upload_snapshot.changing(filename):
+                os.remove(file_path)
+                content_store.forget(site.upload_dir, filename)
             removed_references = remove_material_references(filename)
             return jsonify({
                 'success': True,
@@ -1393,27 +1908,22 @@ def delete_file():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error deleting file: {str(e)}'})
 
-@app.route('/add_additional_event', methods=['POST'])
-@require_auth
-def add_additional_event():
-    event_date = request.form['event_date']
-    event_type = request.form['event_type']
-    event_topic = request.form['event_topic']
-    material_name = request.form.get('event_material_name', '').strip()
-    material_url = normalize_material_url(request.form.get('event_material_url', '').strip())
-    due_in_value = request.form.get('due_in_value', '').strip()
-    due_in_unit = request.form.get('due_in_unit', 'days')
-    
-    additional_events_data = load_yaml_file('additional_events.yml')
-    
+def add_event(additional_events_data, event_date, event_type, event_topic, materials,
+              due_in_value='', due_in_unit='days', ordered=None):
+    """Add an event, and its due event, in date order; ordered says whether the events already are."""
     if 'additional_events' not in additional_events_data:
         additional_events_data['additional_events'] = []
+    events = additional_events_data['additional_events']
+    if ordered is None:
+        ordered = event_index.is_date_ordered(events)
+    if not ordered:
+        events.sort(key=event_index.date_key)
     
     new_event = {
         'date': event_date,
         'type': event_type,
         'topic': event_topic,
-        'materials': []
+        'materials': list(materials)
     }
     group_id = None
     if event_type in ['homework', 'project']:
@@ -1423,14 +1933,7 @@ def add_additional_event():
             new_event['due_in_value'] = due_in_value
             new_event['due_in_unit'] = due_in_unit
     
-    # Add material if provided
-    if material_name and material_url:
-        new_event['materials'].append({
-            'name': material_name,
-            'url': material_url
-        })
-    
-    additional_events_data['additional_events'].append(new_event)
+    event_index.insert(events, new_event)
 
     if event_type in ['homework', 'project'] and due_in_value:
         try:
@@ -1440,9 +1943,7 @@ def add_additional_event():
 
         if due_amount > 0:
             try:
-                base_date = datetime.strptime(event_date, "%Y-%m-%d")
-                delta_days = due_amount * 7 if due_in_unit == 'weeks' else due_amount
-                due_date = (base_date + timedelta(days=delta_days)).strftime("%Y-%m-%d")
+                due_date = shift_date(event_date, due_amount, due_in_unit)
                 due_materials = list(new_event['materials']) if event_type == 'homework' else []
                 due_event = {
                     'date': due_date,
@@ -1453,144 +1954,243 @@ def add_additional_event():
                 if group_id:
                     due_event['group_id'] = group_id
                     due_event['auto_due'] = True
-                additional_events_data['additional_events'].append(due_event)
+                event_index.insert(events, due_event)
             except ValueError:
                 pass
+
+@app.route('/add_additional_event', methods=['POST'])
+@require_auth
+@with_file_locks('additional_events_file')
+def add_additional_event():
+    event_date = request.form['event_date']
+    event_type = request.form['event_type']
+    event_topic = request.form['event_topic']
+    material_name = request.form.get('event_material_name', '').strip()
+    material_url = normalize_material_url(request.form.get('event_material_url', '').strip())
+    due_in_value = request.form.get('due_in_value', '').strip()
+    due_in_unit = request.form.get('due_in_unit', 'days')
     
-    # Sort events by date
-    additional_events_data['additional_events'].sort(key=lambda x: x['date'])
+    additional_events_data = load_yaml_file('additional_events.yml')
+
+    # Add material if provided
+    materials = []
+    if material_name and material_url:
+        materials.append({
+            'name': material_name,
+            'url': material_url
+        })
+
+    add_event(
+        additional_events_data, event_date, event_type, event_topic, materials, due_in_value, due_in_unit,
+        ordered=site.event_index.ordered()
+    )
     
     save_yaml_file('additional_events.yml', additional_events_data)
     flash('Additional event added successfully!', 'success')
     return redirect(url_for('events'))
 
+def update_event(additional_events_data, index, date, event_type, topic, materials,
+                 due_in_value='', due_in_unit='days', ordered=None, links=None):
+    """Replace the event at index and the due events linked to it.
+
+    ordered and links describe the events as they are before the edit; they
+    are worked out from the events when not given.
+    """
+    if 'additional_events' not in additional_events_data or not 0 <= index < len(additional_events_data['additional_events']):
+        return False
+
+    events = additional_events_data['additional_events']
+    existing_event = events[index]
+    group_id = existing_event.get('group_id')
+    if ordered is None:
+        ordered = event_index.is_date_ordered(events)
+    if links is None:
+        links = event_index.EventLinks(events)
+    due_event = None
+
+    updated_event = {
+        'date': date,
+        'type': event_type,
+        'topic': topic,
+        'materials': materials
+    }
+    if group_id:
+        updated_event['group_id'] = group_id
+    if event_type in ['homework', 'project'] and due_in_value:
+        updated_event['due_in_value'] = due_in_value
+        updated_event['due_in_unit'] = due_in_unit
+    updated_event = entity_ids.keep_id(existing_event, updated_event)
+
+    events[index] = updated_event
+
+    # Remove existing auto due entries for this group (or, without one, this
+    # topic) before recalculating; if the type changed away they stay removed
+    if group_id:
+        stale = links.dues(group_id)
+    elif event_type in ['homework', 'project']:
+        stale = links.dues_by_topic(f"{topic} Due")
+    else:
+        stale = []
+    stale = sorted(position for position in stale if position != index)
+    previous_due = events[stale[0]] if stale else None
+    for position in reversed(stale):
+        del events[position]
+    index -= bisect.bisect_left(stale, index)
+
+    # Handle auto due update for homework/project
+    if event_type in ['homework', 'project'] and due_in_value:
+        if not group_id:
+            group_id = uuid4().hex
+            updated_event['group_id'] = group_id
+        try:
+            due_amount = int(due_in_value)
+        except ValueError:
+            due_amount = 0
+        if due_amount > 0:
+            try:
+                due_date = shift_date(date, due_amount, due_in_unit)
+                due_type = f"{event_type}_due"
+                due_topic = f"{topic} Due"
+                due_materials = list(materials) if due_type == 'homework_due' else []
+                due_event = entity_ids.keep_id(previous_due, {
+                    'date': due_date,
+                    'type': due_type,
+                    'topic': due_topic,
+                    'materials': due_materials,
+                    'group_id': group_id,
+                    'auto_due': True
+                })
+            except ValueError:
+                pass
+
+    # Keep events in date order
+    if ordered:
+        event_index.reposition(events, index)
+        if due_event is not None:
+            event_index.insert(events, due_event)
+    else:
+        if due_event is not None:
+            events.append(due_event)
+        events.sort(key=event_index.date_key)
+    return True
+
 @app.route('/edit_additional_event', methods=['POST'])
 @require_auth
+@with_file_locks('additional_events_file')
 def edit_additional_event():
     data = request.get_json()
-    index = data.get('index')
     date = data.get('date')
     event_type = data.get('type')
     topic = data.get('topic')
     raw_materials = data.get('materials', [])
     due_in_value = (data.get('due_in_value') or '').strip()
     due_in_unit = data.get('due_in_unit') or 'days'
-    materials = [
-        {'name': m.get('name'), 'url': normalize_material_url(m.get('url', ''))}
-        for m in raw_materials
-    ]
+    if not valid_materials(raw_materials):
+        return jsonify({'success': False, 'message': INVALID_MATERIALS_MESSAGE}), 400
+    materials = normalize_materials(raw_materials)
     
     additional_events_data = load_yaml_file('additional_events.yml')
+    index = find_item(site.additional_events_file, additional_events_data.get('additional_events') or [], data)
     
-    if 'additional_events' in additional_events_data and 0 <= index < len(additional_events_data['additional_events']):
-        existing_event = additional_events_data['additional_events'][index]
-        group_id = existing_event.get('group_id')
-
-        updated_event = {
-            'date': date,
-            'type': event_type,
-            'topic': topic,
-            'materials': materials
-        }
-        if group_id:
-            updated_event['group_id'] = group_id
-        if event_type in ['homework', 'project'] and due_in_value:
-            updated_event['due_in_value'] = due_in_value
-            updated_event['due_in_unit'] = due_in_unit
-
-        additional_events_data['additional_events'][index] = updated_event
-
-        # Remove existing auto due entries for this group/topic before recalculating
-        if event_type in ['homework', 'project']:
-            def _is_related_due(ev):
-                if group_id and ev.get('group_id') == group_id:
-                    return str(ev.get('type', '')).endswith('_due')
-                return ev.get('type') in ['homework_due', 'project_due'] and ev.get('topic') == f"{topic} Due"
-            additional_events_data['additional_events'] = [
-                ev for ev in additional_events_data['additional_events'] if not _is_related_due(ev)
-            ]
-
-        # Handle auto due update for homework/project
-        if event_type in ['homework', 'project'] and due_in_value:
-            if not group_id:
-                group_id = uuid4().hex
-                updated_event['group_id'] = group_id
-                additional_events_data['additional_events'][index]['group_id'] = group_id
-            try:
-                due_amount = int(due_in_value)
-            except ValueError:
-                due_amount = 0
-            if due_amount > 0:
-                try:
-                    base_date = datetime.strptime(date, "%Y-%m-%d")
-                    delta_days = due_amount * 7 if due_in_unit == 'weeks' else due_amount
-                    due_date = (base_date + timedelta(days=delta_days)).strftime("%Y-%m-%d")
-                    due_type = f"{event_type}_due"
-                    due_topic = f"{topic} Due"
-                    due_materials = list(materials) if due_type == 'homework_due' else []
-                    due_event = {
-                        'date': due_date,
-                        'type': due_type,
-                        'topic': due_topic,
-                        'materials': due_materials,
-                        'group_id': group_id,
-                        'auto_due': True
-                    }
-                    additional_events_data['additional_events'].append(due_event)
-                except ValueError:
-                    pass
-        elif group_id:
-            # If type changed away, remove linked auto due
-            additional_events_data['additional_events'] = [
-                ev for ev in additional_events_data['additional_events']
-                if ev.get('group_id') != group_id or not str(ev.get('type', '')).endswith('_due')
-            ]
-
-        # Sort events by date
-        additional_events_data['additional_events'].sort(key=lambda x: x['date'])
-        
+    if index is not None and update_event(additional_events_data, index, date, event_type, topic, materials, due_in_value, due_in_unit,
+                    ordered=site.event_index.ordered(), links=site.event_index.links()):
         save_yaml_file('additional_events.yml', additional_events_data)
         return jsonify({'success': True, 'message': 'Event updated successfully'})
     
     return jsonify({'success': False, 'message': 'Event not found'})
 
+def delete_event(additional_events_data, index, links=None):
+    """Delete the event at index and, for a homework or project, its due events; returns how many were deleted."""
+    events = additional_events_data['additional_events']
+    if links is None:
+        links = event_index.EventLinks(events)
+    event = events[index]
+    positions = {index}
+    if event.get('group_id') and not event_index.is_due(event):
+        positions.update(links.dues(event['group_id']))
+    for position in sorted(positions, reverse=True):
+        del events[position]
+    return len(positions)
+
 @app.route('/delete_additional_event', methods=['POST'])
 @require_auth
+@with_file_locks('additional_events_file')
 def delete_additional_event():
     data = request.get_json()
-    index = data.get('index')
     
     additional_events_data = load_yaml_file('additional_events.yml')
+    index = find_item(site.additional_events_file, additional_events_data.get('additional_events') or [], data)
     
-    if 'additional_events' in additional_events_data and 0 <= index < len(additional_events_data['additional_events']):
-        additional_events_data['additional_events'].pop(index)
+    if index is not None:
+        removed = delete_event(additional_events_data, index, links=site.event_index.links())
         save_yaml_file('additional_events.yml', additional_events_data)
+        if removed > 1:
+            return jsonify({'success': True, 'message': f'Event and {removed - 1} linked due event(s) deleted successfully'})
         return jsonify({'success': True, 'message': 'Event deleted successfully'})
     
     return jsonify({'success': False, 'message': 'Event not found'})
 
+def read_event_window(args):
+    """Return (from, to, types) of an events query; raises ValueError for a malformed date."""
+    start, end = args.get('from') or None, args.get('to') or None
+    for value in (start, end):
+        if value is not None and parse_date(value) is None:
+            raise ValueError(f'"{value}" is not a date (YYYY-MM-DD)')
+    types = {event_type for value in args.getlist('type') for event_type in value.split(',') if event_type}
+    return start, end, types or None
+
 @app.route('/events')
 @require_auth
 def events():
-    additional_events_data = load_yaml_file('additional_events.yml')
+    try:
+        start, end, types = read_event_window(request.args)
+    except ValueError as error:
+        flash(str(error), 'error')
+        return redirect(url_for('events'))
+    if 'from' not in request.args:
+        # Start at the current semester; events of earlier ones stay in the
+        # file and are one click away.
+        semester_start = CourseCalendar(load_yaml_file('course_schedule.yml')).start
+        start = semester_start.isoformat() if semester_start else None
+
+    entries = site.event_index.query(start, end, types)
     return render_template(
         'events.html',
-        events=additional_events_data,
+        events=entries,
+        visible_events=[event for _, event in entries],
+        window={'from': start or '', 'to': end or '', 'type': ','.join(sorted(types or ()))},
         public_base=get_public_base(),
         public_root=get_public_root()
     )
 
+@app.route('/api/events')
+@require_auth
+def api_events():
+    try:
+        start, end, types = read_event_window(request.args)
+    except ValueError as error:
+        return jsonify({'success': False, 'message': str(error)}), 400
+    return jsonify({
+        'success': True,
+        'from': start,
+        'to': end,
+        'events': [{'index': position, **event} for position, event in site.event_index.query(start, end, types)]
+    })
+
 @app.route('/add_event_material', methods=['POST'])
 @require_auth
+@with_file_locks('additional_events_file')
 def add_event_material():
     data = request.get_json()
-    event_index = data.get('event_index')
     material_name = data.get('material_name')
     material_url = normalize_material_url(data.get('material_url'))
     
     additional_events_data = load_yaml_file('additional_events.yml')
+    event_index = find_item(
+        site.additional_events_file, additional_events_data.get('additional_events') or [], data, 'event_id', 'event_index'
+    )
     
-    if 'additional_events' in additional_events_data and 0 <= event_index < len(additional_events_data['additional_events']):
+    if event_index is not None:
         event = additional_events_data['additional_events'][event_index]
         if 'materials' not in event:
             event['materials'] = []
@@ -1607,16 +2207,19 @@ def add_event_material():
 
 @app.route('/delete_event_material', methods=['POST'])
 @require_auth
+@with_file_locks('additional_events_file')
 def delete_event_material():
     data = request.get_json()
-    event_index = data.get('event_index')
-    material_index = data.get('material_index')
 
     additional_events_data = load_yaml_file('additional_events.yml')
-    if 'additional_events' in additional_events_data and 0 <= event_index < len(additional_events_data['additional_events']):
+    event_index = find_item(
+        site.additional_events_file, additional_events_data.get('additional_events') or [], data, 'event_id', 'event_index'
+    )
+    if event_index is not None:
         event = additional_events_data['additional_events'][event_index]
         materials = event.get('materials', [])
-        if 0 <= material_index < len(materials):
+        material_index = find_item(site.additional_events_file, materials, data, 'material_id', 'material_index')
+        if material_index is not None:
             materials.pop(material_index)
             event['materials'] = materials
             save_yaml_file('additional_events.yml', additional_events_data)
@@ -1624,10 +2227,308 @@ def delete_event_material():
 
     return jsonify({'success': False, 'message': 'Material not found'})
 
+# Batch edits: every operation below edits one data file in memory, and
+# /api/batch writes each touched file once after all of them succeeded.
+batch_operations = BatchOperations()
+
+# Site attribute of each file batch operations edit -> its loader.
+BATCH_LOADERS = {
+    'schedule_file': lambda: load_yaml_file('course_schedule.yml'),
+    'additional_events_file': lambda: load_yaml_file('additional_events.yml'),
+    'assignments_file': load_assignments,
+    'home_modules_file': load_home_modules,
+}
+
+def batch_index(items, index, label):
+    if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < len(items):
+        raise BatchError(f'{label} not found')
+    return index
+
+def batch_find(file, items, params, label, id_field='id', index_field='index'):
+    """Position of the entry params name by id_field, or else by index_field; see find_item()."""
+    entity_id = params.get(id_field)
+    if entity_id:
+        if not isinstance(entity_id, str):
+            raise BatchError(f'{label} ids are strings')
+        position = entity_ids.find(items, entity_id, site.entity_ids.position(getattr(site, file), entity_id))
+        if position is None:
+            raise BatchError(f'{label} {entity_id} not found')
+        return position
+    return batch_index(items, params[index_field], label)
+
+def batch_move(file, items, params, label):
+    index = batch_find(file, items, params, label)
+    if 'to' in params:
+        target = params['to']
+        if isinstance(target, bool) or not isinstance(target, int) or not 0 <= target < len(items):
+            raise BatchError(f'Cannot move {label.lower()} to position {target}')
+    elif params.get('direction') == 'up':
+        target = max(index - 1, 0)
+    elif params.get('direction') == 'down':
+        target = min(index + 1, len(items) - 1)
+    else:
+        raise BatchError('Moving needs "to" or a direction of "up" or "down"')
+    items.insert(target, items.pop(index))
+    return f'Moved {label.lower()} {index} to {target}'
+
+def batch_material(params):
+    if not params['name'] or not params['url'] or not isinstance(params['url'], str):
+        raise BatchError('Materials need a name and a URL')
+    return {'name': params['name'], 'url': normalize_material_url(params['url'])}
+
+def batch_materials(raw_materials):
+    if not valid_materials(raw_materials):
+        raise BatchError(INVALID_MATERIALS_MESSAGE)
+    return normalize_materials(raw_materials)
+
+def batch_lecture_sequence(schedule_data):
+    sequence = build_lecture_sequence(schedule_data)
+    schedule_data['lecture_sequence'] = sequence
+    return sequence
+
+@batch_operations.register('lecture.add', 'schedule_file')
+def batch_add_lecture(schedule_data, params):
+    sequence = batch_lecture_sequence(schedule_data)
+    position = params.get('index', len(sequence))
+    if isinstance(position, bool) or not isinstance(position, int) or not 0 <= position <= len(sequence):
+        raise BatchError(f'Cannot insert a lecture at position {position}')
+    sequence.insert(position, {
+        'topic': params['topic'],
+        'materials': batch_materials(params.get('materials', []))
+    })
+    return f'Added lecture {position}'
+
+@batch_operations.register('lecture.update', 'schedule_file')
+def batch_update_lecture(schedule_data, params):
+    sequence = batch_lecture_sequence(schedule_data)
+    index = batch_find('schedule_file', sequence, params, 'Lecture')
+    lecture = sequence[index]
+    sequence[index] = entity_ids.keep_id(lecture, {
+        'topic': params.get('topic', lecture.get('topic')),
+        'materials': batch_materials(params['materials']) if 'materials' in params else lecture.get('materials', [])
+    })
+    return f'Updated lecture {index}'
+
+@batch_operations.register('lecture.delete', 'schedule_file')
+def batch_delete_lecture(schedule_data, params):
+    sequence = batch_lecture_sequence(schedule_data)
+    index = batch_find('schedule_file', sequence, params, 'Lecture')
+    sequence.pop(index)
+    return f'Removed lecture {index}'
+
+@batch_operations.register('lecture.move', 'schedule_file')
+def batch_move_lecture(schedule_data, params):
+    return batch_move('schedule_file', batch_lecture_sequence(schedule_data), params, 'Lecture')
+
+@batch_operations.register('lecture.add_material', 'schedule_file')
+def batch_add_lecture_material(schedule_data, params):
+    sequence = batch_lecture_sequence(schedule_data)
+    lecture_index = batch_find('schedule_file', sequence, params, 'Lecture', 'lecture_id', 'lecture_index')
+    sequence[lecture_index].setdefault('materials', []).append(batch_material(params))
+    return f'Added material to lecture {lecture_index}'
+
+@batch_operations.register('lecture.delete_material', 'schedule_file')
+def batch_delete_lecture_material(schedule_data, params):
+    sequence = batch_lecture_sequence(schedule_data)
+    lecture_index = batch_find('schedule_file', sequence, params, 'Lecture', 'lecture_id', 'lecture_index')
+    materials = sequence[lecture_index].get('materials', [])
+    index = batch_find('schedule_file', materials, params, 'Material')
+    materials.pop(index)
+    return f'Removed material {index} from lecture {lecture_index}'
+
+@batch_operations.register('event.add', 'additional_events_file')
+def batch_add_event(additional_events_data, params):
+    add_event(
+        additional_events_data, params['date'], params['type'], params['topic'],
+        batch_materials(params.get('materials', [])),
+        str(params.get('due_in_value') or '').strip(), params.get('due_in_unit') or 'days'
+    )
+    return f'Added event "{params["topic"]}"'
+
+@batch_operations.register('event.update', 'additional_events_file')
+def batch_update_event(additional_events_data, params):
+    events_list = additional_events_data.get('additional_events') or []
+    index = batch_find('additional_events_file', events_list, params, 'Event')
+    event = events_list[index]
+    update_event(
+        additional_events_data, index,
+        params.get('date', event.get('date')),
+        params.get('type', event.get('type')),
+        params.get('topic', event.get('topic')),
+        batch_materials(params['materials']) if 'materials' in params else event.get('materials', []),
+        str(params.get('due_in_value', event.get('due_in_value')) or '').strip(),
+        params.get('due_in_unit', event.get('due_in_unit')) or 'days'
+    )
+    return f'Updated event {index}'
+
+@batch_operations.register('event.delete', 'additional_events_file')
+def batch_delete_event(additional_events_data, params):
+    events_list = additional_events_data.get('additional_events') or []
+    index = batch_find('additional_events_file', events_list, params, 'Event')
+    removed = delete_event(additional_events_data, index)
+    if removed > 1:
+        return f'Removed event {index} and {removed - 1} linked due event(s)'
+    return f'Removed event {index}'
+
+@batch_operations.register('event.add_material', 'additional_events_file')
+def batch_add_event_material(additional_events_data, params):
+    events_list = additional_events_data.get('additional_events') or []
+    event_index = batch_find('additional_events_file', events_list, params, 'Event', 'event_id', 'event_index')
+    events_list[event_index].setdefault('materials', []).append(batch_material(params))
+    return f'Added material to event {event_index}'
+
+@batch_operations.register('event.delete_material', 'additional_events_file')
+def batch_delete_event_material(additional_events_data, params):
+    events_list = additional_events_data.get('additional_events') or []
+    event_index = batch_find('additional_events_file', events_list, params, 'Event', 'event_id', 'event_index')
+    materials = events_list[event_index].get('materials', [])
+    index = batch_find('additional_events_file', materials, params, 'Material')
+    materials.pop(index)
+    return f'Removed material {index} from event {event_index}'
+
+def batch_assignment(params):
+    return {
+        'title': params['title'],
+        'link': params.get('link', ''),
+        'description': params.get('description', '')
+    }
+
+@batch_operations.register('assignments.update_intro', 'assignments_file')
+def batch_update_assignments_intro(data, params):
+    data['intro'] = str(params.get('intro', '')).strip()
+    return 'Updated assignments intro'
+
+@batch_operations.register('assignment.add', 'assignments_file')
+def batch_add_assignment(data, params):
+    data.setdefault('assignments', []).append(batch_assignment(params))
+    return f'Added assignment "{params["title"]}"'
+
+@batch_operations.register('assignment.update', 'assignments_file')
+def batch_update_assignment(data, params):
+    items = data.setdefault('assignments', [])
+    index = batch_find('assignments_file', items, params, 'Assignment')
+    items[index] = entity_ids.keep_id(items[index], batch_assignment(params))
+    return f'Updated assignment {index}'
+
+@batch_operations.register('assignment.delete', 'assignments_file')
+def batch_delete_assignment(data, params):
+    items = data.setdefault('assignments', [])
+    index = batch_find('assignments_file', items, params, 'Assignment')
+    items.pop(index)
+    return f'Removed assignment {index}'
+
+@batch_operations.register('assignment.move', 'assignments_file')
+def batch_move_assignment(data, params):
+    return batch_move('assignments_file', data.setdefault('assignments', []), params, 'Assignment')
+
+def batch_home_module(params):
+    return {
+        'type': params['module_type'],
+        'title': str(params.get('title', '')).strip(),
+        'body': str(params.get('body', '')).strip()
+    }
+
+@batch_operations.register('module.add', 'home_modules_file')
+def batch_add_home_module(modules_data, params):
+    modules_data.setdefault('modules', []).append(batch_home_module(params))
+    return 'Added home module'
+
+@batch_operations.register('module.update', 'home_modules_file')
+def batch_update_home_module(modules_data, params):
+    modules = modules_data.setdefault('modules', [])
+    index = batch_find('home_modules_file', modules, params, 'Module')
+    modules[index] = entity_ids.keep_id(modules[index], batch_home_module(params))
+    return f'Updated home module {index}'
+
+@batch_operations.register('module.delete', 'home_modules_file')
+def batch_delete_home_module(modules_data, params):
+    modules = modules_data.setdefault('modules', [])
+    index = batch_find('home_modules_file', modules, params, 'Module')
+    modules.pop(index)
+    return f'Removed home module {index}'
+
+@batch_operations.register('module.move', 'home_modules_file')
+def batch_move_home_module(modules_data, params):
+    return batch_move('home_modules_file', modules_data.setdefault('modules', []), params, 'Module')
+
+@app.route('/jobs/<job_id>')
+@require_auth
+def job_status(job_id):
+    job = job_queue.status(job_id)
+    if job is None or job['site'] != site.name:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/jobs/rebuild_caches', methods=['POST'])
+@require_auth
+def rebuild_caches():
+    job = submit_job('caches.rebuild', rebuild_derived_caches)
+    return job_response(job, 'Rebuilding caches')
+
+def rebuild_derived_caches(job):
+    """Rebuild everything derived from the data files and uploads, e.g. after editing them by hand."""
+    steps = [
+        ('upload listing', lambda: (
+            site.upload_snapshot.invalidate(),
+            site.pdf_metadata_cache.metadata_for(site.upload_snapshot.listing())
+        )),
+        ('material usage index', site.material_usage.rebuild),
+        ('compiled schedule', site.schedule_compiler.compile),
+        ('image variants', site.image_pipeline.backfill),
+    ]
+    for position, (name, rebuild) in enumerate(steps):
+        job.progress(position, len(steps), f'Rebuilding {name}')
+        rebuild()
+    job.progress(len(steps), len(steps))
+    return {'message': 'Rebuilt ' + ', '.join(name for name, _ in steps)}
+
+def metrics_authorized():
+    if 'authenticated' in request.cookies:
+        return True
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(METRICS_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(token.strip(), METRICS_TOKEN)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Not @require_auth: there is no login page to send a scraper to outside
+    # of a course site.
+    if not metrics_authorized():
+        return app.response_class('Unauthorized\n', status=401, content_type='text/plain; charset=utf-8',
+                                  headers={'WWW-Authenticate': 'Bearer'})
+    return app.response_class(
+        metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+@app.route('/api/batch', methods=['POST'])
+@require_auth
+def apply_batch():
+    data = request.get_json(silent=True) or {}
+    try:
+        results, written = batch_operations.run(
+            data.get('operations'),
+            {name: (getattr(site, name), load) for name, load in BATCH_LOADERS.items()}
+        )
+    except BatchError as e:
+        response = {'success': False, 'message': e.message}
+        if e.position is not None:
+            response['message'] = f'Operation {e.position + 1}: {e.message}. No changes were saved.'
+            response['failed_operation'] = e.position
+        return jsonify(response), 400
+
+    return jsonify({
+        'success': True,
+        'message': f'Applied {len(results)} operation(s)',
+        'results': results,
+        'files': [os.path.relpath(path, site.root) for path in written]
+    })
+
 if __name__ == '__main__':
-    # Create data directory if it doesn't exist
-    os.makedirs(DATA_DIR, exist_ok=True)
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    os.makedirs(PHOTO_UPLOAD_DIR, exist_ok=True)
-    os.makedirs(TEXTBOOK_UPLOAD_DIR, exist_ok=True)
-    app.run(debug=True, host='0.0.0.0', port=8080)
+    # Create data directories if they don't exist
+    for course in course_sites.values():
+        os.makedirs(course.data_dir, exist_ok=True)
+        os.makedirs(course.upload_dir, exist_ok=True)
+        os.makedirs(course.photo_upload_dir, exist_ok=True)
+        os.makedirs(course.textbook_upload_dir, exist_ok=True)
+
+    import run
+    run.serve(app, run.parse_args())
@@ -0,0 +1,84 @@
+"""
+All-or-nothing batches of edits to the dashboard's YAML data files.
+
+Each operation is a dict whose "op" names a registered handler; the other
+keys are its parameters. A handler is bound to the name of the data file it
+edits, which run() maps to the file of the current site, and is called as
+handler(document, params) with the parsed document, which it mutates in
+place, returning a short description of what it did.
+
+A batch locks every file its operations touch, loads each one once, runs
+the operations in order against those in-memory documents and then writes
+each changed file once. Later operations see the effects of earlier ones,
+so indexes refer to the state after the previous operation, while ids (see
+entity_ids.py) name the same entry throughout. If any operation fails,
+nothing is written.
+"""
+
+import storage
+
+
+class BatchError(Exception):
+    def __init__(self, message, position=None):
+        super().__init__(message)
+        self.message = message
+        self.position = position
+
+
+class BatchOperations:
+
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, name, file):
+        """Decorator registering handler(document, params) for operation name on the named file."""
+        def decorator(handler):
+            self._handlers[name] = (file, handler)
+            return handler
+        return decorator
+
+    def names(self):
+        return sorted(self._handlers)
+
+    def run(self, operations, files):
+        """Apply operations and save the result.
+
+        files maps each file name handlers were registered with to its
+        (path, load), where load() returns a fresh copy of the document.
+
+        Returns the list of handler results and the paths that were written.
+        Raises BatchError, with the position of the failing operation, if
+        the batch is malformed or an operation cannot be applied.
+        """
+        if not isinstance(operations, list) or not operations:
+            raise BatchError('operations must be a non-empty list')
+        for position, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                raise BatchError('Each operation must be an object', position)
+            if operation.get('op') not in self._handlers:
+                raise BatchError(f'Unknown operation "{operation.get("op")}"', position)
+
+        names = {self._handlers[operation['op']][0] for operation in operations}
+        with storage.locked(*(files[name][0] for name in names)):
+            originals = {name: files[name][1]() for name in names}
+            documents = {name: files[name][1]() for name in names}
+            results = []
+            for position, operation in enumerate(operations):
+                name, handler = self._handlers[operation['op']]
+                params = {key: value for key, value in operation.items() if key != 'op'}
+                try:
+                    results.append(handler(documents[name], params))
+                except BatchError as error:
+                    raise BatchError(error.message, position)
+                except KeyError as error:
+                    raise BatchError(f'Missing parameter {error}', position)
+                except (TypeError, ValueError) as error:
+                    raise BatchError(f'Invalid parameters: {error}', position)
+
+            changed = {
+                files[name][0]: documents[name]
+                for name in sorted(names) if documents[name] != originals[name]
+            }
+            if changed:
+                storage.save_yaml_many(changed)
+        return results, list(changed)
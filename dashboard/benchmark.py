@@ -0,0 +1,214 @@
+"""
+Benchmarks the dashboard's helpers and routes on a synthetic course site.
+
+By default a site is generated in a temporary directory at the scale given
+by the synthetic_site options; --site benchmarks an existing tree instead.
+Every case runs once to warm up and is then timed --iterations times. The
+report lists latency percentiles in milliseconds and the number of YAML
+files parsed per call, taken from storage.stats().
+
+    python benchmark.py                              # default scale
+    python benchmark.py --uploads 50000 --output after.json
+    python benchmark.py --baseline before.json       # compare against a saved run
+
+With --baseline, cases whose median got slower by more than --threshold are
+reported as regressions and the exit status is 1.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from synthetic_site import add_scale_arguments, generate_site
+
+
+def percentile(sorted_samples, fraction):
+    index = max(0, min(len(sorted_samples) - 1, round(fraction * len(sorted_samples) + 0.5) - 1))
+    return sorted_samples[index]
+
+
+def measure(storage, run, iterations, before=None):
+    run()
+    samples = []
+    parses = 0
+    for _ in range(iterations):
+        if before is not None:
+            before()
+        parses_before = storage.stats()['parses']
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+        parses += storage.stats()['parses'] - parses_before
+    samples.sort()
+    return {
+        'iterations': iterations,
+        'min_ms': samples[0],
+        'mean_ms': sum(samples) / len(samples),
+        'p50_ms': percentile(samples, 0.50),
+        'p90_ms': percentile(samples, 0.90),
+        'p99_ms': percentile(samples, 0.99),
+        'max_ms': samples[-1],
+        'yaml_parses': parses / iterations,
+    }
+
+
+def build_cases(app_module):
+    """Return (name, run, before) for every benchmark case."""
+    storage = app_module.storage
+    client = app_module.app.test_client()
+    client.set_cookie('authenticated', 'true')
+
+    def get(path):
+        def run():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {path} returned {response.status_code}')
+        return run
+
+    schedule_data = app_module.load_yaml_file('course_schedule.yml')
+    sequence = app_module.build_lecture_sequence(schedule_data)
+    referenced = [
+        material['url'].rsplit('/', 1)[-1]
+        for lecture in sequence
+        for material in lecture.get('materials') or []
+    ]
+    renames = [referenced[0], f'renamed_{referenced[0]}'] if referenced else None
+
+    def rename_references():
+        with storage.locked(app_module.site.schedule_file, app_module.site.additional_events_file):
+            app_module.replace_material_references(renames[0], renames[1])
+        renames.reverse()
+
+    moves = [{'from': 0, 'to': 1}]
+
+    def reorder_lectures():
+        response = client.post('/reorder_lectures', json=moves[0])
+        if response.status_code != 200:
+            raise RuntimeError(f'POST /reorder_lectures returned {response.status_code}')
+
+    cases = [
+        ('load_yaml_file (cached)', lambda: app_module.load_yaml_file('course_schedule.yml'), None),
+        ('load_yaml_file (sidecar)', lambda: app_module.load_yaml_file('course_schedule.yml'),
+         lambda: storage.invalidate(app_module.site.schedule_file)),
+        ('load_yaml_file (parse)', lambda: app_module.load_yaml_file('course_schedule.yml'),
+         lambda: (storage.invalidate(app_module.site.schedule_file), storage.clear_sidecars())),
+        ('build_lecture_sequence', lambda: app_module.build_lecture_sequence(schedule_data), None),
+        ('material usage index rebuild', app_module.site.material_usage.rebuild, None),
+        ('collect_uploaded_files', lambda: app_module.collect_uploaded_files(), None),
+        ('collect_uploaded_files (page of 200)',
+         lambda: app_module.collect_uploaded_files(limit=200, include_usages=False), None),
+        ('collect_uploaded_files (rescan)', lambda: app_module.collect_uploaded_files(),
+         lambda: app_module.site.upload_snapshot.invalidate()),
+        ('compile schedule', app_module.site.schedule_compiler.compile, None),
+    ]
+    if renames:
+        cases.append(('replace_material_references', rename_references, None))
+    cases += [
+        ('GET /schedule', get('/schedule'), None),
+        ('GET /events', get('/events'), None),
+        ('GET /material-library', get('/material-library'), None),
+        ('GET /get_uploaded_files', get('/get_uploaded_files'), None),
+        ('GET /get_uploaded_files?limit=200&usages=0', get('/get_uploaded_files?limit=200&usages=0'), None),
+        ('GET /home', get('/home'), None),
+        ('GET /assignments', get('/assignments'), None),
+        ('POST /reorder_lectures', reorder_lectures, None),
+    ]
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """Print each case next to its baseline; return the names of regressed cases."""
+    regressions = []
+    print(f'\n{"case":45} {"p50 ms":>10} {"baseline":>10} {"change":>8}')
+    for name, stats in results['cases'].items():
+        before = baseline['cases'].get(name)
+        if before is None:
+            print(f'{name:45} {stats["p50_ms"]:10.3f} {"-":>10} {"new":>8}')
+            continue
+        ratio = stats['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  SLOWER'
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            flag = '  faster'
+        print(f'{name:45} {stats["p50_ms"]:10.3f} {before["p50_ms"]:10.3f} {ratio:7.2f}x{flag}')
+    if baseline.get('scale') != results.get('scale'):
+        print('\nNote: the baseline was taken at a different scale or on a different site.')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the course dashboard')
+    parser.add_argument('--site', help='Benchmark an existing site instead of generating one')
+    add_scale_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=20, help='Timed runs per case')
+    parser.add_argument('--only', help='Run only cases whose name contains this text')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against results saved with --output')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Median slowdown ratio reported as a regression')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated site')
+    options = parser.parse_args(argv)
+
+    generated = None
+    scale = None
+    if options.site:
+        site = os.path.abspath(options.site)
+    else:
+        generated = site = tempfile.mkdtemp(prefix='dashboard-bench-')
+        print(f'Generating synthetic site in {site} ...')
+        scale = generate_site(
+            site, options.lectures, options.events, options.materials,
+            options.uploads, options.pdf_share, options.seed
+        )
+
+    try:
+        # The dashboard reads its site location when app is imported.
+        os.environ['DASHBOARD_SITE_ROOT'] = site
+        app_module = importlib.import_module('app')
+        storage = app_module.storage
+
+        results = {
+            'site': None if generated else site,
+            'scale': scale,
+            'python': platform.python_version(),
+            'cases': {},
+        }
+        print(f'\n{"case":45} {"p50":>9} {"p90":>9} {"p99":>9} {"max":>9} {"parses":>7}')
+        for name, run, before in build_cases(app_module):
+            if options.only and options.only not in name:
+                continue
+            stats = measure(storage, run, options.iterations, before)
+            results['cases'][name] = stats
+            print(f'{name:45} {stats["p50_ms"]:9.3f} {stats["p90_ms"]:9.3f} '
+                  f'{stats["p99_ms"]:9.3f} {stats["max_ms"]:9.3f} {stats["yaml_parses"]:7.2f}')
+
+        if options.output:
+            with open(options.output, 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+            print(f'\nResults written to {options.output}')
+
+        if options.baseline:
+            with open(options.baseline, 'r', encoding='utf-8') as file:
+                baseline = json.load(file)
+            regressions = compare(results, baseline, options.threshold)
+            if regressions:
+                print(f'\n{len(regressions)} case(s) slower than {options.threshold}x the baseline')
+                return 1
+        return 0
+    finally:
+        if generated and not options.keep:
+            shutil.rmtree(generated, ignore_errors=True)
+        elif generated:
+            print(f'\nSynthetic site kept in {generated}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
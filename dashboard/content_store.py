@@ -0,0 +1,231 @@
+"""
+Content-addressed deduplication for the upload folder.
+
+Jekyll serves uploads straight from static_files/uploads, so every name has
+to stay a regular file there. Identical files are stored once and shared via
+hardlinks instead. A JSON index in the upload folder maps each filename to
+the SHA-256 of its bytes plus the stat identity it had when it was recorded;
+entries whose file has since changed or vanished are ignored and dropped.
+
+Files must only ever be replaced by rename, never rewritten in place, since
+an in-place write would change every name that shares the inode.
+
+Names that share an inode also share its mtime, so a file uploaded today
+as a copy of an old one would look old. Each entry therefore also records
+when its name was uploaded, which upload_times() reports for sorting.
+"""
+
+import json
+import os
+import time
+
+import storage
+from uploads import file_sha256
+
+INDEX_FILENAME = '.content-index.json'
+
+
+def index_path(upload_dir):
+    return os.path.join(upload_dir, INDEX_FILENAME)
+
+
+def _load(upload_dir):
+    try:
+        with open(index_path(upload_dir), 'r', encoding='utf-8') as file:
+            return json.load(file).get('files', {})
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save(upload_dir, entries):
+    storage.atomic_write(index_path(upload_dir), json.dumps({'files': entries}, sort_keys=True))
+
+
+def _identity(stat):
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'ino': stat.st_ino}
+
+
+def _entry_is_current(upload_dir, name, entry):
+    try:
+        stat = os.stat(os.path.join(upload_dir, name))
+    except FileNotFoundError:
+        return False
+    return _identity(stat) == {key: entry.get(key) for key in ('size', 'mtime_ns', 'ino')}
+
+
+def _record(upload_dir, entries, name, digest, uploaded_ns=None):
+    """Record name's digest and current identity; uploaded_ns defaults to the time already recorded, else its mtime."""
+    stat = os.stat(os.path.join(upload_dir, name))
+    if uploaded_ns is None:
+        uploaded_ns = (entries.get(name) or {}).get('uploaded_ns', stat.st_mtime_ns)
+    entries[name] = {'sha256': digest, **_identity(stat), 'uploaded_ns': uploaded_ns}
+
+
+def _scan(upload_dir, is_material, entries):
+    """Hash every material file that has no current index entry."""
+    entries = dict(entries or {})
+    present = set()
+    for dir_entry in os.scandir(upload_dir):
+        if not dir_entry.is_file() or not is_material(dir_entry.name):
+            continue
+        present.add(dir_entry.name)
+        entry = entries.get(dir_entry.name)
+        if entry is None or not _entry_is_current(upload_dir, dir_entry.name, entry):
+            _record(upload_dir, entries, dir_entry.name, file_sha256(dir_entry.path),
+                    dir_entry.stat().st_mtime_ns)
+    return {name: entry for name, entry in entries.items() if name in present}
+
+
+def _load_or_scan(upload_dir, is_material):
+    entries = _load(upload_dir)
+    if entries is None:
+        entries = _scan(upload_dir, is_material, {})
+    return entries
+
+
+def _find_copy(upload_dir, entries, digest, exclude):
+    for name, entry in list(entries.items()):
+        if name == exclude or entry.get('sha256') != digest:
+            continue
+        if _entry_is_current(upload_dir, name, entry):
+            return name
+        del entries[name]
+    return None
+
+
+def _same_file(path, other_path):
+    try:
+        return os.path.samefile(path, other_path)
+    except FileNotFoundError:
+        return False
+
+
+def store(upload_dir, source_path, filename, is_material, digest=None):
+    """Move source_path into the upload folder as filename.
+
+    If a file with the same bytes is already stored under another name, the
+    new name becomes a hardlink to it and source_path is discarded. Returns
+    the SHA-256 and the names of any existing files with identical content.
+    """
+    digest = digest or file_sha256(source_path)
+    target_path = os.path.join(upload_dir, filename)
+
+    with storage.locked(index_path(upload_dir)):
+        entries = _load_or_scan(upload_dir, is_material)
+        existing = _find_copy(upload_dir, entries, digest, exclude=filename)
+
+        linked = False
+        if existing is not None and _same_file(os.path.join(upload_dir, existing), target_path):
+            # Already a link to the copy; replacing a name with a link to its
+            # own inode would do nothing and leave the link behind.
+            os.remove(source_path)
+            linked = True
+        elif existing is not None:
+            link_path = source_path + '.link'
+            try:
+                os.link(os.path.join(upload_dir, existing), link_path)
+            except OSError:
+                pass
+            else:
+                os.replace(link_path, target_path)
+                os.remove(source_path)
+                linked = True
+        if not linked:
+            os.replace(source_path, target_path)
+
+        _record(upload_dir, entries, filename, digest, time.time_ns())
+        duplicates = sorted(
+            name for name, entry in entries.items()
+            if name != filename and entry.get('sha256') == digest
+        )
+        _save(upload_dir, entries)
+
+    return {'sha256': digest, 'duplicate_of': duplicates, 'linked': linked}
+
+
+def _current_entries(upload_dir, stats):
+    entries = _load(upload_dir) or {}
+    current = {}
+    for name, file_stat in stats.items():
+        entry = entries.get(name)
+        if entry is not None and _identity(file_stat) == {key: entry.get(key) for key in ('size', 'mtime_ns', 'ino')}:
+            current[name] = entry
+    return current
+
+
+def current_digests(upload_dir, stats):
+    """Map each name in stats to its recorded SHA-256, if the index entry still matches the stat."""
+    return {name: entry['sha256'] for name, entry in _current_entries(upload_dir, stats).items()}
+
+
+def upload_times(upload_dir, stats):
+    """Map each name in stats to when it was uploaded, in ns, or its mtime if the index does not say."""
+    current = _current_entries(upload_dir, stats)
+    return {
+        name: current.get(name, {}).get('uploaded_ns', file_stat.st_mtime_ns)
+        for name, file_stat in stats.items()
+    }
+
+
+def record_digest(upload_dir, name, digest, file_stat):
+    """Record a digest computed elsewhere, provided the file has not changed since file_stat."""
+    with storage.locked(index_path(upload_dir)):
+        entries = _load(upload_dir)
+        # Without an index the next store() hashes the whole folder anyway.
+        if entries is None or not _entry_is_current(upload_dir, name, _identity(file_stat)):
+            return
+        uploaded_ns = (entries.get(name) or {}).get('uploaded_ns', file_stat.st_mtime_ns)
+        entries[name] = {'sha256': digest, **_identity(file_stat), 'uploaded_ns': uploaded_ns}
+        _save(upload_dir, entries)
+
+
+def rename(upload_dir, old_name, new_name):
+    with storage.locked(index_path(upload_dir)):
+        entries = _load(upload_dir)
+        if entries is None:
+            return
+        entry = entries.pop(old_name, None)
+        entries.pop(new_name, None)
+        if entry is not None:
+            entries[new_name] = entry
+        _save(upload_dir, entries)
+
+
+def forget(upload_dir, name):
+    with storage.locked(index_path(upload_dir)):
+        entries = _load(upload_dir)
+        if entries is None or name not in entries:
+            return
+        del entries[name]
+        _save(upload_dir, entries)
+
+
+def deduplicate(upload_dir, is_material):
+    """Re-index the folder and hardlink together files with identical bytes.
+
+    Returns the number of files relinked and the bytes that freed up.
+    """
+    relinked = 0
+    reclaimed = 0
+    with storage.locked(index_path(upload_dir)):
+        entries = _scan(upload_dir, is_material, _load(upload_dir))
+        canonical = {}
+        for name in sorted(entries):
+            entry = entries[name]
+            first = canonical.setdefault(entry['sha256'], name)
+            if first == name or entry['ino'] == entries[first]['ino']:
+                continue
+            path = os.path.join(upload_dir, name)
+            link_path = os.path.join(upload_dir, f'.{name}.link')
+            last_link = os.stat(path).st_nlink == 1
+            try:
+                os.link(os.path.join(upload_dir, first), link_path)
+            except OSError:
+                continue
+            os.replace(link_path, path)
+            if last_link:
+                reclaimed += entry['size']
+            relinked += 1
+            _record(upload_dir, entries, name, entry['sha256'])
+        _save(upload_dir, entries)
+    return {'relinked': relinked, 'reclaimed_bytes': reclaimed}
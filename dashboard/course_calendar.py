@@ -0,0 +1,203 @@
+"""
+Dates, weeks and class days of the course schedule.
+
+course_schedule.yml describes the semester (start and end dates, the class
+days and holidays) and keeps lectures either as a flat lecture_sequence or,
+in older files, as a list of weeks mapping class days to lectures:
+
+    lectures:
+    - week: 1
+      tuesday: {topic: Introduction, materials: []}
+      thursday: {topic: Sockets, materials: []}
+
+CourseCalendar reads those once into indexed structures: the weeks by
+number, the class days in order, the holidays as a set and, on first use,
+the list of class dates. Its edits to the weeks (changing class days,
+filling missing days, generating weeks) work in place on the schedule
+document and touch each week once, so they take linear time however long
+the semester is.
+
+Every other module asks this one about dates and weeks: the schedule
+compiler for the dated schedule, and app.py for class-day changes and the
+due dates of assignments.
+"""
+
+from datetime import date, timedelta
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# The Liquid version of the schedule scanned at most this many days past
+# semester_start.
+MAX_SEMESTER_DAYS = 366
+
+
+def parse_date(value):
+    """Return the date an ISO date string stands for, or None."""
+    try:
+        return date.fromisoformat(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def shift_date(value, amount, unit='days'):
+    """Return the ISO date amount days, or weeks if unit is 'weeks', after value.
+
+    Raises ValueError if value is not an ISO date.
+    """
+    days = amount * 7 if unit == 'weeks' else amount
+    return (date.fromisoformat(str(value).strip()) + timedelta(days=days)).isoformat()
+
+
+def day_label(day):
+    return f'{day:%m/%d} {day:%a}'
+
+
+def placeholder_lecture():
+    return {'topic': 'TBD', 'materials': []}
+
+
+def build_lecture_sequence(schedule_data):
+    sequence = schedule_data.get('lecture_sequence')
+    if sequence:
+        return sequence
+
+    class_days = schedule_data.get('course_schedule', {}).get('class_days', [])
+    day_order = [day.get('day') for day in class_days if day.get('day')]
+    if not day_order:
+        day_order = WEEKDAYS
+
+    sequence = []
+    for lecture_week in schedule_data.get('lectures', []):
+        for day in day_order:
+            if day in lecture_week and lecture_week[day]:
+                sequence.append({
+                    'topic': lecture_week[day].get('topic', 'TBD'),
+                    'materials': lecture_week[day].get('materials', [])
+                })
+
+    return sequence
+
+
+class CourseCalendar:
+
+    def __init__(self, schedule_data):
+        """Index schedule_data, the parsed course_schedule.yml, which edits then change in place."""
+        self.schedule_data = schedule_data
+        course_schedule = schedule_data.get('course_schedule') or {}
+        self.start = parse_date(course_schedule.get('semester_start'))
+        self.end = parse_date(course_schedule.get('semester_end'))
+        self.class_days = [day.get('day') for day in course_schedule.get('class_days') or [] if day.get('day')]
+        self.holidays = {parse_date(holiday) for holiday in course_schedule.get('holidays') or []} - {None}
+        self._dates = None
+        # Week number -> the first entry of lectures with that number, which
+        # is the one edits to that week go to.
+        self.weeks = {}
+        for week in self.lectures:
+            self.weeks.setdefault(week.get('week'), week)
+
+    @property
+    def lectures(self):
+        return self.schedule_data.get('lectures') or []
+
+    def class_dates(self):
+        """Return (class dates, holiday dates that fall on a class day)."""
+        if self._dates is None:
+            dates, cancelled = [], []
+            if self.start is not None and self.end is not None:
+                weekdays = {
+                    WEEKDAYS.index(str(day).lower()) for day in self.class_days if str(day).lower() in WEEKDAYS
+                }
+                for offset in range(MAX_SEMESTER_DAYS):
+                    day = self.start + timedelta(days=offset)
+                    if day > self.end:
+                        break
+                    if day.weekday() in weekdays:
+                        (cancelled if day in self.holidays else dates).append(day)
+            self._dates = (dates, cancelled)
+        return self._dates
+
+    def week_number(self, day):
+        """Number of the semester week day falls in; weeks start on Monday and week 1 holds semester_start."""
+        first_week_start = self.start - timedelta(days=self.start.weekday())
+        return max((day - first_week_start).days // 7 + 1, 1)
+
+    def week_range(self, number):
+        """Return the Monday and Sunday of semester week number."""
+        week_start = self.start - timedelta(days=self.start.weekday()) + timedelta(weeks=number - 1)
+        return week_start, week_start + timedelta(days=6)
+
+    def remove_days(self, days):
+        """Remove the lectures of days from every week and drop weeks left empty.
+
+        Returns the removed lectures as (week number, lecture), by week and
+        then in the order of days.
+        """
+        removed = []
+        for week in self.lectures:
+            for day in days:
+                if day in week:
+                    removed.append((week['week'], week.pop(day)))
+        if 'lectures' in self.schedule_data:
+            self.schedule_data['lectures'] = [week for week in self.lectures if len(week) > 1]
+            self.weeks = {}
+            for week in self.lectures:
+                self.weeks.setdefault(week.get('week'), week)
+        return removed
+
+    def remove_other_days(self):
+        """Remove the lectures of days that are not class days; returns how many were removed."""
+        class_days = set(self.class_days)
+        other_days = {day for week in self.lectures for day in week if day != 'week' and day not in class_days}
+        return len(self.remove_days(sorted(other_days)))
+
+    def assign(self, lectures, days):
+        """Put (week number, lecture) pairs on days in turn, adding weeks that no longer exist.
+
+        Returns how many lectures were placed.
+        """
+        for position, (number, lecture) in enumerate(lectures):
+            week = self.weeks.get(number)
+            if week is None:
+                week = self.weeks[number] = {'week': number}
+                self.schedule_data.setdefault('lectures', []).append(week)
+            week[days[position % len(days)]] = lecture
+        return len(lectures)
+
+    def add_placeholders(self, days):
+        """Add a placeholder lecture on each of days to every week without one; returns how many."""
+        added = 0
+        for number in sorted(self.weeks):
+            week = self.weeks[number]
+            for day in days:
+                if day not in week:
+                    week[day] = placeholder_lecture()
+                    added += 1
+        return added
+
+    def fill_missing_days(self):
+        """Add a placeholder lecture for every class day missing from a week entry; returns how many."""
+        filled = 0
+        for week in self.lectures:
+            for day in self.class_days:
+                if day not in week:
+                    week[day] = placeholder_lecture()
+                    filled += 1
+        return filled
+
+    def generate_weeks(self, max_week):
+        """Add weeks 1 to max_week that do not exist yet, with placeholders on every class day.
+
+        Returns how many weeks were added; weeks are then sorted by number.
+        """
+        created = 0
+        for number in range(1, max_week + 1):
+            if number not in self.weeks:
+                week = {'week': number}
+                for day in self.class_days:
+                    week[day] = placeholder_lecture()
+                self.weeks[number] = week
+                self.schedule_data.setdefault('lectures', []).append(week)
+                created += 1
+        if 'lectures' in self.schedule_data:
+            self.schedule_data['lectures'].sort(key=lambda week: week['week'])
+        return created
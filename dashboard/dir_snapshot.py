@@ -0,0 +1,173 @@
+"""
+Cached listing of a directory, revalidated by the directory's own mtime.
+
+Creating, renaming or deleting an entry updates the directory's mtime, so a
+listing taken at a given (mtime_ns, inode) stays valid until that changes.
+Operations the dashboard performs itself go through changing(), which
+re-stats only the names they touched instead of rescanning everything.
+
+A listing is only trusted once its directory mtime is older than the racy
+window, since another change within the same timestamp tick would leave
+the mtime as it was. Until then it is checked before use: while the window
+lasts by a rescan, and after it by reading the directory's names and inode
+numbers once, without a stat per file, and comparing them to the listing.
+That check also catches files that other worker processes created, renamed
+or deleted while changing() was applying this worker's change.
+
+Each listing is immutable; changes install a new one with a higher version.
+Derived data such as sorted orders can be memoized on a listing and is
+dropped automatically when the listing is replaced.
+
+Files rewritten in place do not touch the directory mtime. The dashboard
+always replaces files by rename, but an external in-place edit only shows up
+after the next change to the directory or an explicit invalidate().
+"""
+
+import os
+import stat
+import threading
+import time
+from contextlib import contextmanager
+
+# A directory mtime this close to the scan time may be followed by another
+# change within the same timestamp tick, so such a scan is not trusted.
+# Filesystems that only record whole seconds get the wider window.
+RACY_WINDOW_NS = 20_000_000
+COARSE_RACY_WINDOW_NS = 2_000_000_000
+
+
+def _is_racy(mtime_ns, now_ns):
+    window = COARSE_RACY_WINDOW_NS if mtime_ns % 1_000_000_000 == 0 else RACY_WINDOW_NS
+    return now_ns - mtime_ns <= window
+
+
+class DirectoryListing:
+
+    __slots__ = ('files', 'version', '_memo', '_memo_lock')
+
+    def __init__(self, files, version):
+        self.files = files
+        self.version = version
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    def memo(self, key, compute):
+        with self._memo_lock:
+            if key in self._memo:
+                return self._memo[key]
+        value = compute()
+        with self._memo_lock:
+            return self._memo.setdefault(key, value)
+
+
+class DirectorySnapshot:
+
+    def __init__(self, path, include):
+        """include(name) decides which regular files are part of the listing."""
+        self.path = path
+        self._include = include
+        self._lock = threading.RLock()
+        self._listing = None
+        self._signature = None
+        self._trusted = False
+        self._version = 0
+        # listing() calls answered without a rescan, and directory scans.
+        self.hits = 0
+        self.scans = 0
+
+    def _directory_signature(self):
+        try:
+            dir_stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (dir_stat.st_mtime_ns, dir_stat.st_ino)
+
+    def _install(self, files, signature, trusted):
+        self._version += 1
+        self._listing = DirectoryListing(files, self._version)
+        self._signature = signature
+        self._trusted = trusted
+
+    def _scan(self):
+        self.scans += 1
+        signature = self._directory_signature()
+        files = {}
+        if signature is not None:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if self._include(entry.name) and entry.is_file():
+                        try:
+                            files[entry.name] = entry.stat()
+                        except FileNotFoundError:
+                            pass
+        trusted = signature is not None and not _is_racy(signature[0], time.time_ns())
+        self._install(files, signature, trusted)
+
+    def _names_match(self, files):
+        """Whether the directory holds exactly the files of a listing, by name and inode."""
+        try:
+            with os.scandir(self.path) as entries:
+                names = {
+                    entry.name: entry.inode() for entry in entries
+                    if self._include(entry.name) and entry.is_file()
+                }
+        except FileNotFoundError:
+            return False
+        return names == {name: file_stat.st_ino for name, file_stat in files.items()}
+
+    def listing(self):
+        """Return the current DirectoryListing, rescanning only if the directory changed."""
+        with self._lock:
+            signature = self._directory_signature()
+            if self._listing is None or signature != self._signature:
+                self._scan()
+            elif self._trusted:
+                self.hits += 1
+            elif signature is None or _is_racy(signature[0], time.time_ns()):
+                self._scan()
+            elif self._names_match(self._listing.files):
+                self._trusted = True
+                self.hits += 1
+            else:
+                self._scan()
+            return self._listing
+
+    def invalidate(self):
+        with self._lock:
+            self._listing = None
+
+    @contextmanager
+    def changing(self, *names):
+        """Wrap a change the dashboard makes to the given names.
+
+        Yields a set; names added to it are re-stated as well. The lock is
+        not held while the block runs. If the directory had already changed
+        before the block, or another thread installed a listing meanwhile,
+        the next listing() rescans instead; otherwise the changed listing
+        is installed untrusted, for listing() to check as described above.
+        """
+        touched = set(names)
+        with self._lock:
+            base = self.listing() if self._listing is not None else None
+            if base is not None and not self._trusted:
+                base = None
+        try:
+            yield touched
+        finally:
+            with self._lock:
+                if base is None or self._listing is not base:
+                    self._listing = None
+                else:
+                    signature = self._directory_signature()
+                    files = dict(base.files)
+                    for name in touched:
+                        files.pop(name, None)
+                        if not self._include(name):
+                            continue
+                        try:
+                            file_stat = os.stat(os.path.join(self.path, name))
+                        except FileNotFoundError:
+                            continue
+                        if stat.S_ISREG(file_stat.st_mode):
+                            files[name] = file_stat
+                    self._install(files, signature, False)
@@ -0,0 +1,149 @@
+"""
+Stable ids for the entries of the dashboard's data files.
+
+Lectures, events, their materials, home modules, assignments, textbooks,
+instructors and teaching assistants each carry a short "id" key:
+
+    lecture_sequence:
+    - id: 3f9c2a71
+      topic: Sockets
+      materials:
+      - id: 0b6e41d8
+        name: Slides
+        url: /static_files/lectures/sockets.pdf
+
+Pages send the id of the entry they edit, so an edit still reaches the same
+entry after another tab reordered or deleted entries before it. Positions
+are still accepted where no id is given.
+
+Ids are filled in by a storage save hook whenever the dashboard saves one
+of these files, so entries added by hand get theirs on the next save, and
+an entry whose id is missing or repeats another in the same file gets a new
+one. Edits that replace an entry pass the old id on with keep_id().
+
+EntityIds maps the ids of each file to their positions. The map is rebuilt
+from the saved document after each save and from the file when its
+signature changes otherwise. find() checks that position first and only
+searches the list when it no longer holds the entry, e.g. in a batch whose
+earlier operations moved things around.
+"""
+
+import threading
+from uuid import uuid4
+
+import storage
+
+
+def new_id(taken=()):
+    while True:
+        entity_id = uuid4().hex[:8]
+        if entity_id not in taken:
+            return entity_id
+
+
+def keep_id(old, new):
+    """Return new, which replaces old, under the id of old."""
+    entity_id = old.get('id') if isinstance(old, dict) else None
+    if not isinstance(entity_id, str) or not entity_id:
+        return new
+    return {'id': entity_id, **{key: value for key, value in new.items() if key != 'id'}}
+
+
+def find(items, entity_id, hint=None):
+    """Position in items of the entry with entity_id, trying position hint first, or None."""
+    if hint is not None and 0 <= hint < len(items):
+        item = items[hint]
+        if isinstance(item, dict) and item.get('id') == entity_id:
+            return hint
+    for position, item in enumerate(items):
+        if isinstance(item, dict) and item.get('id') == entity_id:
+            return position
+    return None
+
+
+def _entity_lists(data, lists):
+    """Yield (positions of the parent, list of entries) for the entity lists of data."""
+    if not isinstance(data, dict):
+        return
+    for key, child_key in lists:
+        items = data.get(key)
+        if not isinstance(items, list):
+            continue
+        yield (), items
+        if child_key:
+            for position, item in enumerate(items):
+                children = item.get(child_key) if isinstance(item, dict) else None
+                if isinstance(children, list):
+                    yield (position,), children
+
+
+class EntityIds:
+
+    def __init__(self, files):
+        """files maps a data file path to its entity lists, as (key, key of the entries' own entity list or None)."""
+        self._files = files
+        self._lock = threading.Lock()
+        self._signatures = {}
+        self._locations = {}
+        storage.add_save_hook(self.assign)
+        storage.add_save_listener(self._on_save)
+
+    def assign(self, path, data):
+        """Give every entry of data, the document at path, that lacks a unique id a new one; returns how many."""
+        lists = self._files.get(path)
+        if lists is None:
+            return 0
+        taken = set()
+        assigned = 0
+        for _, items in _entity_lists(data, lists):
+            for position, item in enumerate(items):
+                if not isinstance(item, dict):
+                    continue
+                entity_id = item.get('id')
+                if isinstance(entity_id, str) and entity_id and entity_id not in taken:
+                    taken.add(entity_id)
+                    continue
+                # A new dict, so entries YAML aliases share are not renamed together.
+                entity_id = new_id(taken)
+                taken.add(entity_id)
+                items[position] = {'id': entity_id, **{key: value for key, value in item.items() if key != 'id'}}
+                assigned += 1
+        return assigned
+
+    def position(self, path, entity_id):
+        """Position of the entry with entity_id in its list of the file at path, or None."""
+        with self._lock:
+            self._refresh(path)
+            location = self._locations.get(path, {}).get(entity_id)
+        return location[-1] if location else None
+
+    def _refresh(self, path):
+        try:
+            signature = storage.file_signature(path)
+        except FileNotFoundError:
+            signature = None
+        if path in self._signatures and self._signatures[path] == signature:
+            return
+        data = None
+        if signature is not None:
+            try:
+                data = storage.load_yaml(path)
+            except FileNotFoundError:
+                pass
+        self._build(path, data)
+        self._signatures[path] = signature
+
+    def _on_save(self, path, data, previous_signature, signature):
+        if path not in self._files:
+            return
+        with self._lock:
+            self._build(path, data)
+            self._signatures[path] = signature
+
+    def _build(self, path, data):
+        locations = {}
+        for parent, items in _entity_lists(data, self._files[path]):
+            for position, item in enumerate(items):
+                if isinstance(item, dict) and isinstance(item.get('id'), str):
+                    locations.setdefault(item['id'], parent + (position,))
+        self._locations[path] = locations
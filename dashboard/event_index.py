@@ -0,0 +1,195 @@
+"""
+Date order for additional_events.yml.
+
+The dashboard keeps the events list sorted by date. Edits used to append
+and then sort the whole list; insert() and reposition() instead put one
+event at its place with a binary search, exactly where a stable sort by
+date would have put it, so edits no longer grow with the length of the
+semester's history. A list found out of order, e.g. after a hand edit, is
+sorted once first.
+
+EventIndex answers date range queries for /api/events. It keeps the dates
+of all events in sorted order next to each event's position in the file,
+so a query bisects to the first and last date of the window and reads only
+the events in between. The index is rebuilt when the file's signature
+changes, and also tells edits whether the file is in date order, so they
+need not check that on every change.
+
+Homework and projects are linked to their due events by a group_id shared
+by both. EventLinks maps each group_id to the positions of its release and
+due events, so editing or deleting an assignment finds the due events to
+replace or remove without scanning the list. Due events from before
+group_ids existed are found by their "<topic> Due" topic in the same way.
+EventIndex keeps the links of the file next to its dates, and after a save
+made through storage it rebuilds both from the saved document instead of
+reading the file back.
+"""
+
+import bisect
+import operator
+import threading
+from itertools import islice
+
+import storage
+
+_date = operator.itemgetter('date')
+
+
+def date_key(event):
+    return str(event.get('date') or '')
+
+
+def is_date_ordered(events):
+    # Compares the plain dates in C first; dates that are missing or not all
+    # strings take the slower way through date_key.
+    try:
+        dates = list(map(_date, events))
+        return all(map(operator.le, dates, islice(dates, 1, None)))
+    except (KeyError, TypeError):
+        keys = [date_key(event) for event in events]
+        return all(map(operator.le, keys, islice(keys, 1, None)))
+
+
+# bisect only takes a key from Python 3.10 on.
+def _bisect_left(events, key, low=0):
+    high = len(events)
+    while low < high:
+        middle = (low + high) // 2
+        if date_key(events[middle]) < key:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _bisect_right(events, key, low=0):
+    high = len(events)
+    while low < high:
+        middle = (low + high) // 2
+        if key < date_key(events[middle]):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def is_due(event):
+    return str(event.get('type', '')).endswith('_due')
+
+
+def insert(events, event):
+    """Insert event into date-ordered events after the events of the same date."""
+    events.insert(_bisect_right(events, date_key(event)), event)
+
+
+def reposition(events, position):
+    """Move the event at position, whose date may have changed, to its place in otherwise date-ordered events.
+
+    Among events of the same date it keeps its position relative to the
+    others, like a stable sort would.
+    """
+    event = events.pop(position)
+    key = date_key(event)
+    low = _bisect_left(events, key)
+    high = _bisect_right(events, key, low)
+    events.insert(min(max(position, low), high), event)
+
+
+class EventLinks:
+    """Positions of the events that belong together in one events list."""
+
+    def __init__(self, events):
+        self._releases = {}
+        self._dues = {}
+        self._due_topics = {}
+        for position, event in enumerate(events):
+            group_id = event.get('group_id')
+            if is_due(event):
+                if group_id:
+                    self._dues.setdefault(group_id, []).append(position)
+                if event.get('type') in ('homework_due', 'project_due'):
+                    self._due_topics.setdefault(event.get('topic'), []).append(position)
+            elif group_id:
+                self._releases.setdefault(group_id, position)
+
+    def release(self, group_id):
+        """Position of the homework or project of group_id, or None."""
+        return self._releases.get(group_id)
+
+    def dues(self, group_id):
+        """Positions of the due events of group_id."""
+        return list(self._dues.get(group_id, ()))
+
+    def dues_by_topic(self, topic):
+        """Positions of the homework and project due events whose topic is topic."""
+        return list(self._due_topics.get(topic, ()))
+
+
+class EventIndex:
+
+    def __init__(self, path, load):
+        """load() returns the parsed additional_events.yml at path."""
+        self.path = path
+        self._load = load
+        self._lock = threading.Lock()
+        self._signature = False
+        self._keys = []
+        self._entries = []
+        self._ordered = True
+        self._links = EventLinks([])
+        storage.add_save_listener(self._on_save)
+
+    def query(self, start=None, end=None, types=None):
+        """Return (position, event) for the events dated start to end, both included, in date order.
+
+        start and end are ISO dates and either may be None for an open
+        range; types, if given, limits the result to those event types.
+        """
+        with self._lock:
+            self._refresh()
+            low = bisect.bisect_left(self._keys, start) if start else 0
+            # Dates may carry a time after the day, e.g. 2026-02-03T10:00.
+            high = bisect.bisect_right(self._keys, end + '\uffff') if end else len(self._keys)
+            entries = self._entries[low:high]
+        if types:
+            entries = [(position, event) for position, event in entries if event.get('type') in types]
+        return entries
+
+    def ordered(self):
+        """Whether the events in the file are in date order, so edits can insert() into them."""
+        with self._lock:
+            self._refresh()
+            return self._ordered
+
+    def links(self):
+        """EventLinks of the events in the file."""
+        with self._lock:
+            self._refresh()
+            return self._links
+
+    def _refresh(self):
+        try:
+            signature = storage.file_signature(self.path)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature:
+            return
+        events = []
+        if signature is not None:
+            events = (self._load() or {}).get('additional_events') or []
+        self._build(events)
+        self._signature = signature
+
+    def _on_save(self, path, data, previous_signature, signature):
+        if path != self.path:
+            return
+        with self._lock:
+            self._build((data or {}).get('additional_events') or [])
+            self._signature = signature
+
+    def _build(self, events):
+        entries = sorted(enumerate(events), key=lambda entry: date_key(entry[1]))
+        self._keys = [date_key(event) for _, event in entries]
+        self._entries = entries
+        self._ordered = all(position == expected for expected, (position, _) in enumerate(entries))
+        self._links = EventLinks(events)
@@ -0,0 +1,273 @@
+"""
+Resized thumbnails and WebP variants for uploaded images.
+
+For every source image the pipeline writes into a variants/ folder next to
+it one copy per configured width, both in the source's own format and as
+WebP. Widths larger than the image itself collapse into one copy at the
+original size. Finished variants are recorded in a YAML data file keyed by
+the image's site path (e.g. /_images/pp/photo.jpg) together with the size
+and mtime of the source they were made from. The Jekyll includes and the
+dashboard templates look images up there and fall back to the original
+when an entry is missing or out of date.
+
+Resizing runs in a process pool, shared with the other sites of the
+dashboard (see process_pool.py), so uploads return straight away. Jobs are
+tracked per site path; the data file answers for jobs that finished in
+another worker process. Pillow is optional: without it no variants are made
+and originals are used everywhere.
+"""
+
+import os
+import threading
+import time
+
+import storage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # variants are optional; originals are served instead
+    Image = None
+
+VARIANTS_DIRNAME = 'variants'
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+FINISHED_JOB_TTL = 60 * 60
+
+_EXIF_ORIENTATION = 0x0112
+_PIL_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+
+def available():
+    return Image is not None
+
+
+def _fallback_extension(name):
+    extension = name.rsplit('.', 1)[-1].lower()
+    # GIFs are reduced to their first frame, which is stored as PNG.
+    return 'png' if extension == 'gif' else extension
+
+
+def source_size(path):
+    """Return the (width, height) the image has once its EXIF orientation is applied."""
+    with Image.open(path) as image:
+        width, height = image.size
+        if image.getexif().get(_EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+
+def planned_variants(source_path, widths, source_width):
+    """Return (width, extension, path) for every file render_variants writes."""
+    directory, name = os.path.split(source_path)
+    variants_dir = os.path.join(directory, VARIANTS_DIRNAME)
+    planned = []
+    for width in sorted({min(width, source_width) for width in widths}):
+        for extension in (_fallback_extension(name), 'webp'):
+            planned.append((width, extension, os.path.join(variants_dir, f'{name}.{width}w.{extension}')))
+    return planned
+
+
+def _prepare(image, extension):
+    if extension in ('jpg', 'jpeg'):
+        return image if image.mode in ('RGB', 'L') else image.convert('RGB')
+    if image.mode in ('RGB', 'RGBA', 'L', 'LA'):
+        return image
+    return image.convert('RGBA')
+
+
+def render_variants(source_path, widths):
+    """Write the variants of source_path; runs in a pool worker process."""
+    with Image.open(source_path) as opened:
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+    source_width, source_height = image.size
+    os.makedirs(os.path.join(os.path.dirname(source_path), VARIANTS_DIRNAME), exist_ok=True)
+
+    variants = []
+    resized = {}
+    for width, extension, path in planned_variants(source_path, widths, source_width):
+        if width not in resized:
+            height = max(1, round(source_height * width / source_width))
+            resized[width] = image if width == source_width else image.resize((width, height), Image.LANCZOS)
+        variant = _prepare(resized[width], extension)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        options = {'quality': WEBP_QUALITY if extension == 'webp' else JPEG_QUALITY}
+        if extension in ('jpg', 'jpeg'):
+            options.update(optimize=True, progressive=True)
+        variant.save(temp_path, format=_PIL_FORMATS[extension], **options)
+        os.replace(temp_path, path)
+        variants.append({'path': path, 'format': extension, 'width': variant.width, 'height': variant.height})
+
+    return {'width': source_width, 'height': source_height, 'variants': variants}
+
+
+def _identity(file_stat):
+    return {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns}
+
+
+class VariantPipeline:
+
+    def __init__(self, site_root, manifest_path, widths_by_dir, include, pool):
+        """
+        widths_by_dir maps an image folder to the widths made for images in
+        it; include(name) decides which files in those folders are images.
+        pool is the ProcessPool the images are resized in.
+        """
+        self.site_root = site_root
+        self.manifest_path = manifest_path
+        self._widths_by_dir = widths_by_dir
+        self._include = include
+        self._pool = pool
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def site_path(self, path):
+        return '/' + os.path.relpath(path, self.site_root).replace(os.sep, '/')
+
+    def _source_path(self, site_path):
+        return os.path.join(self.site_root, *site_path.strip('/').split('/'))
+
+    def manifest(self):
+        """The parsed data file, for passing to several lookup() calls; callers must not change it."""
+        return self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            return storage.load_yaml(self.manifest_path) or {}
+        except FileNotFoundError:
+            return {}
+
+    def _current_entry(self, manifest, site_path):
+        entry = manifest.get(site_path)
+        if not entry:
+            return None
+        try:
+            file_stat = os.stat(self._source_path(site_path))
+        except OSError:
+            return None
+        if _identity(file_stat) != {'size': entry.get('size'), 'mtime_ns': entry.get('mtime_ns')}:
+            return None
+        return entry
+
+    def lookup(self, site_path, manifest=None):
+        """Return the data file entry for site_path if its variants are up to date.
+
+        manifest, from manifest(), saves loading the data file again when
+        looking up many images.
+        """
+        return self._current_entry(self._load_manifest() if manifest is None else manifest, site_path)
+
+    def submit(self, source_path):
+        """Queue variants for source_path and return the job description."""
+        site_path = self.site_path(source_path)
+        widths = self._widths_by_dir.get(os.path.dirname(source_path))
+        if not available() or not widths:
+            return {'path': site_path, 'status': 'unavailable', 'variants': [], 'error': None}
+
+        try:
+            source_stat = os.stat(source_path)
+            source_width = source_size(source_path)[0]
+        except OSError as error:
+            return {'path': site_path, 'status': 'failed', 'variants': [], 'error': str(error)}
+
+        job = {
+            'path': site_path,
+            'source': _identity(source_stat),
+            'variants': [self.site_path(path) for _, _, path in planned_variants(source_path, widths, source_width)],
+            'error': None,
+            'finished_at': None
+        }
+        with self._lock:
+            self._prune_jobs()
+            job['future'] = self._pool.submit(render_variants, source_path, widths)
+            self._jobs[site_path] = job
+        job['future'].add_done_callback(lambda future: self._finish(job, future))
+        return self._describe(job)
+
+    def status(self, site_path):
+        with self._lock:
+            job = self._jobs.get(site_path)
+        if job is not None and job['finished_at'] is None:
+            return self._describe(job)
+        entry = self.lookup(site_path)
+        if entry is not None:
+            variants = [variant['path'] for variant in entry.get('fallback', []) + entry.get('webp', [])]
+            return {'path': site_path, 'status': 'done', 'variants': variants, 'error': None}
+        if job is not None:
+            return self._describe(job)
+        return {'path': site_path, 'status': 'missing', 'variants': [], 'error': None}
+
+    def backfill(self):
+        """Queue every image whose variants are missing or older than the image."""
+        if not available():
+            return []
+        manifest = self._load_manifest()
+        jobs = []
+        for directory in self._widths_by_dir:
+            try:
+                names = sorted(entry.name for entry in os.scandir(directory)
+                               if entry.is_file() and self._include(entry.name))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                source_path = os.path.join(directory, name)
+                site_path = self.site_path(source_path)
+                if self._current_entry(manifest, site_path) is not None:
+                    continue
+                with self._lock:
+                    pending = site_path in self._jobs and self._jobs[site_path]['finished_at'] is None
+                if not pending:
+                    jobs.append(self.submit(source_path))
+        return jobs
+
+    def _describe(self, job):
+        future = job['future']
+        if job['error'] is not None:
+            status = 'failed'
+        elif job['finished_at'] is not None:
+            status = 'done'
+        elif future.running():
+            status = 'running'
+        else:
+            status = 'queued'
+        return {'path': job['path'], 'status': status, 'variants': list(job['variants']), 'error': job['error']}
+
+    def _finish(self, job, future):
+        try:
+            result = future.result()
+        except Exception as error:
+            job['error'] = str(error) or error.__class__.__name__
+        else:
+            try:
+                self._record(job, result)
+            except Exception as error:
+                job['error'] = str(error) or error.__class__.__name__
+        job['finished_at'] = time.time()
+
+    def _record(self, job, result):
+        def entries(extension_is_webp):
+            return [
+                {'path': self.site_path(variant['path']), 'width': variant['width'], 'height': variant['height']}
+                for variant in result['variants']
+                if (variant['format'] == 'webp') == extension_is_webp
+            ]
+
+        with storage.locked(self.manifest_path):
+            manifest = self._load_manifest()
+            manifest[job['path']] = {
+                **job['source'],
+                'width': result['width'],
+                'height': result['height'],
+                'fallback': entries(False),
+                'webp': entries(True)
+            }
+            for site_path in list(manifest):
+                if not os.path.exists(self._source_path(site_path)):
+                    del manifest[site_path]
+            storage.save_yaml(self.manifest_path, dict(sorted(manifest.items())))
+
+    def _prune_jobs(self):
+        cutoff = time.time() - FINISHED_JOB_TTL
+        for site_path, job in list(self._jobs.items()):
+            if job['finished_at'] is not None and job['finished_at'] < cutoff:
+                del self._jobs[site_path]
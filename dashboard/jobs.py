@@ -0,0 +1,160 @@
+"""
+Background jobs for long edits, with progress that any worker can report.
+
+Operations that rewrite whole data files are submitted here instead of
+running inside the request: generating schedule weeks (generate_weeks),
+filling in missing class days (fill_missing_days) and moving lectures after
+the class days change (redistribute_lectures), plus the rebuild of the
+derived caches. submit() returns the job's description at once
+and a thread pool runs the job; the browser then polls the job's status.
+
+A job function is called as function(job, *args) and may call
+job.progress(done, total, message) as it goes. It returns a dict, whose
+"message" becomes the job's final message, and raises JobError to fail with
+a message meant for the user. Any other exception fails the job as well.
+
+Every change of state is written as <id>.json to a directory shared by all
+worker processes, so a status request reaching another worker still finds
+the job. Progress is written at most every PROGRESS_INTERVAL seconds, and
+finished jobs are forgotten after FINISHED_JOB_TTL.
+
+Jobs run in threads of the web worker because they work on the same YAML
+caches, storage engines and file locks as requests do. They hold those
+locks themselves, one job at a time per file, like any request would.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+PROGRESS_INTERVAL = 0.5
+FINISHED_JOB_TTL = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class JobError(Exception):
+    """A job failure whose message is shown to the user."""
+
+
+class Job:
+
+    def __init__(self, queue, kind, site):
+        self._queue = queue
+        self._published = 0
+        self.state = {
+            'id': uuid4().hex,
+            'kind': kind,
+            'site': site,
+            'status': 'queued',
+            'done': 0,
+            'total': None,
+            'message': None,
+            'result': None,
+            'error': None,
+            'submitted_at': time.time(),
+            'finished_at': None
+        }
+
+    @property
+    def id(self):
+        return self.state['id']
+
+    def progress(self, done, total=None, message=None):
+        """Record that done of total steps are complete."""
+        self.state['done'] = done
+        if total is not None:
+            self.state['total'] = total
+        if message is not None:
+            self.state['message'] = message
+        if time.monotonic() - self._published >= PROGRESS_INTERVAL:
+            self._publish()
+
+    def describe(self):
+        return dict(self.state)
+
+    def _publish(self):
+        self._published = time.monotonic()
+        self._queue._write(self)
+
+
+class JobQueue:
+
+    def __init__(self, state_dir, max_workers=2):
+        self.state_dir = state_dir
+        self._max_workers = max_workers
+        self._executor = None
+        self._pid = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, function, *args, site=None):
+        """Queue function(job, *args) and return the job's description."""
+        job = Job(self, kind, site)
+        with self._lock:
+            self._prune()
+            # Pool threads do not survive a fork into gunicorn workers.
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='dashboard-job')
+                self._pid = os.getpid()
+            self._jobs[job.id] = job
+            job._publish()
+            self._executor.submit(self._run, job, function, args)
+        return job.describe()
+
+    def status(self, job_id):
+        """Return the description of job_id, from this process or another one, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.describe()
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.state_dir, f'{job_id}.json'), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _run(self, job, function, args):
+        job.state['status'] = 'running'
+        job._publish()
+        try:
+            result = function(job, *args) or {}
+        except JobError as error:
+            job.state.update(status='failed', error=str(error))
+        except Exception as error:
+            logger.exception('Job %s (%s) failed', job.id, job.state['kind'])
+            job.state.update(status='failed', error=str(error) or error.__class__.__name__)
+        else:
+            job.state.update(status='done', result=result, message=result.get('message', job.state['message']))
+        job.state['finished_at'] = time.time()
+        job._publish()
+
+    def _write(self, job):
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = os.path.join(self.state_dir, f'{job.id}.json')
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(job.describe(), file, default=str)
+        os.replace(temp_path, path)
+
+    def _prune(self):
+        cutoff = time.time() - FINISHED_JOB_TTL
+        for job_id, job in list(self._jobs.items()):
+            if job.state['finished_at'] is not None and job.state['finished_at'] < cutoff:
+                del self._jobs[job_id]
+        try:
+            entries = list(os.scandir(self.state_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
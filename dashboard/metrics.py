@@ -0,0 +1,266 @@
+"""
+Request, YAML I/O, upload and cache metrics in the Prometheus text format.
+
+instrument(app) times every request through Flask's request hooks, so new
+routes are covered without changes, and subscribes to storage's I/O
+listener, which sees every load_yaml and save_yaml behind the dashboard's
+load_*/save_* helpers. Caches register a function returning their hit and
+miss counts with add_cache() and are read whenever metrics are collected.
+
+Each process keeps its own counters. When DASHBOARD_METRICS_DIR is set, as
+run.py does for gunicorn, a background thread in every process also writes
+them to <pid>.json in that directory within FLUSH_INTERVAL seconds of a
+change, and render() sums the files of all processes. Forked workers start
+from zero rather than inheriting the counts of the process that loaded the
+app.
+"""
+
+import json
+import os
+import threading
+import time
+
+from flask import g, request
+
+import storage
+
+FLUSH_INTERVAL = 1.0
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+YAML_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# name -> (type, help text, histogram buckets)
+METRICS = {
+    'dashboard_requests_total': (
+        'counter', 'Requests handled, by endpoint, method and status.', None),
+    'dashboard_request_duration_seconds': (
+        'histogram', 'Time spent handling requests, by endpoint and method.', REQUEST_BUCKETS),
+    'dashboard_yaml_load_duration_seconds': (
+        'histogram', 'YAML loads by file and result: hit (served from the cache), sidecar, parse or engine.', YAML_BUCKETS),
+    'dashboard_yaml_save_duration_seconds': (
+        'histogram', 'YAML saves by file.', YAML_BUCKETS),
+    'dashboard_yaml_bytes_written_total': (
+        'counter', 'Bytes of YAML written, by file.', None),
+    'dashboard_upload_bytes_total': (
+        'counter', 'Bytes of uploaded files written to the upload folder, by upload method.', None),
+    'dashboard_cache_lookups_total': (
+        'counter', 'Cache lookups by cache and result (hit or miss).', None),
+    'dashboard_cache_hit_ratio': (
+        'gauge', 'Share of cache lookups that were hits since the server started.', None),
+}
+
+
+class Registry:
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._caches = {}
+        self._cache_offsets = {}
+        self._dirty = False
+        self._flusher_pid = None
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    entry['buckets'][index] += 1
+                    break
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def add_cache(self, name, counts):
+        """Report the cache name; counts() returns its (hits, misses) so far."""
+        with self._lock:
+            self._caches[name] = counts
+
+    def file_label(self, path):
+        relative = os.path.relpath(path, self.root)
+        return os.path.basename(path) if relative.startswith('..') else relative.replace(os.sep, '/')
+
+    def reset(self):
+        """Start from zero, e.g. in a freshly forked worker."""
+        # Another thread may have held the lock when the process forked.
+        self._lock = threading.Lock()
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self._cache_offsets = {name: tuple(counts()) for name, counts in self._caches.items()}
+            self._dirty = False
+            self._flusher_pid = None
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [
+                [name, list(labels), list(entry['buckets']), entry['sum'], entry['count']]
+                for (name, labels), entry in self._histograms.items()
+            ]
+            caches = {}
+            for name, counts in self._caches.items():
+                hits, misses = counts()
+                offset_hits, offset_misses = self._cache_offsets.get(name, (0, 0))
+                caches[name] = [hits - offset_hits, misses - offset_misses]
+        return {'counters': counters, 'histograms': histograms, 'caches': caches}
+
+    def changed(self):
+        """Have this process's counters written out soon, if they are shared."""
+        if not os.environ.get('DASHBOARD_METRICS_DIR'):
+            return
+        with self._lock:
+            self._dirty = True
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            with self._lock:
+                dirty, self._dirty = self._dirty, False
+            if dirty:
+                self.flush()
+
+    def flush(self):
+        directory = os.environ.get('DASHBOARD_METRICS_DIR')
+        if not directory:
+            return
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.snapshot(), file)
+            os.replace(temp_path, path)
+        except OSError:
+            pass  # metrics must never fail a request
+
+    def _snapshots(self):
+        directory = os.environ.get('DASHBOARD_METRICS_DIR')
+        if not directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name), 'r', encoding='utf-8') as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """Return the metrics of all processes in the Prometheus text format."""
+        counters = {}
+        histograms = {}
+        caches = {}
+        for snapshot in self._snapshots():
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, buckets, total, count in snapshot['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                entry = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], buckets)]
+                entry[1] += total
+                entry[2] += count
+            for name, (hits, misses) in snapshot['caches'].items():
+                merged = caches.setdefault(name, [0, 0])
+                merged[0] += hits
+                merged[1] += misses
+
+        for name, (hits, misses) in caches.items():
+            counters[('dashboard_cache_lookups_total', (('cache', name), ('result', 'hit')))] = hits
+            counters[('dashboard_cache_lookups_total', (('cache', name), ('result', 'miss')))] = misses
+            if hits + misses:
+                counters[('dashboard_cache_hit_ratio', (('cache', name),))] = hits / (hits + misses)
+
+        lines = []
+        for name, (metric_type, help_text, bounds) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'histogram':
+                for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket in zip(bounds, buckets):
+                        cumulative += bucket
+                        lines.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+                    lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+                    lines.append(f'{name}_count{_labels(labels)} {count}')
+            else:
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def instrument(app, registry):
+    """Record every request to app and every YAML load and save in registry."""
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(error=None):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        status = g.pop('metrics_status', 500 if error is not None else 200)
+        endpoint = request.endpoint or 'unmatched'
+        registry.inc('dashboard_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': str(status)})
+        registry.observe('dashboard_request_duration_seconds', {'endpoint': endpoint, 'method': request.method},
+                         time.perf_counter() - start)
+        registry.changed()
+
+    def record_io(operation, path, seconds, size):
+        file_label = registry.file_label(path)
+        if operation == 'save':
+            registry.observe('dashboard_yaml_save_duration_seconds', {'file': file_label}, seconds)
+            registry.inc('dashboard_yaml_bytes_written_total', {'file': file_label}, size)
+        else:
+            registry.observe('dashboard_yaml_load_duration_seconds', {'file': file_label, 'result': operation}, seconds)
+
+    def yaml_cache_counts():
+        counts = storage.stats()
+        return counts['hits'], counts['sidecar_loads'] + counts['parses'] + counts['engine_loads']
+
+    storage.add_io_listener(record_io)
+    registry.add_cache('yaml', yaml_cache_counts)
+    os.register_at_fork(after_in_child=registry.reset)
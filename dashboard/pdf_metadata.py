@@ -0,0 +1,196 @@
+"""
+Page count, title and first-page preview for uploaded PDFs.
+
+Results are cached in the hidden .previews folder of the upload directory as
+<sha256>.json plus an optional <sha256>.webp preview, so renaming or
+replacing a PDF with identical bytes never extracts it again and copies
+share one entry. Entries are written once and never change.
+
+Extraction runs in a process pool shared with the other sites of the
+dashboard (see process_pool.py). Looking metadata up only reads the cache:
+a PDF that has no entry yet is queued and reported as pending. File digests
+come from the content store's index, and digests computed by the extractor
+are recorded there in turn.
+
+pypdfium2 is optional, and preview images additionally need Pillow.
+Without them PDFs are listed without metadata.
+"""
+
+import json
+import os
+import threading
+
+import content_store
+from dir_snapshot import DirectorySnapshot
+from uploads import file_sha256
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # metadata is optional; PDFs are listed without it
+    pdfium = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CACHE_DIRNAME = '.previews'
+PREVIEW_WIDTH = 240
+PREVIEW_QUALITY = 75
+
+
+def available():
+    return pdfium is not None
+
+
+def is_pdf(name):
+    return name.lower().endswith('.pdf')
+
+
+def _write_atomic(path, write):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    write(temp_path)
+    os.replace(temp_path, path)
+
+
+def extract(source_path, cache_dir, digest=None):
+    """Fill the cache entry for source_path; runs in a pool worker process.
+
+    Returns the digest and the stat the file had when it was hashed, or
+    None for the stat if the digest was given.
+    """
+    file_stat = None
+    if digest is None:
+        file_stat = os.stat(source_path)
+        digest = file_sha256(source_path)
+
+    metadata_path = os.path.join(cache_dir, f'{digest}.json')
+    if os.path.exists(metadata_path):
+        return digest, file_stat
+
+    metadata = {'pages': None, 'title': None, 'preview': None, 'error': None}
+    try:
+        pdf = pdfium.PdfDocument(source_path)
+        try:
+            metadata['pages'] = len(pdf)
+            metadata['title'] = (pdf.get_metadata_dict().get('Title') or '').strip() or None
+            if len(pdf) and Image is not None:
+                page = pdf[0]
+                bitmap = page.render(scale=PREVIEW_WIDTH / page.get_width())
+                preview_name = f'{digest}.webp'
+                _write_atomic(
+                    os.path.join(cache_dir, preview_name),
+                    lambda path: bitmap.to_pil().convert('RGB').save(path, format='WEBP', quality=PREVIEW_QUALITY)
+                )
+                metadata['preview'] = preview_name
+        finally:
+            pdf.close()
+    except pdfium.PdfiumError as error:
+        metadata['error'] = str(error) or 'Could not read PDF'
+
+    def write_metadata(path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(metadata, file)
+    _write_atomic(metadata_path, write_metadata)
+    return digest, file_stat
+
+
+def _identity(file_stat):
+    return (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+
+class PdfMetadataCache:
+
+    def __init__(self, upload_dir, pool):
+        """pool is the ProcessPool PDFs are extracted in."""
+        self.upload_dir = upload_dir
+        self.cache_dir = os.path.join(upload_dir, CACHE_DIRNAME)
+        self._entries = DirectorySnapshot(self.cache_dir, lambda name: name.endswith('.json'))
+        self._pool = pool
+        self._pending = set()
+        self._loaded = {}
+        # filename -> (stat identity, digest) for digests the content store
+        # could not record, e.g. because it has no index yet.
+        self._digests = {}
+        # Files whose extraction failed; retried once the upload folder changes.
+        self._failed = set()
+        self._memo = (None, None, None)
+        self._lock = threading.Lock()
+
+    def _read(self, digest):
+        metadata = self._loaded.get(digest)
+        if metadata is None:
+            try:
+                with open(os.path.join(self.cache_dir, f'{digest}.json'), 'r', encoding='utf-8') as file:
+                    metadata = json.load(file)
+            except (OSError, ValueError):
+                return None
+            self._loaded[digest] = metadata
+        return metadata
+
+    def metadata_for(self, listing):
+        """Return ({filename: metadata}, pending filenames) for the PDFs in a DirectoryListing.
+
+        PDFs without a cache entry are queued for extraction.
+        """
+        entries = self._entries.listing()
+        with self._lock:
+            listing_version, entries_version, result = self._memo
+            if listing_version != listing.version or entries_version != entries.version:
+                if listing_version != listing.version:
+                    self._failed.clear()
+                pdf_stats = {name: stat for name, stat in listing.files.items() if is_pdf(name)}
+                digests = content_store.current_digests(self.upload_dir, pdf_stats)
+                found = {}
+                missing = {}
+                for name, file_stat in pdf_stats.items():
+                    digest = digests.get(name)
+                    if digest is None and name in self._digests:
+                        identity, known = self._digests[name]
+                        digest = known if identity == _identity(file_stat) else None
+                    metadata = self._read(digest) if digest and f'{digest}.json' in entries.files else None
+                    if metadata is not None:
+                        found[name] = {'sha256': digest, **metadata}
+                    else:
+                        missing[name] = digest
+                result = (found, missing)
+                self._memo = (listing.version, entries.version, result)
+        found, missing = result
+        for name, digest in missing.items():
+            self.queue(name, digest)
+        if not available():
+            return found, []
+        with self._lock:
+            return found, sorted(name for name in missing if name not in self._failed)
+
+    def queue(self, filename, digest=None):
+        """Queue filename for extraction unless it is already pending in this process."""
+        if not available() or not is_pdf(filename):
+            return
+        with self._lock:
+            if filename in self._pending or filename in self._failed:
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            future = self._pool.submit(extract, os.path.join(self.upload_dir, filename), self.cache_dir, digest)
+            self._pending.add(filename)
+        future.add_done_callback(lambda done: self._finish(filename, done))
+
+    def preview_path(self, digest):
+        return os.path.join(self.cache_dir, f'{digest}.webp')
+
+    def _finish(self, filename, future):
+        try:
+            digest, file_stat = future.result()
+            if file_stat is not None:
+                with self._lock:
+                    self._digests[filename] = (_identity(file_stat), digest)
+                content_store.record_digest(self.upload_dir, filename, digest, file_stat)
+        except Exception:
+            # Including BrokenProcessPool, when a worker died, e.g. on a PDF
+            # that crashes the renderer.
+            with self._lock:
+                self._failed.add(filename)
+        finally:
+            with self._lock:
+                self._pending.discard(filename)
+                self._memo = (None, None, None)
@@ -0,0 +1,45 @@
+"""
+Process pools shared by every course site of a dashboard process.
+
+Image resizing and PDF extraction run in separate processes so a slow or
+crashing file cannot hold up a request. Each kind of work has one pool for
+the whole dashboard process rather than one per site, so serving more
+courses does not start more processes; the tasks carry the full paths of
+the files they work on, so any site can use any worker.
+
+A pool starts its processes on the first task. When a worker dies, e.g. on
+a PDF that crashes the renderer, the pool breaks: its pending tasks fail
+with BrokenProcessPool and the next submit() starts a new pool.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ProcessPool:
+
+    def __init__(self, max_workers):
+        self._max_workers = max_workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        """Run function(*args) in a worker process and return its Future."""
+        with self._lock:
+            for attempt in range(2):
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self._max_workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+                    self._pid = os.getpid()
+                try:
+                    return self._executor.submit(function, *args)
+                except BrokenProcessPool:
+                    self._executor = None
+                    if attempt:
+                        raise
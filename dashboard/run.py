@@ -2,11 +2,21 @@
 """
 Course Dashboard Launcher
 Run this script to start the course management dashboard
+
+    python run.py                  # development server with debugger and reloader
+    python run.py --production     # multi-worker gunicorn server
+
+Production mode can also be selected with DASHBOARD_MODE=production. Worker,
+thread, bind and shutdown settings are read from the command line or from
+the DASHBOARD_* environment variables listed in parse_args.
 """
 
+import argparse
 import os
+import shutil
 import sys
 import subprocess
+import tempfile
 
 def check_requirements():
     """Check if required packages are installed"""
@@ -26,35 +36,112 @@ def check_requirements():
             print("✗ Failed to install requirements")
             return False
 
+def parse_args(argv=None):
+    """Read launch options from the command line, defaulting to DASHBOARD_* variables"""
+    env = os.environ
+    parser = argparse.ArgumentParser(description="Start the course website dashboard")
+    parser.add_argument('--production', action='store_true',
+                        default=env.get('DASHBOARD_MODE', '').lower() == 'production',
+                        help="serve with gunicorn instead of the Flask development server")
+    parser.add_argument('--host', default=env.get('DASHBOARD_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(env.get('DASHBOARD_PORT', 8080)))
+    parser.add_argument('--workers', type=int,
+                        default=int(env.get('DASHBOARD_WORKERS', min(2 * (os.cpu_count() or 1) + 1, 8))),
+                        help="worker processes in production mode")
+    parser.add_argument('--threads', type=int, default=int(env.get('DASHBOARD_THREADS', 4)),
+                        help="threads per worker in production mode")
+    parser.add_argument('--graceful-timeout', type=int, default=int(env.get('DASHBOARD_GRACEFUL_TIMEOUT', 30)),
+                        help="seconds workers get to finish in-flight requests on shutdown")
+    return parser.parse_args(argv)
+
+def serve_production(app, options):
+    """Serve the app with gunicorn, preloaded and with warm caches"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("✗ Production mode requires gunicorn")
+        print("   Install it with:  pip install gunicorn")
+        sys.exit(1)
+
+    class DashboardApplication(BaseApplication):
+        def __init__(self, application, settings):
+            self.application = application
+            self.settings = settings
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    # Workers are forked from this process, so everything loaded here is
+    # shared with them instead of being parsed again per worker. The app may
+    # have been started as app.py's __main__, so look its module up by name.
+    sys.modules[app.import_name].warm_caches()
+
+    # Workers share their /metrics counters through this directory.
+    metrics_dir = None
+    master_pid = os.getpid()
+    if not os.environ.get('DASHBOARD_METRICS_DIR'):
+        metrics_dir = os.environ['DASHBOARD_METRICS_DIR'] = tempfile.mkdtemp(prefix='dashboard-metrics-')
+
+    try:
+        DashboardApplication(app, {
+            'bind': f'{options.host}:{options.port}',
+            'workers': max(options.workers, 1),
+            'threads': max(options.threads, 1),
+            'worker_class': 'gthread' if options.threads > 1 else 'sync',
+            'preload_app': True,
+            'graceful_timeout': options.graceful_timeout,
+            'accesslog': '-',
+        }).run()
+    finally:
+        # Exiting workers unwind through here too; only the master cleans up.
+        if metrics_dir and os.getpid() == master_pid:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+def serve(app, options):
+    if options.production:
+        print(f"🚀 Starting production server: {options.workers} worker(s) x {options.threads} thread(s)")
+        print(f"🌐 Listening on http://{options.host}:{options.port}")
+        print("=" * 50)
+        serve_production(app, options)
+    else:
+        app.run(debug=True, host=options.host, port=options.port)
+
 def main():
     """Main function to start the dashboard"""
+    options = parse_args()
+
     print("=" * 50)
     print("Course Website Dashboard")
     print("=" * 50)
-    
+
     # Check if we're in the right directory
     if not os.path.exists("app.py"):
         print("✗ Error: app.py not found")
         print("Please run this script from the dashboard directory")
         sys.exit(1)
-    
+
     # Check requirements
-    if not check_requirements():
+    if not options.production and not check_requirements():
         sys.exit(1)
-    
+
     # Import and run the app
     try:
         from app import app
         print("\n🚀 Starting dashboard server...")
         print("📝 Default password: admin123")
         print("🌐 Dashboard will be available at:")
-        print("   Local:  http://localhost:8080")
-        print("   Network: http://0.0.0.0:8080")
+        print(f"   Local:  http://localhost:{options.port}")
+        print(f"   Network: http://{options.host}:{options.port}")
         print("\n💡 Tip: Change the password in app.py for production use")
         print("=" * 50)
-        
-        app.run(debug=True, host='0.0.0.0', port=8080)
-        
+
+        serve(app, options)
+
     except KeyboardInterrupt:
         print("\n\n👋 Dashboard stopped by user")
     except Exception as e:
@@ -62,4 +149,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,174 @@
+"""
+Compiles the dated course schedule for the Jekyll site.
+
+The schedule page used to expand the semester in Liquid on every build:
+scan each day between semester_start and semester_end for class days, mark
+holidays, hand out lecture_sequence entries to the remaining class dates and
+merge in additional_events. This module does the same in Python, with the
+class dates from course_calendar.py, and writes the result to
+_data/generated_schedule.yml, grouped into weeks of rows that the
+smart_schedule_generator.html include renders with plain loops.
+
+The dashboard recompiles whenever course_schedule.yml or
+additional_events.yml is saved through it, and once at startup to pick up
+edits made by hand. Run this file directly to compile without the dashboard:
+
+    python dashboard/schedule_compiler.py
+"""
+
+import os
+import sys
+
+import storage
+from course_calendar import CourseCalendar, build_lecture_sequence, day_label, parse_date
+
+
+def _type_label(event_type):
+    return str(event_type).replace('_', ' ').capitalize()
+
+
+def _materials(materials):
+    return [{'name': m.get('name'), 'url': m.get('url')} for m in materials or []]
+
+
+def compile_schedule(schedule_data, events_data):
+    """Return the document written to generated_schedule.yml."""
+    calendar = CourseCalendar(schedule_data)
+    compiled = {'generated_by': 'dashboard/schedule_compiler.py', 'weeks': []}
+    if calendar.start is None:
+        return compiled
+
+    events = []
+    events_by_day = {}
+    for event in events_data.get('additional_events') or []:
+        day = parse_date(event.get('date'))
+        if day is not None:
+            events.append((day, event))
+            events_by_day.setdefault(day, []).append(event)
+
+    # Items are ordered like the Liquid version sorted its "date|type|key" strings.
+    dates, cancelled = calendar.class_dates()
+    lecture_days = set()
+    items = []
+    for index, (day, lecture) in enumerate(zip(dates, build_lecture_sequence(schedule_data))):
+        lecture_days.add(day)
+        items.append((f'{day}|lecture|{index}', day, 'lecture', lecture))
+    for day in cancelled:
+        items.append((f'{day}|no_class|No Class', day, 'no_class', None))
+    for day, event in events:
+        items.append((f'{day}|{event.get("type")}|{event.get("topic")}', day, event.get('type'), event))
+    items.sort(key=lambda item: item[0])
+
+    weeks = compiled['weeks']
+    for _, day, item_type, item in items:
+        same_day_events = events_by_day.get(day, [])
+        if item_type == 'lecture':
+            row = {'date': str(day), 'day': day_label(day), 'type': 'lecture', 'topic': item.get('topic')}
+            materials = _materials(item.get('materials'))
+            if materials:
+                row['materials'] = materials
+            if same_day_events:
+                row['events'] = [
+                    {'type': event.get('type'), 'label': _type_label(event.get('type')), 'topic': event.get('topic')}
+                    for event in same_day_events
+                ]
+            event_materials = [
+                {'label': _type_label(event.get('type')), **material}
+                for event in same_day_events
+                for material in _materials(event.get('materials'))
+            ]
+            if event_materials:
+                row['event_materials'] = event_materials
+        elif item_type == 'no_class':
+            row = {'date': str(day), 'day': day_label(day), 'type': 'no_class', 'topic': 'No Class'}
+        elif day in lecture_days:
+            # Shown under that day's lecture instead.
+            continue
+        else:
+            row = {
+                'date': str(day),
+                'day': day_label(day),
+                'type': item_type,
+                'label': _type_label(item_type),
+                'topic': item.get('topic')
+            }
+            materials = [
+                material
+                for event in same_day_events
+                if event.get('topic') == item.get('topic')
+                for material in _materials(event.get('materials'))
+            ]
+            if materials:
+                row['materials'] = materials
+
+        number = calendar.week_number(day)
+        if not weeks or weeks[-1]['number'] != number:
+            week_start, week_end = calendar.week_range(number)
+            weeks.append({
+                'number': number,
+                'start': f'{week_start:%m/%d}',
+                'end': f'{week_end:%m/%d}',
+                'class': 'week-even' if number % 2 == 0 else 'week-odd',
+                'rows': []
+            })
+        weeks[-1]['rows'].append(row)
+
+    return compiled
+
+
+def _load(path):
+    try:
+        return storage.load_yaml(path) or {}
+    except FileNotFoundError:
+        return {}
+
+
+class ScheduleCompiler:
+
+    def __init__(self, schedule_path, events_path, output_path, compile_on_save=True):
+        """With compile_on_save=False, call sources_changed() to recompile."""
+        self.schedule_path = schedule_path
+        self.events_path = events_path
+        self.output_path = output_path
+        # (signature, document) of the last write, to compare against
+        # without parsing the output again while it is unchanged.
+        self._written = None
+        if compile_on_save:
+            storage.add_save_listener(self._on_save)
+
+    def compile(self):
+        """Write the compiled schedule; returns True if the output changed."""
+        with storage.locked(self.output_path):
+            compiled = compile_schedule(_load(self.schedule_path), _load(self.events_path))
+            try:
+                signature = storage.file_signature(self.output_path)
+            except FileNotFoundError:
+                signature = None
+            if self._written is not None and self._written[0] == signature:
+                previous = self._written[1]
+            else:
+                previous = _load(self.output_path)
+            if compiled == previous:
+                return False
+            storage.save_yaml(self.output_path, compiled)
+            self._written = (storage.file_signature(self.output_path), compiled)
+            return True
+
+    def _on_save(self, path, data, previous_signature, signature):
+        self.sources_changed([path])
+
+    def sources_changed(self, paths):
+        if self.schedule_path in paths or self.events_path in paths:
+            self.compile()
+
+
+if __name__ == '__main__':
+    site_root = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    data_dir = os.path.join(site_root, '_data')
+    compiler = ScheduleCompiler(
+        os.path.join(data_dir, 'course_schedule.yml'),
+        os.path.join(data_dir, 'additional_events.yml'),
+        os.path.join(data_dir, 'generated_schedule.yml')
+    )
+    changed = compiler.compile()
+    print(f'{compiler.output_path} {"updated" if changed else "already up to date"}')
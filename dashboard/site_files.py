@@ -0,0 +1,110 @@
+"""
+Conditional, ranged and precompressed responses for files under the site root.
+
+Werkzeug's send_file already answers If-None-Match / If-Modified-Since with
+304 and single byte ranges with 206. On top of that this module
+
+* uses an ETag built from the inode, size and nanosecond mtime, so a file
+  replaced within the same second still gets a new tag;
+* advertises Accept-Ranges on every response, which PDF viewers need before
+  they will fetch a document page by page, and falls back to the full body
+  for multi-range or malformed Range headers instead of failing with 416;
+* serves a .br or .gz sibling of a text asset when the client accepts that
+  encoding and the sibling is at least as new as the original;
+* picks Cache-Control by path prefix.
+"""
+
+import os
+import stat
+
+from flask import request, send_file
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
+from werkzeug.http import parse_range_header
+from werkzeug.security import safe_join
+
+PRECOMPRESSED_EXTENSIONS = {'.css', '.js', '.mjs', '.html', '.htm', '.svg', '.json', '.xml', '.txt', '.map'}
+
+# Content-Encoding and sibling suffix, in order of preference.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def strong_etag(file_stat, encoding=None):
+    etag = f'{file_stat.st_ino:x}-{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}'
+    return f'{etag}-{encoding}' if encoding else etag
+
+
+def cache_control_for(filename, rules, default):
+    """Return the value of the longest prefix in rules that filename starts with."""
+    best = None
+    for prefix in rules:
+        if filename.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return rules[best] if best is not None else default
+
+
+def _regular_file_stat(path):
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+    return file_stat if stat.S_ISREG(file_stat.st_mode) else None
+
+
+def _precompressed(path, file_stat):
+    for encoding, suffix in ENCODINGS:
+        if not request.accept_encodings[encoding]:
+            continue
+        sibling_stat = _regular_file_stat(path + suffix)
+        if sibling_stat is not None and sibling_stat.st_mtime_ns >= file_stat.st_mtime_ns:
+            return encoding, path + suffix, sibling_stat
+    return None
+
+
+def _range_environ(environ):
+    """Drop a Range header that is not a single satisfiable-looking byte range."""
+    value = environ.get('HTTP_RANGE')
+    if value is None:
+        return environ
+    parsed = parse_range_header(value)
+    if parsed is not None and len(parsed.ranges) == 1:
+        return environ
+    environ = dict(environ)
+    del environ['HTTP_RANGE']
+    return environ
+
+
+def send_site_file(root, filename, cache_rules, default_cache_control):
+    path = safe_join(root, filename)
+    file_stat = _regular_file_stat(path) if path is not None else None
+    if file_stat is None:
+        raise NotFound()
+
+    served_path, served_stat, encoding = path, file_stat, None
+    compressible = os.path.splitext(path)[1].lower() in PRECOMPRESSED_EXTENSIONS
+    if compressible:
+        sibling = _precompressed(path, file_stat)
+        if sibling is not None:
+            encoding, served_path, served_stat = sibling
+
+    response = send_file(
+        served_path,
+        download_name=os.path.basename(path),
+        etag=strong_etag(served_stat, encoding),
+        last_modified=served_stat.st_mtime,
+        conditional=False
+    )
+    if encoding:
+        response.content_encoding = encoding
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control_for(filename, cache_rules, default_cache_control)
+
+    try:
+        response.make_conditional(
+            _range_environ(request.environ), accept_ranges=True, complete_length=served_stat.st_size
+        )
+    except RequestedRangeNotSatisfiable:
+        response.close()
+        raise
+    response.accept_ranges = 'bytes'
+    return response
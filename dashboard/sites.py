@@ -0,0 +1,111 @@
+"""
+Several course sites served by one dashboard process.
+
+DASHBOARD_SITES lists the sites as name=root pairs separated by commas:
+
+    DASHBOARD_SITES="cse589=/srv/cse589,cse510-a=/srv/cse510-a"
+
+SiteDispatcher picks the site of each request and records its name in the
+WSGI environ under SITE_KEY. A request to <name>.<domain>, when a domain is
+configured, belongs to that site; otherwise the first path segment names
+it, and /cse589/schedule reaches the schedule route of cse589 with
+/cse589 moved to SCRIPT_NAME, so url_for() builds links that stay within
+the site. Without DASHBOARD_SITES the dashboard serves one site at the root
+and no dispatcher is installed.
+
+A Site holds the paths of one course and the per-site state app.py attaches
+to it: data caches, upload listings, indexes and the URL context. Templates,
+routes and the YAML cache are shared, so each further course costs only its
+own data.
+"""
+
+import os
+import re
+
+import storage
+from urls import UrlContext
+
+SITE_KEY = 'dashboard.site'
+SITE_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]*$')
+
+
+def parse_sites(value):
+    """Return {name: root} from a DASHBOARD_SITES value; raises ValueError if it is malformed."""
+    sites = {}
+    for entry in (value or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, separator, root = entry.partition('=')
+        name, root = name.strip().lower(), root.strip()
+        if not separator or not SITE_NAME.match(name) or not root:
+            raise ValueError(f'DASHBOARD_SITES entries look like name=/path/to/site, not "{entry}"')
+        if name in sites:
+            raise ValueError(f'Site "{name}" is listed twice in DASHBOARD_SITES')
+        sites[name] = os.path.abspath(root)
+    return sites
+
+
+class Site:
+
+    def __init__(self, name, root):
+        self.name = name
+        self.root = root
+        self.data_dir = os.path.join(root, '_data')
+        self.config_file = os.path.join(root, '_config.yml')
+        self.upload_dir = os.path.join(root, 'static_files', 'uploads')
+        self.schedule_file = os.path.join(self.data_dir, 'course_schedule.yml')
+        self.additional_events_file = os.path.join(self.data_dir, 'additional_events.yml')
+        self.people_file = os.path.join(self.data_dir, 'people.yml')
+        self.home_modules_file = os.path.join(self.data_dir, 'home_modules.yml')
+        self.textbooks_file = os.path.join(self.data_dir, 'textbooks.yml')
+        self.assignments_file = os.path.join(self.data_dir, 'assignments.yml')
+        self.photo_upload_dir = os.path.join(root, '_images', 'pp')
+        self.textbook_upload_dir = os.path.join(root, '_images', 'textbook')
+        self.image_variants_file = os.path.join(self.data_dir, 'image_variants.yml')
+        self.generated_schedule_file = os.path.join(self.data_dir, 'generated_schedule.yml')
+        self._url_context = (None, None)
+
+    def url_context(self):
+        """Return the UrlContext for the current _config.yml, rebuilt when it changes."""
+        try:
+            signature = storage.file_signature(self.config_file)
+        except FileNotFoundError:
+            signature = None
+        cached_signature, context = self._url_context
+        if context is None or cached_signature != signature:
+            try:
+                config = storage.load_yaml(self.config_file)
+            except FileNotFoundError:
+                config = {}
+            context = UrlContext(config)
+            self._url_context = (signature, context)
+        return context
+
+
+class SiteDispatcher:
+    """WSGI middleware recording which site a request is for; see the module docstring."""
+
+    def __init__(self, app, names, domain=None):
+        self.app = app
+        self.names = set(names)
+        self.domain = domain.lower().strip('.') if domain else None
+
+    def __call__(self, environ, start_response):
+        environ[SITE_KEY] = self.select(environ)
+        return self.app(environ, start_response)
+
+    def select(self, environ):
+        if self.domain:
+            host = environ.get('HTTP_HOST', '').split(':', 1)[0].lower()
+            if host.endswith('.' + self.domain):
+                name = host[:-len(self.domain) - 1]
+                return name if name in self.names else None
+
+        path = environ.get('PATH_INFO', '')
+        name, _, rest = path.lstrip('/').partition('/')
+        if name not in self.names:
+            return None
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '').rstrip('/') + '/' + name
+        environ['PATH_INFO'] = '/' + rest
+        return name
@@ -0,0 +1,472 @@
+"""
+Optional SQLite storage engine for the dashboard's data files.
+
+With DASHBOARD_STORAGE=sqlite the lecture sequence, events, people,
+textbooks, assignments and home modules live in a SQLite database instead of
+being rewritten as whole YAML files on every edit. storage.add_engine()
+routes load_yaml and save_yaml for those files here, so the rest of the
+dashboard is unchanged.
+
+Each document is split into a header (its top-level keys, in order) and
+row collections, the lists named in DATA_COLLECTIONS. Every list entry is a
+row holding its JSON-encoded body; dates and other values JSON cannot hold
+are tagged so they come back as YAML loaded them. A save compares the new
+rows with the stored ones and only inserts, updates, moves or deletes the
+rows that differ, then bumps the document's revision, which is what
+storage.file_signature() reports. Materials of lectures and events are
+mirrored into an indexed table by URL, and event rows carry their date.
+
+Jekyll still reads the YAML files. They are exported in the background
+EXPORT_DELAY seconds after a change, so bursts of edits cause one write,
+and any export still pending when the process exits is written then. Each
+export produces exactly what storage.save_yaml would have written. Export
+listeners run afterwards, which is where files derived from the data, such
+as the compiled schedule, are brought up to date.
+
+The YAML files are imported on startup when the database has no copy of
+them yet, and whenever a file no longer matches what was last exported,
+e.g. after a hand edit or a git pull. Such an edit wins over dashboard
+edits still waiting to be exported.
+
+    python sqlite_store.py export [site_root]    # write the YAML files now
+    python sqlite_store.py import [site_root]    # reload the database from YAML
+"""
+
+import argparse
+import atexit
+import base64
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from difflib import SequenceMatcher
+
+import storage
+
+EXPORT_DELAY = 0.5
+
+# Data file name -> top-level keys whose lists are stored as rows.
+DATA_COLLECTIONS = {
+    'course_schedule.yml': ('lecture_sequence', 'lectures'),
+    'additional_events.yml': ('additional_events',),
+    'people.yml': ('instructors', 'teaching_assistants'),
+    'textbooks.yml': ('textbooks',),
+    'assignments.yml': ('assignments',),
+    'home_modules.yml': ('modules',),
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    header TEXT NOT NULL,
+    row_keys TEXT NOT NULL,
+    exported_revision INTEGER NOT NULL DEFAULT 0,
+    exported_hash TEXT,
+    file_signature TEXT
+);
+CREATE TABLE IF NOT EXISTS rows (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    date TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rows_by_position ON rows (path, collection, position);
+CREATE INDEX IF NOT EXISTS rows_by_date ON rows (collection, date) WHERE date IS NOT NULL;
+CREATE TABLE IF NOT EXISTS materials (
+    row_id INTEGER NOT NULL REFERENCES rows (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT,
+    url TEXT,
+    PRIMARY KEY (row_id, position)
+);
+CREATE INDEX IF NOT EXISTS materials_by_url ON materials (url);
+'''
+
+
+def site_documents(data_dir):
+    """Return the {path: collection keys} of a site's managed data files."""
+    return {os.path.join(data_dir, name): keys for name, keys in DATA_COLLECTIONS.items()}
+
+
+def _pack(value):
+    if isinstance(value, dict):
+        if all(isinstance(key, str) and not key.startswith('$') for key in value):
+            return {key: _pack(item) for key, item in value.items()}
+        return {'$map': [[_pack(key), _pack(item)] for key, item in value.items()]}
+    if isinstance(value, list):
+        return [_pack(item) for item in value]
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, float) and not math.isfinite(value):
+        return {'$float': repr(value)}
+    if isinstance(value, bytes):
+        return {'$binary': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, set):
+        return {'$set': [_pack(item) for item in value]}
+    return value
+
+
+_UNPACK = {
+    '$map': lambda pairs: {_hashable(key): item for key, item in pairs},
+    '$datetime': datetime.fromisoformat,
+    '$date': date.fromisoformat,
+    '$float': float,
+    '$binary': base64.b64decode,
+    '$set': lambda items: {_hashable(item) for item in items},
+}
+
+
+def _hashable(key):
+    return tuple(key) if isinstance(key, list) else key
+
+
+def _unpack_object(value):
+    if len(value) == 1:
+        tag, packed = next(iter(value.items()))
+        unpack = _UNPACK.get(tag)
+        if unpack is not None:
+            return unpack(packed)
+    return value
+
+
+def encode(value):
+    """Return value as JSON text that decode() turns back into an equal value."""
+    return json.dumps(_pack(value), ensure_ascii=False, separators=(',', ':'))
+
+
+def decode(text):
+    return json.loads(text, object_hook=_unpack_object)
+
+
+def _row_date(item):
+    if isinstance(item, dict) and item.get('date') is not None:
+        return str(item['date'])
+    return None
+
+
+def _row_materials(item):
+    if not isinstance(item, dict) or not isinstance(item.get('materials'), list):
+        return []
+    return [
+        (position, material.get('name'), material.get('url'))
+        for position, material in enumerate(item['materials'])
+        if isinstance(material, dict)
+    ]
+
+
+class SqliteStore:
+
+    def __init__(self, db_path, documents, export_delay=EXPORT_DELAY):
+        """documents maps each managed data file path to its collection keys."""
+        self.db_path = db_path
+        self.documents = documents
+        self.export_delay = export_delay
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending = set()
+        self._wake = threading.Event()
+        self._exporter_pid = None
+        self._export_listeners = []
+        # Why the last export failed, if it did; failed exports are retried.
+        self.export_error = None
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.flush)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending = set()
+        self._wake = threading.Event()
+        self._exporter_pid = None
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA foreign_keys=ON')
+            self._local.connection = connection
+        return connection
+
+    def open(self):
+        """Create the schema, import new or changed YAML files and export anything unexported."""
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+        for path in self.documents:
+            try:
+                self.signature(path)
+            except FileNotFoundError:
+                continue
+        unexported = self._connection().execute(
+            'SELECT path FROM documents WHERE exported_revision < revision'
+        ).fetchall()
+        for (path,) in unexported:
+            if path in self.documents:
+                self.export(path)
+
+    def manages(self, path):
+        return path in self.documents
+
+    def signature(self, path):
+        row = self._document(path)
+        current = self._stat_signature(path)
+        if row is None or current != (row[3] and json.loads(row[3])):
+            self._import_if_changed(path)
+            row = self._document(path)
+        if row is None:
+            raise FileNotFoundError(path)
+        return ('sqlite', row[0])
+
+    def _document(self, path):
+        return self._connection().execute(
+            'SELECT revision, exported_revision, exported_hash, file_signature FROM documents WHERE path = ?',
+            (path,)
+        ).fetchone()
+
+    @staticmethod
+    def _stat_signature(path):
+        try:
+            return list(storage.stat_signature(path))
+        except FileNotFoundError:
+            return None
+
+    def _import_if_changed(self, path):
+        with storage.locked(path):
+            try:
+                with open(path, 'rb') as file:
+                    raw = file.read()
+            except FileNotFoundError:
+                if self._document(path) is not None:
+                    self._schedule_export([path])  # deleted outside the dashboard
+                return
+            signature = self._stat_signature(path)
+            digest = hashlib.sha256(raw).hexdigest()
+            connection = self._connection()
+            row = self._document(path)
+            if row is not None and row[2] == digest:
+                connection.execute('UPDATE documents SET file_signature = ? WHERE path = ?',
+                                   (json.dumps(signature), path))
+                return
+            data = storage.parse_yaml(raw)
+            with self._transaction() as connection:
+                revision = self._write(connection, path, data)
+                connection.execute(
+                    'UPDATE documents SET exported_revision = ?, exported_hash = ?, file_signature = ? '
+                    'WHERE path = ?',
+                    (revision, digest, json.dumps(signature), path)
+                )
+            storage.invalidate(path)
+
+    def load(self, path):
+        connection = self._connection()
+        row = connection.execute('SELECT header, row_keys FROM documents WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(path)
+        header, row_keys = decode(row[0]), json.loads(row[1])
+        if not row_keys:
+            return header
+        collections = {key: [] for key in row_keys}
+        for collection, body in connection.execute(
+                'SELECT collection, body FROM rows WHERE path = ? ORDER BY collection, position', (path,)):
+            collections[collection].append(decode(body))
+        return {key: collections[key] if key in collections else value for key, value in header.items()}
+
+    def save(self, documents):
+        """Store {path: data} in one transaction and schedule the YAML exports."""
+        with self._transaction() as connection:
+            for path, data in documents.items():
+                self._write(connection, path, data)
+        self._schedule_export(documents)
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _write(self, connection, path, data):
+        """Apply data to path's rows; return the document's resulting revision."""
+        keys = self.documents[path]
+        if isinstance(data, dict):
+            row_keys = [key for key in data if key in keys and isinstance(data[key], list)]
+            header = {key: None if key in row_keys else value for key, value in data.items()}
+            collections = {key: data[key] for key in row_keys}
+        else:
+            row_keys, header, collections = [], data, {}
+        header_text, row_keys_text = encode(header), json.dumps(row_keys)
+
+        row = connection.execute('SELECT revision, header, row_keys FROM documents WHERE path = ?',
+                                 (path,)).fetchone()
+        if row is None:
+            connection.execute(
+                'INSERT INTO documents (path, revision, header, row_keys) VALUES (?, 0, ?, ?)',
+                (path, header_text, row_keys_text)
+            )
+            revision, changed = 0, True
+        else:
+            revision, changed = row[0], (row[1], row[2]) != (header_text, row_keys_text)
+            if changed:
+                connection.execute('UPDATE documents SET header = ?, row_keys = ? WHERE path = ?',
+                                   (header_text, row_keys_text, path))
+
+        stored = {}
+        for row_id, collection, body in connection.execute(
+                'SELECT id, collection, body FROM rows WHERE path = ? ORDER BY collection, position', (path,)):
+            stored.setdefault(collection, []).append((row_id, body))
+        for collection in set(stored) | set(collections):
+            items = collections.get(collection, [])
+            if self._write_rows(connection, path, collection, stored.get(collection, []), items):
+                changed = True
+
+        if changed:
+            revision += 1
+            connection.execute('UPDATE documents SET revision = ? WHERE path = ?', (revision, path))
+        return revision
+
+    def _write_rows(self, connection, path, collection, stored, items):
+        """Turn the stored (id, body) rows into items with as few row changes as possible."""
+        bodies = [encode(item) for item in items]
+        old_bodies = [body for _, body in stored]
+        if bodies == old_bodies:
+            return False
+
+        def insert(position):
+            cursor = connection.execute(
+                'INSERT INTO rows (path, collection, position, date, body) VALUES (?, ?, ?, ?, ?)',
+                (path, collection, position, _row_date(items[position]), bodies[position])
+            )
+            self._write_materials(connection, cursor.lastrowid, items[position])
+
+        matcher = SequenceMatcher(None, old_bodies, bodies, autojunk=False)
+        for tag, old_start, old_end, start, end in matcher.get_opcodes():
+            if tag == 'equal':
+                if old_start != start:
+                    connection.executemany('UPDATE rows SET position = ? WHERE id = ?', [
+                        (start + offset, stored[old_start + offset][0]) for offset in range(end - start)
+                    ])
+                continue
+            paired = min(old_end - old_start, end - start)
+            for offset in range(paired):
+                row_id, position = stored[old_start + offset][0], start + offset
+                connection.execute('UPDATE rows SET position = ?, date = ?, body = ? WHERE id = ?',
+                                   (position, _row_date(items[position]), bodies[position], row_id))
+                connection.execute('DELETE FROM materials WHERE row_id = ?', (row_id,))
+                self._write_materials(connection, row_id, items[position])
+            connection.executemany('DELETE FROM rows WHERE id = ?', [
+                (row_id,) for row_id, _ in stored[old_start + paired:old_end]
+            ])
+            for position in range(start + paired, end):
+                insert(position)
+        return True
+
+    @staticmethod
+    def _write_materials(connection, row_id, item):
+        connection.executemany(
+            'INSERT INTO materials (row_id, position, name, url) VALUES (?, ?, ?, ?)',
+            [(row_id, position, name, url) for position, name, url in _row_materials(item)]
+        )
+
+    def _schedule_export(self, paths):
+        with self._lock:
+            self._pending.update(paths)
+            if self._exporter_pid != os.getpid():
+                self._exporter_pid = os.getpid()
+                threading.Thread(target=self._export_periodically, name='sqlite-export', daemon=True).start()
+        self._wake.set()
+
+    def _export_periodically(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.export_delay)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Export every document with a pending change now."""
+        with self._lock:
+            paths, self._pending = self._pending, set()
+        exported = set()
+        for path in sorted(paths):
+            try:
+                self.export(path)
+                exported.add(path)
+            except (OSError, sqlite3.Error) as error:
+                self.export_error = f'{path}: {error}'
+                with self._lock:
+                    self._pending.add(path)
+        if exported:
+            for listener in list(self._export_listeners):
+                try:
+                    listener(exported)
+                except Exception as error:
+                    self.export_error = str(error) or error.__class__.__name__
+
+    def add_export_listener(self, listener):
+        """Call listener(paths) after flush() has written the YAML files of paths."""
+        self._export_listeners.append(listener)
+
+    def export(self, path):
+        """Write path's YAML file from the database if it is out of date."""
+        with storage.locked(path):
+            row = self._document(path)
+            if row is None:
+                return
+            revision, exported_revision = row[0], row[1]
+            if exported_revision == revision and self._stat_signature(path) is not None:
+                return
+            signature = storage.write_yaml(path, self.load(path))
+            with open(path, 'rb') as file:
+                digest = hashlib.sha256(file.read()).hexdigest()
+            self._connection().execute(
+                'UPDATE documents SET exported_revision = ?, exported_hash = ?, file_signature = ? WHERE path = ?',
+                (revision, digest, json.dumps(list(signature)), path)
+            )
+
+    def reimport(self):
+        """Replace the database's copy of every file with the file's current contents."""
+        for path in self.documents:
+            with storage.locked(path):
+                self._connection().execute(
+                    'UPDATE documents SET exported_hash = NULL, file_signature = NULL WHERE path = ?', (path,)
+                )
+                self._import_if_changed(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move data between the SQLite database and the YAML files')
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('site_root', nargs='?',
+                        default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    options = parser.parse_args(argv)
+
+    db_path = os.environ.get('DASHBOARD_SQLITE_PATH') or os.path.join(options.site_root, '.dashboard.sqlite3')
+    store = SqliteStore(db_path, site_documents(os.path.join(options.site_root, '_data')))
+    store.open()
+    if options.command == 'import':
+        store.reimport()
+        print(f'Imported the data files into {db_path}')
+    else:
+        for path in store.documents:
+            store.export(path)
+        print(f'Exported {db_path} to the data files')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,477 @@
+"""
+YAML storage helpers for the dashboard.
+
+Parsed documents are cached per path and revalidated against the file's
+(mtime_ns, size, inode) signature, so repeated reads of an unchanged file
+do not parse YAML again. Callers always receive a private copy and are free
+to mutate it.
+
+YAML is parsed and written with libyaml's C loader and emitter when PyYAML
+was built with it, and with the pure-Python ones otherwise. After
+set_sidecar_dir(), every parsed document is also pickled into that
+directory under the SHA-256 of the file's bytes, so a new process loading
+an unchanged file unpickles it instead of parsing YAML. The sidecars are
+only a cache: the YAML files stay the source of truth, a sidecar is used
+only for the exact bytes it was made from, and the oldest ones are removed
+once there are more than SIDECAR_LIMIT.
+
+stats() counts cache hits, sidecar loads, YAML parses and saves since the
+process started, and listeners registered with add_io_listener are told how
+long each load and save of a file took.
+
+Listeners registered with add_save_listener are told about every save made
+through this module, which lets derived indexes update themselves in place.
+Hooks registered with add_save_hook see each document before it is written
+and may fill in missing values, such as the ids of entity_ids.py.
+
+add_engine() hands the paths an engine manages (see sqlite_store.py) over
+to it: load_yaml and save_yaml then read and write the engine,
+file_signature returns its revision of the document, and caching, listeners
+and locking work as they do for files. Each course site can have its own.
+
+Saves are atomic: the document is written to a temporary file in the same
+directory, fsynced and renamed over the original, so readers never see a
+half-written file. Read-modify-write cycles should hold locked(path), which
+takes an exclusive advisory lock shared by every worker process and thread.
+"""
+
+import copy
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import yaml
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+_cache = {}
+_cache_lock = threading.Lock()
+_save_listeners = []
+_save_hooks = []
+_io_listeners = []
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+_held = threading.local()
+_stats = {'hits': 0, 'sidecar_loads': 0, 'parses': 0, 'engine_loads': 0, 'saves': 0}
+_sidecar_dir = None
+_engines = []
+
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_Dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
+SIDECAR_LIMIT = 500
+# Part of every sidecar key, so a different loader never reuses another's output.
+_SIDECAR_VERSION = f'1:{yaml.__version__}:{_Loader.__name__}'.encode()
+# The only classes safe_load produces besides builtins.
+_SIDECAR_CLASSES = {('datetime', 'date'), ('datetime', 'datetime'), ('datetime', 'timedelta'), ('datetime', 'timezone')}
+
+
+def file_signature(path):
+    """Return what identifies the current version of path's document.
+
+    Raises FileNotFoundError if there is no such document.
+    """
+    engine = _engine_for(path)
+    if engine is not None:
+        return engine.signature(path)
+    return stat_signature(path)
+
+
+def stat_signature(path):
+    """Return the (mtime_ns, size, inode) of the file itself, managed or not."""
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _engine_for(path):
+    for engine in _engines:
+        if engine.manages(path):
+            return engine
+    return None
+
+
+def add_engine(engine):
+    """Route documents for which engine.manages(path) is true to engine.
+
+    The engine provides signature(path), load(path) and save({path: data}).
+    """
+    _engines.append(engine)
+    invalidate()
+
+
+def load_yaml(path):
+    """Return a copy of the parsed document at path.
+
+    Raises FileNotFoundError if the file does not exist.
+    """
+    start = time.perf_counter()
+    engine = _engine_for(path)
+    signature = file_signature(path)
+    size = None if engine is not None else signature[1]
+    with _cache_lock:
+        entry = _cache.get(path)
+    if entry is not None and entry[0] == signature:
+        with _cache_lock:
+            _stats['hits'] += 1
+        data = copy.deepcopy(entry[1])
+        _notify_io('hit', path, time.perf_counter() - start, size)
+        return data
+
+    if engine is not None:
+        data, source = engine.load(path), 'engine'
+    else:
+        with open(path, 'rb') as file:
+            raw = file.read()
+        data, source = _parse(raw)
+    with _cache_lock:
+        _cache[path] = (signature, data)
+        _stats[{'sidecar': 'sidecar_loads', 'engine': 'engine_loads'}.get(source, 'parses')] += 1
+    data = copy.deepcopy(data)
+    _notify_io(source, path, time.perf_counter() - start, size)
+    return data
+
+
+def parse_yaml(raw):
+    """Return the document in the YAML bytes raw, using a sidecar if there is one."""
+    return _parse(raw)[0]
+
+
+def _parse(raw):
+    """Return (data, 'sidecar' or 'parse') for the YAML document in raw."""
+    if _sidecar_dir is None:
+        return yaml.load(raw, Loader=_Loader), 'parse'
+    sidecar = os.path.join(_sidecar_dir, hashlib.sha256(_SIDECAR_VERSION + raw).hexdigest() + '.pickle')
+    try:
+        with open(sidecar, 'rb') as file:
+            data = _SidecarUnpickler(file).load()
+        os.utime(sidecar)  # keep recently used sidecars when pruning
+        return data, 'sidecar'
+    except FileNotFoundError:
+        pass
+    except Exception:
+        _remove_quietly(sidecar)  # unreadable or from an incompatible version
+
+    data = yaml.load(raw, Loader=_Loader)
+    _write_sidecar(sidecar, data)
+    return data, 'parse'
+
+
+class _SidecarUnpickler(pickle.Unpickler):
+
+    def find_class(self, module, name):
+        if (module, name) not in _SIDECAR_CLASSES:
+            raise pickle.UnpicklingError(f'{module}.{name} is not allowed in a sidecar')
+        return super().find_class(module, name)
+
+
+def _write_sidecar(sidecar, data):
+    buffer = io.BytesIO()
+    try:
+        pickle.dump(data, buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs(_sidecar_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=_sidecar_dir, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(buffer.getvalue())
+            os.replace(temp_path, sidecar)
+        except BaseException:
+            _remove_quietly(temp_path)
+            raise
+        _prune_sidecars()
+    except (OSError, pickle.PicklingError):
+        pass  # the cache is optional; the YAML was parsed all the same
+
+
+def _prune_sidecars():
+    entries = []
+    with os.scandir(_sidecar_dir) as scan:
+        for entry in scan:
+            if entry.name.endswith('.pickle'):
+                try:
+                    entries.append((entry.stat().st_mtime_ns, entry.path))
+                except FileNotFoundError:
+                    pass
+    if len(entries) > SIDECAR_LIMIT:
+        entries.sort()
+        for _, path in entries[:len(entries) - SIDECAR_LIMIT]:
+            _remove_quietly(path)
+
+
+def set_sidecar_dir(directory):
+    """Keep pickled copies of parsed documents in directory; None turns them off."""
+    global _sidecar_dir
+    _sidecar_dir = directory
+
+
+def clear_sidecars():
+    """Remove every sidecar, so the next cold load of each file parses YAML."""
+    if _sidecar_dir is None:
+        return
+    try:
+        names = os.listdir(_sidecar_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.endswith('.pickle'):
+            _remove_quietly(os.path.join(_sidecar_dir, name))
+
+
+def _dump(data):
+    return yaml.dump(data, Dumper=_Dumper, default_flow_style=False, allow_unicode=True, sort_keys=False)
+
+
+def _signature_or_none(path):
+    try:
+        return file_signature(path)
+    except FileNotFoundError:
+        return None
+
+
+def _saved(path, data, previous_signature, seconds):
+    invalidate(path)
+    with _cache_lock:
+        _stats['saves'] += 1
+    signature = file_signature(path)
+    _notify_io('save', path, seconds, 0 if _engine_for(path) is not None else signature[1])
+    for listener in list(_save_listeners):
+        listener(path, data, previous_signature, signature)
+
+
+def _notify_io(operation, path, seconds, size):
+    for listener in list(_io_listeners):
+        listener(operation, path, seconds, size)
+
+
+def _prepare(path, data):
+    for hook in list(_save_hooks):
+        hook(path, data)
+
+
+def save_yaml(path, data):
+    _prepare(path, data)
+    start = time.perf_counter()
+    previous_signature = _signature_or_none(path)
+    engine = _engine_for(path)
+    if engine is not None:
+        engine.save({path: data})
+    else:
+        atomic_write(path, _dump(data))
+    _saved(path, data, previous_signature, time.perf_counter() - start)
+
+
+def write_yaml(path, data):
+    """Atomically write data to the file at path, bypassing engines, caches and listeners.
+
+    Returns the stat_signature of the written file.
+    """
+    atomic_write(path, _dump(data))
+    return stat_signature(path)
+
+
+def save_yaml_many(documents):
+    """Save several {path: data} documents, staging all of them before replacing any.
+
+    Every document is serialized and written to its temporary file, and the
+    documents managed by an engine are saved in one transaction per engine,
+    before the first file is renamed into place, so a serialization or disk
+    error while staging leaves all originals untouched. The renames that
+    follow are not atomic together: if one of them fails, the engine
+    documents and the files renamed before it keep their new contents.
+    Callers should hold locked() on all paths.
+    """
+    for path, data in documents.items():
+        _prepare(path, data)
+    previous_signatures = {path: _signature_or_none(path) for path in documents}
+    managed = {}
+    for path, data in documents.items():
+        engine = _engine_for(path)
+        if engine is not None:
+            managed.setdefault(engine, {})[path] = data
+    managed_paths = {path for engine_documents in managed.values() for path in engine_documents}
+    staged = []
+    durations = {}
+    try:
+        for path, data in documents.items():
+            if path in managed_paths:
+                continue
+            start = time.perf_counter()
+            staged.append(_stage(path, _dump(data)))
+            durations[path] = time.perf_counter() - start
+        for engine, engine_documents in managed.items():
+            start = time.perf_counter()
+            engine.save(engine_documents)
+            for path in engine_documents:
+                durations[path] = (time.perf_counter() - start) / len(engine_documents)
+    except BaseException:
+        for temp_path, _ in staged:
+            _remove_quietly(temp_path)
+        raise
+
+    for temp_path, target in staged:
+        os.replace(temp_path, target)
+    for directory in {os.path.dirname(target) for _, target in staged}:
+        _fsync_directory(directory)
+    for path, data in documents.items():
+        _saved(path, data, previous_signatures[path], durations[path])
+
+
+def stats():
+    """Return a copy of the hit, sidecar load, parse, engine load and save counters."""
+    with _cache_lock:
+        return dict(_stats)
+
+
+def add_save_listener(listener):
+    """Call listener(path, data, previous_signature, signature) after each save."""
+    _save_listeners.append(listener)
+
+
+def add_save_hook(hook):
+    """Call hook(path, data) before each save; it may change data in place."""
+    _save_hooks.append(hook)
+
+
+def add_io_listener(listener):
+    """Call listener(operation, path, seconds, size) after each load and save.
+
+    operation is 'hit' for a load served from the cache, 'sidecar' for one
+    answered by a sidecar, 'parse' for one that parsed the YAML, 'engine'
+    for one read from the storage engine and 'save' for a write. size is
+    the file size, or None for loads and 0 for saves of documents managed
+    by an engine.
+    """
+    _io_listeners.append(listener)
+
+
+def atomic_write(path, text):
+    temp_path, target = _stage(path, text)
+    try:
+        os.replace(temp_path, target)
+    except BaseException:
+        _remove_quietly(temp_path)
+        raise
+    _fsync_directory(os.path.dirname(target))
+
+
+def _stage(path, text):
+    """Write text to a synced temporary file next to path; return (temp_path, target)."""
+    target = os.path.realpath(path)
+    directory = os.path.dirname(target)
+    try:
+        mode = os.stat(target).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(target)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp_path, mode)
+    except BaseException:
+        _remove_quietly(temp_path)
+        raise
+    return temp_path, target
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _fsync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def lock_path(path):
+    target = os.path.realpath(path)
+    return os.path.join(os.path.dirname(target), f'.{os.path.basename(target)}.lock')
+
+
+@contextmanager
+def locked(*paths):
+    """Hold exclusive locks on paths for the duration of the block.
+
+    Locks are reentrant within a thread. The paths of one call are taken in
+    sorted order, so two single calls with overlapping paths cannot deadlock
+    each other. A nested call is only ordered within itself: holding B and
+    then taking A can deadlock against another thread that takes A and then
+    B. Code that nests calls must always nest them in the same order: the
+    data files first, then the files derived from them, such as the
+    compiled schedule.
+    """
+    held = getattr(_held, 'counts', None)
+    if held is None:
+        held = _held.counts = {}
+
+    acquired = []
+    try:
+        for target in sorted({os.path.realpath(path) for path in paths}):
+            if target in held:
+                held[target][0] += 1
+            else:
+                held[target] = [1, _acquire(target)]
+            acquired.append(target)
+        yield
+    finally:
+        for target in reversed(acquired):
+            entry = held[target]
+            entry[0] -= 1
+            if entry[0] == 0:
+                del held[target]
+                _release(target, entry[1])
+
+
+def _acquire(target):
+    with _path_locks_guard:
+        thread_lock = _path_locks.setdefault(target, threading.Lock())
+    thread_lock.acquire()
+    if fcntl is None:
+        return None
+    fd = None
+    try:
+        fd = os.open(lock_path(target), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        thread_lock.release()
+        raise
+    return fd
+
+
+def _release(target, fd):
+    if fd is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+    _path_locks[target].release()
+
+
+def invalidate(path=None):
+    with _cache_lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(path, None)
@@ -0,0 +1,157 @@
+"""
+Generates synthetic course sites for benchmarking the dashboard.
+
+A generated tree has the layout the dashboard expects (_config.yml, the
+_data files and static_files/uploads) filled with made-up content at a
+chosen scale: the lecture sequence, additional events, the materials they
+link and the upload folder. Materials point at uploaded files through the
+site's public URL, so material usage lookups find real matches.
+
+Uploads are small placeholder files. PDFs are left out by default because
+listing them starts background metadata extraction, which would compete
+with the code being timed; --pdf-share includes some anyway.
+
+    python synthetic_site.py /tmp/big-course --lectures 400 --uploads 30000
+"""
+
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+import yaml
+
+SITE_URL = 'https://example.edu'
+BASE_URL = '/course'
+EVENT_TYPES = ['homework', 'homework_due', 'project', 'project_due', 'exam', 'presentation']
+OTHER_EXTENSIONS = ['pptx', 'docx', 'txt']
+
+DEFAULT_SCALE = {
+    'lectures': 300,
+    'events': 3000,
+    'materials': 3,
+    'uploads': 20000,
+}
+
+
+def _write_yaml(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        yaml.dump(data, file, default_flow_style=False, allow_unicode=True, sort_keys=False)
+
+
+def upload_names(count, pdf_share, rng):
+    names = []
+    for index in range(count):
+        extension = 'pdf' if rng.random() < pdf_share else rng.choice(OTHER_EXTENSIONS)
+        names.append(f'material_{index:06d}.{extension}')
+    return names
+
+
+def generate_site(target, lectures=300, events=3000, materials=3, uploads=20000, pdf_share=0.0, seed=0):
+    """Write a synthetic site to target and return a summary of what it holds."""
+    rng = random.Random(seed)
+    names = upload_names(uploads, pdf_share, rng)
+
+    def material_list():
+        if not names:
+            return []
+        return [
+            {'name': name, 'url': f'{SITE_URL}{BASE_URL}/static_files/uploads/{name}'}
+            for name in rng.sample(names, min(materials, len(names)))
+        ]
+
+    semester_start = date(2026, 1, 5)
+    _write_yaml(os.path.join(target, '_config.yml'), {
+        'course_name': 'Synthetic Course',
+        'course_semester': 'Spring 2026',
+        'baseurl': BASE_URL,
+        'url': SITE_URL,
+    })
+    _write_yaml(os.path.join(target, '_data', 'course_schedule.yml'), {
+        'course_schedule': {
+            'semester_start': str(semester_start),
+            'semester_end': str(semester_start + timedelta(days=364)),
+            'class_days': [{'day': day, 'time': '10:00'} for day in ('monday', 'wednesday', 'friday')],
+            'holidays': [str(semester_start + timedelta(days=offset)) for offset in range(70, 365, 91)],
+        },
+        'lecture_sequence': [
+            {'topic': f'Lecture topic {index + 1}', 'materials': material_list()}
+            for index in range(lectures)
+        ],
+    })
+    _write_yaml(os.path.join(target, '_data', 'additional_events.yml'), {
+        'additional_events': [
+            {
+                'date': str(semester_start + timedelta(days=rng.randrange(365))),
+                'type': rng.choice(EVENT_TYPES),
+                'topic': f'Event {index + 1}',
+                'materials': material_list(),
+            }
+            for index in range(events)
+        ],
+    })
+    _write_yaml(os.path.join(target, '_data', 'home_modules.yml'), {
+        'modules': [
+            {'type': 'markdown', 'title': f'Section {index + 1}', 'body': 'Lorem ipsum ' * 40}
+            for index in range(10)
+        ] + [{'type': 'people', 'title': 'Staff', 'body': ''}],
+    })
+    _write_yaml(os.path.join(target, '_data', 'assignments.yml'), {
+        'intro': 'Synthetic assignments.',
+        'assignments': [
+            {'title': f'Assignment {index + 1}', 'link': '', 'description': 'Do the work.'}
+            for index in range(20)
+        ],
+    })
+    _write_yaml(os.path.join(target, '_data', 'textbooks.yml'), {
+        'textbooks': [{'title': f'Textbook {index + 1}', 'author': 'Author', 'cover_image': ''} for index in range(5)],
+    })
+    _write_yaml(os.path.join(target, '_data', 'people.yml'), {
+        'instructors': [{'name': 'Instructor', 'title': 'Professor', 'email': 'instructor@example.edu'}],
+        'teaching_assistants': [{'name': f'TA {index + 1}', 'email': f'ta{index + 1}@example.edu'} for index in range(8)],
+    })
+
+    upload_dir = os.path.join(target, 'static_files', 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+    for name in names:
+        with open(os.path.join(upload_dir, name), 'wb') as file:
+            file.write(rng.randbytes(rng.randrange(64, 512)))
+    for directory in ('_images/pp', '_images/textbook'):
+        os.makedirs(os.path.join(target, directory), exist_ok=True)
+
+    return {
+        'lectures': lectures,
+        'events': events,
+        'materials': materials,
+        'uploads': uploads,
+        'pdf_share': pdf_share,
+        'seed': seed,
+    }
+
+
+def add_scale_arguments(parser):
+    parser.add_argument('--lectures', type=int, default=DEFAULT_SCALE['lectures'], help='Lectures in the sequence')
+    parser.add_argument('--events', type=int, default=DEFAULT_SCALE['events'], help='Additional events')
+    parser.add_argument('--materials', type=int, default=DEFAULT_SCALE['materials'], help='Materials per lecture and event')
+    parser.add_argument('--uploads', type=int, default=DEFAULT_SCALE['uploads'], help='Files in static_files/uploads')
+    parser.add_argument('--pdf-share', type=float, default=0.0, help='Fraction of uploads that are PDFs')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic course site')
+    parser.add_argument('target', help='Directory to create the site in')
+    add_scale_arguments(parser)
+    options = parser.parse_args(argv)
+    if os.path.exists(options.target) and os.listdir(options.target):
+        parser.error(f'{options.target} is not empty')
+    summary = generate_site(
+        options.target, options.lectures, options.events, options.materials,
+        options.uploads, options.pdf_share, options.seed
+    )
+    print(f'Generated {options.target}: ' + ', '.join(f'{key}={value}' for key, value in summary.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""
+Resumable chunked uploads.
+
+An upload session lives in the hidden .partial directory inside the upload
+folder: <id>.json records the target filename and declared size, <id>.part
+holds the bytes received so far. Chunks are appended at an explicit offset,
+so a client that lost its connection asks for the current offset and carries
+on from there. Finishing a session is a rename within the same filesystem.
+
+Chunks are copied from the request stream in fixed-size pieces and hashed as
+they arrive, so memory use does not depend on the file size.
+
+Writing a chunk, finishing and aborting each hold an exclusive flock on the
+part file, so they run one at a time per session across worker processes.
+Each reads the session again once it has the lock, so a retried finish, or
+a chunk arriving after an abort, finds the session gone and answers 404.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent writes to one session are not guarded
+    fcntl = None
+
+PARTIAL_DIRNAME = '.partial'
+COPY_BUFFER_SIZE = 1024 * 1024
+SESSION_MAX_AGE = 24 * 60 * 60
+
+_UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# upload_id -> (offset, sha256 of the first offset bytes). Kept per process;
+# when a chunk lands on a different worker the digest is recomputed from the
+# part file at finish time instead.
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.offset = offset
+
+
+def partial_dir(upload_dir):
+    return os.path.join(upload_dir, PARTIAL_DIRNAME)
+
+
+def _session_paths(upload_dir, upload_id):
+    if not upload_id or not _UPLOAD_ID_PATTERN.match(upload_id):
+        raise UploadError('Upload not found', 404)
+    base = os.path.join(partial_dir(upload_dir), upload_id)
+    return base + '.json', base + '.part'
+
+
+def _read_session(upload_dir, upload_id):
+    state_path, part_path = _session_paths(upload_dir, upload_id)
+    try:
+        with open(state_path, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        raise UploadError('Upload not found', 404)
+    return state, state_path, part_path
+
+
+@contextmanager
+def _locked_session(upload_dir, upload_id):
+    """Hold the lock of a session; yields (state, state_path, part_path, open part file)."""
+    state_path, part_path = _session_paths(upload_dir, upload_id)
+    try:
+        file = open(part_path, 'r+b')
+    except FileNotFoundError:
+        raise UploadError('Upload not found', 404)
+    with file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        # Finished or aborted while this call waited for the lock.
+        state, _, _ = _read_session(upload_dir, upload_id)
+        if os.fstat(file.fileno()).st_ino != _inode(part_path):
+            raise UploadError('Upload not found', 404)
+        yield state, state_path, part_path, file
+
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def start_upload(upload_dir, filename, size=None):
+    directory = partial_dir(upload_dir)
+    os.makedirs(directory, exist_ok=True)
+    cleanup_stale_uploads(upload_dir)
+
+    upload_id = uuid4().hex
+    state_path, part_path = _session_paths(upload_dir, upload_id)
+    open(part_path, 'wb').close()
+    with open(state_path, 'w', encoding='utf-8') as file:
+        json.dump({'filename': filename, 'size': size, 'created_at': time.time()}, file)
+
+    with _hashers_lock:
+        _hashers[upload_id] = (0, hashlib.sha256())
+    return {'upload_id': upload_id, 'filename': filename, 'size': size, 'offset': 0}
+
+
+def upload_status(upload_dir, upload_id):
+    state, _, part_path = _read_session(upload_dir, upload_id)
+    try:
+        offset = os.path.getsize(part_path)
+    except FileNotFoundError:
+        raise UploadError('Upload not found', 404)
+    return {
+        'upload_id': upload_id,
+        'filename': state['filename'],
+        'size': state.get('size'),
+        'offset': offset
+    }
+
+
+def write_chunk(upload_dir, upload_id, offset, stream):
+    """Append stream at offset and return the new offset.
+
+    offset must equal the number of bytes already received; otherwise an
+    UploadError with status 409 carries the offset the client should resume
+    from.
+    """
+    with _locked_session(upload_dir, upload_id) as (state, state_path, part_path, file):
+        size = state.get('size')
+        current = os.fstat(file.fileno()).st_size
+        if offset != current:
+            raise UploadError('Offset does not match the data received so far', 409, offset=current)
+
+        with _hashers_lock:
+            entry = _hashers.pop(upload_id, None)
+        hasher = entry[1] if entry is not None and entry[0] == current else None
+
+        file.seek(current)
+        written = 0
+        try:
+            while True:
+                chunk = stream.read(COPY_BUFFER_SIZE)
+                if not chunk:
+                    break
+                if size is not None and current + written + len(chunk) > size:
+                    file.truncate(current + written)
+                    raise UploadError('Chunk exceeds the declared file size', 413, offset=current + written)
+                file.write(chunk)
+                written += len(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+        finally:
+            file.flush()
+            os.fsync(file.fileno())
+            if hasher is not None and os.fstat(file.fileno()).st_size == current + written:
+                with _hashers_lock:
+                    _hashers[upload_id] = (current + written, hasher)
+
+        os.utime(state_path)
+    return current + written
+
+
+def new_temp_path(upload_dir):
+    directory = partial_dir(upload_dir)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f'{uuid4().hex}.tmp')
+
+
+def finish_upload(upload_dir, upload_id, store):
+    """Hand the completed part file to store(part_path, sha256) and close the session.
+
+    store must move the part file away. Returns the size and SHA-256 merged
+    with whatever store returns.
+    """
+    with _locked_session(upload_dir, upload_id) as (state, state_path, part_path, file):
+        received = os.fstat(file.fileno()).st_size
+        size = state.get('size')
+        if size is not None and received != size:
+            raise UploadError(f'Upload incomplete: received {received} of {size} bytes', 409, offset=received)
+
+        with _hashers_lock:
+            entry = _hashers.pop(upload_id, None)
+        if entry is not None and entry[0] == received:
+            digest = entry[1].hexdigest()
+        else:
+            digest = file_sha256(part_path)
+
+        os.chmod(part_path, 0o644)
+        result = store(part_path, digest) or {}
+        # Still under the lock, so a retry waiting for it finds no session.
+        _remove_quietly(state_path)
+    return {'size': received, 'sha256': digest, **result}
+
+
+def abort_upload(upload_dir, upload_id):
+    with _locked_session(upload_dir, upload_id) as (_, state_path, part_path, _file):
+        with _hashers_lock:
+            _hashers.pop(upload_id, None)
+        _remove_quietly(part_path)
+        _remove_quietly(state_path)
+
+
+def cleanup_stale_uploads(upload_dir, max_age=SESSION_MAX_AGE):
+    directory = partial_dir(upload_dir)
+    cutoff = time.time() - max_age
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                _remove_quietly(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(COPY_BUFFER_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,67 @@
+"""
+Public URL handling for course materials.
+
+A UrlContext is compiled once from the url/baseurl settings in _config.yml.
+Its methods are plain string operations, so they are safe to call inside
+loops over every lecture, event and uploaded file.
+"""
+
+
+class UrlContext:
+    """Immutable snapshot of the site's public URL settings."""
+
+    __slots__ = ('root', 'base_path', 'base', '_normalized_base')
+
+    def __init__(self, config):
+        config = config or {}
+        root = (config.get('url') or '').rstrip('/')
+        base_path = (config.get('baseurl') or '').strip()
+        if base_path and not base_path.startswith('/'):
+            base_path = '/' + base_path
+        base = f"{root}{base_path}" if root else base_path
+
+        object.__setattr__(self, 'root', root)
+        object.__setattr__(self, 'base_path', base_path)
+        object.__setattr__(self, 'base', base)
+        object.__setattr__(self, '_normalized_base', base.rstrip('/'))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('UrlContext is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('UrlContext is immutable')
+
+    def __repr__(self):
+        return f'UrlContext(root={self.root!r}, base_path={self.base_path!r})'
+
+    def public_url(self, relative_path):
+        rel = relative_path if relative_path.startswith('/') else '/' + relative_path
+        return f"{self.base}{rel}"
+
+    def url_variants(self, relative_path):
+        variants = {relative_path, self.public_url(relative_path)}
+        if self.root:
+            variants.add(f"{self.root}{relative_path}")
+        return {variant for variant in variants if variant}
+
+    def normalize(self, raw_url):
+        if not raw_url:
+            return raw_url
+        url = raw_url.strip()
+        public_base = self._normalized_base
+        public_root = self.root
+        if url.startswith('http://') or url.startswith('https://'):
+            if public_base and public_root and url.startswith(public_root) and not url.startswith(public_base):
+                rel = url[len(public_root):]
+                if not rel.startswith('/'):
+                    rel = '/' + rel
+                return f"{public_base}{rel}"
+            return url
+        if url.startswith('/static_files/') or url.startswith('static_files/'):
+            rel = url if url.startswith('/') else f"/{url}"
+            return f"{public_base}{rel}" if public_base else rel
+        return url
+
+    def normalize_all(self, raw_urls):
+        normalize = self.normalize
+        return [normalize(url) for url in raw_urls]
@@ -0,0 +1,145 @@
+"""
+Reverse index from material URL to the lectures and events that link it.
+
+Every lecture or event is reduced to a source tuple (type, label, urls).
+Usages are counted per source, so when a data file is saved the index can
+diff the old and new sources as multisets and touch only the entries that
+actually changed. When a file changes without going through the dashboard,
+or the public URL settings change, the index rebuilds itself from disk on
+the next lookup.
+"""
+
+import threading
+from collections import Counter
+
+import storage
+
+
+class MaterialUsageIndex:
+
+    def __init__(self, extractors, load, get_url_context):
+        """
+        extractors maps a data file path to a function that turns the parsed
+        document into a list of source tuples. load(path) returns the parsed
+        document, and get_url_context() the current UrlContext.
+        """
+        self._extractors = extractors
+        self._load = load
+        self._get_url_context = get_url_context
+        self._lock = threading.RLock()
+        self._url_context = None
+        self._signatures = None
+        self._sources = {}
+        self._usages = {}
+        # Lookups answered from the index as it stood, and full rebuilds.
+        self.hits = 0
+        self.rebuilds = 0
+        storage.add_save_listener(self._on_save)
+
+    def lookup(self, variants, refresh=True):
+        """Return the usages recorded for any of the given URL variants."""
+        with self._lock:
+            if refresh:
+                self._refresh()
+            usages = []
+            for variant in variants:
+                usages.extend(dict(usage) for usage in self._usages.get(variant, ()))
+            return usages
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def rebuild(self):
+        with self._lock:
+            self._rebuild(self._get_url_context())
+
+    def snapshot(self):
+        with self._lock:
+            self._refresh()
+            return {
+                url: [dict(usage) for usage in usages]
+                for url, usages in self._usages.items()
+            }
+
+    def _current_signatures(self):
+        signatures = {}
+        for path in self._extractors:
+            try:
+                signatures[path] = storage.file_signature(path)
+            except FileNotFoundError:
+                signatures[path] = None
+        return signatures
+
+    def _refresh(self):
+        url_context = self._get_url_context()
+        if url_context is not self._url_context or self._signatures != self._current_signatures():
+            self._rebuild(url_context)
+        else:
+            self.hits += 1
+
+    def _rebuild(self, url_context):
+        self.rebuilds += 1
+        self._url_context = url_context
+        self._signatures = self._current_signatures()
+        self._sources = {}
+        self._usages = {}
+        for path, extract in self._extractors.items():
+            try:
+                data = self._load(path)
+            except FileNotFoundError:
+                data = None
+            sources = Counter(extract(data or {}))
+            self._sources[path] = sources
+            for source in sources.elements():
+                self._add(source)
+
+    def _on_save(self, path, data, previous_signature, signature):
+        extract = self._extractors.get(path)
+        if extract is None:
+            return
+        with self._lock:
+            if self._signatures is None:
+                return
+            if (self._signatures.get(path) != previous_signature
+                    or self._url_context is not self._get_url_context()):
+                self._signatures = None
+                return
+
+            old_sources = self._sources.get(path, Counter())
+            new_sources = Counter(extract(data or {}))
+            for source in (old_sources - new_sources).elements():
+                self._remove(source)
+            for source in (new_sources - old_sources).elements():
+                self._add(source)
+            self._sources[path] = new_sources
+            self._signatures[path] = signature
+
+    def _grouped(self, source):
+        kind, label, urls = source
+        grouped = {}
+        for normalized in self._url_context.normalize_all(urls):
+            if not normalized:
+                continue
+            grouped[normalized] = grouped.get(normalized, 0) + 1
+        return kind, label, grouped
+
+    def _add(self, source):
+        kind, label, grouped = self._grouped(source)
+        for normalized, count in grouped.items():
+            self._usages.setdefault(normalized, []).append({
+                'type': kind,
+                'label': label,
+                'count': count
+            })
+
+    def _remove(self, source):
+        kind, label, grouped = self._grouped(source)
+        for normalized, count in grouped.items():
+            usages = self._usages.get(normalized, [])
+            for position, usage in enumerate(usages):
+                if usage['type'] == kind and usage['label'] == label and usage['count'] == count:
+                    usages.pop(position)
+                    break
+            if not usages:
+                self._usages.pop(normalized, None)